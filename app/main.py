@@ -1,11 +1,12 @@
 from fastapi import FastAPI, HTTPException, Request, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
+from contextlib import asynccontextmanager
 import uvicorn
 import json
 import os
@@ -29,28 +30,35 @@ logger.add(
 # Thêm thư mục gốc vào PYTHONPATH
 sys.path.append(str(Path(__file__).parent.parent))
 
-from app.services.llm_service import LLMService
-from app.services.post_analysis_service import PostAnalysisService
-from app.services.search_service import SearchService
+from app.services.container import ServiceContainer
 
 # Khởi tạo rate limiter
 limiter = Limiter(key_func=get_remote_address)
 
+# Các service dùng chung được tạo lười biếng, lần đầu được dùng hoặc khi warm-up
+services = ServiceContainer()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Khởi tạo HTTP client dùng chung và warm-up nền (chỉ mục RAG, tác vụ cập nhật
+    cơ sở tri thức); dừng tác vụ nền và đóng HTTP client khi ứng dụng tắt
+    """
+    await services.startup()
+    yield
+    await services.shutdown()
+
 app = FastAPI(
     title="Facebook RAG Chatbot API",
     description="API cho chatbot RAG về Facebook",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Xử lý rate limit exceeded
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# Khởi tạo các service
-llm_service = LLMService()
-post_analysis_service = PostAnalysisService()
-search_service = SearchService()
-
 # Thêm Gzip compression
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
@@ -85,7 +93,10 @@ async def root(request: Request):
                 "/chat-ui": "Giao diện chat với bot",
                 "/docs": "API documentation",
                 "/chat": "API gửi câu hỏi cho chatbot",
+                "/chat/stream": "API gửi câu hỏi và nhận câu trả lời dạng stream (SSE)",
+                "/health": "Trạng thái sẵn sàng của ứng dụng",
                 "/analyze-post": "Phân tích bài đăng Facebook",
+                "/analyze-posts": "Phân tích hàng loạt bài đăng Facebook (NDJSON)",
                 "/search": "Tìm kiếm thông tin"
             }
         }
@@ -108,11 +119,19 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[str]
+    source_ids: List[str] = []
 
 class PostAnalysisRequest(BaseModel):
     post_url: str
     post_content: Optional[str] = None
 
+class BulkPostItem(BaseModel):
+    post_url: Optional[str] = None
+    post_content: Optional[str] = None
+
+class BulkPostAnalysisRequest(BaseModel):
+    posts: List[BulkPostItem] = Field(..., min_length=1, max_length=500)
+
 class PostAnalysisResponse(BaseModel):
     analysis: str
     sentiment: str
@@ -129,16 +148,96 @@ async def chat(
     """
     try:
         logger.info(f"Chat request from {request.client.host}: {chat_request.question}")
-        result = await llm_service.get_completion(chat_request.question)
+        result = await services.rag_service.answer(chat_request.question)
         logger.info(f"Chat response: {result['answer'][:100]}...")
         return ChatResponse(
             answer=result["answer"],
-            sources=result["sources"]
+            sources=result["sources"],
+            source_ids=result["source_ids"]
         )
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    """
+    Định dạng một sự kiện Server-Sent Events
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+@limiter.limit("30/minute")
+async def chat_stream(
+    request: Request,
+    chat_request: ChatRequest
+):
+    """
+    Endpoint trả lời câu hỏi dạng stream (Server-Sent Events), gửi từng token ngay khi model sinh ra
+    """
+    logger.info(f"Chat stream request from {request.client.host}: {chat_request.question}")
+
+    async def event_generator():
+        answer_length = 0
+        try:
+            stream, sources, source_ids = await services.rag_service.stream_answer(chat_request.question)
+            try:
+                async for delta in stream:
+                    # Dừng stream khi client đã ngắt kết nối
+                    if await request.is_disconnected():
+                        logger.info(f"Client {request.client.host} disconnected, cancelling stream")
+                        return
+                    answer_length += len(delta)
+                    yield _sse_event({"delta": delta})
+            finally:
+                # Đóng generator để hủy ngay request upstream tới OpenRouter
+                await stream.aclose()
+            yield _sse_event({"sources": sources, "source_ids": source_ids}, event="done")
+            logger.info(f"Chat stream completed: {answer_length} characters")
+        except Exception as e:
+            logger.error(f"Error in chat stream endpoint: {str(e)}")
+            yield _sse_event({"detail": str(e)}, event="error")
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            # Bỏ qua GZipMiddleware để token không bị gom lại trong buffer nén
+            "Content-Encoding": "identity"
+        }
+    )
+
+@app.get("/api/stats")
+@limiter.limit("50/minute")
+async def stats(request: Request):
+    """
+    Thống kê hit/miss của các cache, số token của các prompt đã gửi và định tuyến model
+    """
+    return {
+        "answer_cache": services.rag_service.answer_cache.stats(),
+        "retrieve_cache": services.rag_service.retrieve_cache.stats(),
+        "retrieve_batches": services.rag_service.retrieve_batcher.stats(),
+        "analysis_cache": services.analysis_cache.stats(),
+        "token_usage": {
+            "llm": services.llm_service.token_usage.stats(),
+            "deepseek": services.deepseek_service.token_usage.stats()
+        },
+        "model_routing": {
+            "llm": services.llm_service.router.stats(),
+            "deepseek": services.deepseek_service.router.stats()
+        }
+    }
+
+@app.get("/health")
+async def health():
+    """
+    Trạng thái sẵn sàng (readiness): 200 khi các service đã warm-up xong, 503 nếu chưa
+    """
+    status = services.health()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.get("/analyze-post", response_class=HTMLResponse)
 @limiter.limit("100/minute")
 async def analyze_post_page(request: Request):
@@ -159,7 +258,7 @@ async def analyze_post(
     """
     try:
         logger.info(f"Analyze post request from {request.client.host}: {analysis_request.post_url}")
-        result = await post_analysis_service.analyze_post(
+        result = await services.post_analysis_service.analyze_post(
             analysis_request.post_url,
             analysis_request.post_content
         )
@@ -168,6 +267,36 @@ async def analyze_post(
         logger.error(f"Error in analyze post endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze-posts")
+@limiter.limit("5/minute")
+async def analyze_posts(
+    request: Request,
+    bulk_request: BulkPostAnalysisRequest
+):
+    """
+    Endpoint phân tích hàng loạt bài đăng, trả về từng kết quả dạng NDJSON ngay khi hoàn thành
+    """
+    logger.info(f"Bulk analyze request from {request.client.host}: {len(bulk_request.posts)} posts")
+
+    async def result_generator():
+        results = services.post_analysis_service.analyze_posts(
+            [post.model_dump() for post in bulk_request.posts]
+        )
+        try:
+            async for result in results:
+                if await request.is_disconnected():
+                    logger.info(f"Client {request.client.host} disconnected, cancelling bulk analysis")
+                    return
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            await results.aclose()
+
+    return StreamingResponse(
+        result_generator(),
+        media_type="application/x-ndjson",
+        headers={"Content-Encoding": "identity"}
+    )
+
 @app.get("/search", response_class=HTMLResponse)
 @limiter.limit("50/minute")
 async def search_page(request: Request):
@@ -188,7 +317,7 @@ async def search(
     """
     try:
         logger.info(f"Search request from {request.client.host}: {q}")
-        results = await search_service.search(q)
+        results = await services.search_service.search(q)
         return {"results": results}
     except Exception as e:
         logger.error(f"Error in search endpoint: {str(e)}")
@@ -0,0 +1,142 @@
+from array import array
+from pathlib import Path
+from typing import Iterator, Optional, Union
+import mmap
+import os
+import numpy as np
+from app.utils.file_utils import atomic_path
+
+# Tên các file của kho văn bản trên đĩa: văn bản {name}.bin, bảng offset {name}.offsets.npy
+DEFAULT_NAME = "documents"
+TEXT_SUFFIX = ".bin"
+OFFSETS_SUFFIX = ".offsets.npy"
+
+# Độ dài -1 đánh dấu vector ID không có (đã xóa hoặc chưa dùng)
+MISSING_LENGTH = -1
+
+class DocumentStore:
+    def __init__(self):
+        """
+        Kho văn bản chỉ ghi thêm: văn bản UTF-8 của mọi đoạn nằm liền trong một buffer,
+        mỗi vector ID có một cặp (vị trí bắt đầu, độ dài byte) trong hai mảng int64.
+        Khi nạp bằng mmap, buffer và bảng offset được ánh xạ từ file chỉ đọc nên các
+        worker dùng chung page cache thay vì mỗi tiến trình giữ một bản sao str Python.
+        Ghi đè hoặc xóa chỉ đánh dấu lại offset; phần byte cũ được dọn khi save.
+        """
+        self._buffer: Union[bytearray, mmap.mmap, bytes] = bytearray()
+        self._starts = array("q")
+        self._lengths = array("q")
+        self._count = 0
+        self.read_only = False
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, vector_id: int) -> bool:
+        return 0 <= vector_id < len(self._lengths) and self._lengths[vector_id] != MISSING_LENGTH
+
+    def __iter__(self) -> Iterator[int]:
+        lengths = np.asarray(self._lengths)
+        return iter(np.flatnonzero(lengths != MISSING_LENGTH).tolist())
+
+    def __getitem__(self, vector_id: int) -> str:
+        return str(self.view(vector_id), "utf-8")
+
+    def __setitem__(self, vector_id: int, text: str):
+        self._check_writable()
+        missing = vector_id + 1 - len(self._lengths)
+        if missing > 0:
+            self._starts.extend([0] * missing)
+            self._lengths.extend([MISSING_LENGTH] * missing)
+        if self._lengths[vector_id] == MISSING_LENGTH:
+            self._count += 1
+        data = text.encode("utf-8")
+        self._starts[vector_id] = len(self._buffer)
+        self._lengths[vector_id] = len(data)
+        self._buffer.extend(data)
+
+    @property
+    def size(self) -> int:
+        """
+        Số vector ID đã cấp phát (ID lớn nhất + 1)
+        """
+        return len(self._lengths)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Kích thước buffer văn bản (kể cả phần byte của đoạn đã xóa chưa được dọn)
+        """
+        return len(self._buffer)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError("Kho văn bản được nạp bằng mmap chỉ đọc")
+
+    def view(self, vector_id: int) -> memoryview:
+        """
+        Văn bản UTF-8 của một vector ID dưới dạng memoryview trỏ thẳng vào buffer (không sao chép).
+        Khi còn giữ view, buffer trong bộ nhớ không thể ghi thêm.
+        """
+        if vector_id not in self:
+            raise KeyError(vector_id)
+        start = int(self._starts[vector_id])
+        return memoryview(self._buffer)[start:start + int(self._lengths[vector_id])]
+
+    def get(self, vector_id: int, default: Optional[str] = None) -> Optional[str]:
+        return self[vector_id] if vector_id in self else default
+
+    def delete(self, vector_id: int):
+        self._check_writable()
+        if vector_id in self:
+            self._lengths[vector_id] = MISSING_LENGTH
+            self._count -= 1
+
+    def save(self, directory: Union[str, Path], name: str = DEFAULT_NAME):
+        """
+        Ghi buffer (chỉ gồm văn bản còn dùng, theo thứ tự vector ID) và bảng offset
+        ra file tạm (tên duy nhất) rồi os.replace, không ảnh hưởng bản đang được ánh xạ
+        """
+        directory = Path(directory)
+        table = np.full((self.size, 2), MISSING_LENGTH, dtype=np.int64)
+        table[:, 0] = 0
+        with atomic_path(directory / f"{name}{TEXT_SUFFIX}") as tmp_text, \
+                atomic_path(directory / f"{name}{OFFSETS_SUFFIX}") as tmp_offsets:
+            with open(tmp_text, "wb") as f:
+                position = 0
+                for vector_id in self:
+                    data = self.view(vector_id)
+                    f.write(data)
+                    table[vector_id] = (position, len(data))
+                    position += len(data)
+            with open(tmp_offsets, "wb") as f:
+                np.save(f, table)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], mmap_mode: bool = True, name: str = DEFAULT_NAME) -> "DocumentStore":
+        """
+        Nạp kho văn bản. Với mmap_mode=True buffer và bảng offset được ánh xạ chỉ đọc;
+        ngược lại được đọc vào bộ nhớ để có thể ghi thêm
+        """
+        text_path = Path(directory) / f"{name}{TEXT_SUFFIX}"
+        offsets_path = Path(directory) / f"{name}{OFFSETS_SUFFIX}"
+        store = cls()
+        if mmap_mode:
+            table = np.load(offsets_path, mmap_mode="r")
+            with open(text_path, "rb") as f:
+                # mmap không ánh xạ được file rỗng
+                if os.fstat(f.fileno()).st_size:
+                    store._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    store._buffer = b""
+            # memoryview trên vùng ánh xạ: đọc từng phần tử ra int nhanh hơn chỉ mục numpy
+            store._starts = memoryview(table[:, 0])
+            store._lengths = memoryview(table[:, 1])
+            store.read_only = True
+        else:
+            table = np.load(offsets_path)
+            store._buffer = bytearray(text_path.read_bytes())
+            store._starts = array("q", np.ascontiguousarray(table[:, 0]).tobytes())
+            store._lengths = array("q", np.ascontiguousarray(table[:, 1]).tobytes())
+        store._count = int(np.count_nonzero(np.asarray(store._lengths) != MISSING_LENGTH))
+        return store
@@ -0,0 +1,246 @@
+from typing import Dict, List, Optional, Protocol, Sequence
+from pathlib import Path
+import json
+import os
+import numpy as np
+from loguru import logger
+
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+BACKEND_TORCH = "torch"
+BACKEND_ONNX = "onnx"
+
+# Các file của mô hình ONNX đã export
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+CONFIG_FILE = "embedding_config.json"
+
+# Sai số cho phép giữa embedding ONNX int8 và embedding PyTorch float32 của cùng một câu:
+# cosine similarity >= ONNX_MIN_COSINE. Với mức này, vector ONNX dùng được với index
+# đã tạo bằng PyTorch (khoảng cách L2 giữa hai vector chuẩn hóa <= sqrt(2 * (1 - 0.98)) ~ 0.2).
+# export_onnx() kiểm tra ngưỡng này trên các câu mẫu và từ chối mô hình không đạt.
+ONNX_MIN_COSINE = 0.98
+
+# Câu mẫu để kiểm tra sai số khi export (tiếng Việt và tiếng Anh như dữ liệu thật)
+CALIBRATION_SENTENCES = [
+    "Làm thế nào để đổi mật khẩu Facebook?",
+    "Tôi không đăng nhập được vào tài khoản của mình.",
+    "Cách báo cáo một bài viết vi phạm tiêu chuẩn cộng đồng",
+    "Facebook ra mắt tính năng mới cho nhóm và trang.",
+    "How do I turn on two-factor authentication?",
+    "Meta announces new privacy controls for Messenger.",
+    "Quảng cáo của tôi bị từ chối, tôi phải làm gì?",
+    "Xin chào",
+]
+
+class EmbeddingModel(Protocol):
+    """
+    Giao diện tối thiểu RAGModel cần từ mô hình embedding (giống SentenceTransformer)
+    """
+    def get_sentence_embedding_dimension(self) -> int: ...
+
+    def encode(self, sentences: Sequence[str], batch_size: int = 32, normalize_embeddings: bool = False,
+               convert_to_numpy: bool = True, **kwargs) -> np.ndarray: ...
+
+class OnnxEmbeddingModel:
+    def __init__(self, model_dir: str, quantized: bool = True, num_threads: int = 0):
+        """
+        Mô hình embedding chạy bằng ONNX Runtime trên CPU, không cần import torch.
+        Dùng tokenizer nhanh (tokenizers) và mean pooling giống SentenceTransformer.
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_dir = Path(model_dir)
+        with open(self.model_dir / CONFIG_FILE, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.model_name = self.config["model_name"]
+        self.max_seq_length = self.config["max_seq_length"]
+
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(
+            str(self.model_dir / model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.quantized = quantized
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def _encode_batch(self, sentences: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(sentences)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        token_embeddings = self.session.run(
+            ["last_hidden_state"],
+            {"input_ids": input_ids, "attention_mask": attention_mask}
+        )[0]
+
+        # Mean pooling trên các token thật (bỏ padding)
+        mask = attention_mask[..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        return summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(
+        self,
+        sentences: Sequence[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        convert_to_numpy: bool = True,
+        **kwargs
+    ) -> np.ndarray:
+        """
+        Tạo embeddings (float32) cho danh sách câu, cùng chữ ký với SentenceTransformer.encode
+        """
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        embeddings = np.empty((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Sắp theo độ dài để mỗi lô ít padding, sau đó trả về đúng thứ tự ban đầu
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        for start in range(0, len(order), batch_size):
+            batch_order = order[start:start + batch_size]
+            embeddings[batch_order] = self._encode_batch([sentences[i] for i in batch_order])
+
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+def load_embedding_model(
+    model_name: str = MODEL_NAME,
+    backend: Optional[str] = None,
+    onnx_dir: Optional[str] = None,
+    quantized: Optional[bool] = None
+) -> EmbeddingModel:
+    """
+    Nạp mô hình embedding theo backend ("torch" hoặc "onnx"). Mặc định đọc từ biến môi trường
+    EMBEDDING_BACKEND, EMBEDDING_ONNX_DIR, EMBEDDING_ONNX_QUANTIZED, EMBEDDING_ONNX_THREADS.
+    """
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", BACKEND_TORCH)).lower()
+    if backend == BACKEND_TORCH:
+        # Import tại đây để backend ONNX không phải import torch
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+
+    if backend != BACKEND_ONNX:
+        raise ValueError(f"Backend embedding không hợp lệ: {backend} (hỗ trợ: torch, onnx)")
+
+    onnx_dir = Path(onnx_dir or os.getenv("EMBEDDING_ONNX_DIR", "app/data/onnx"))
+    if not (onnx_dir / CONFIG_FILE).exists():
+        raise FileNotFoundError(
+            f"Không tìm thấy mô hình ONNX trong {onnx_dir}, hãy chạy "
+            f"`python -m app.models.embedding_backend --output-dir {onnx_dir}`"
+        )
+    if quantized is None:
+        quantized = os.getenv("EMBEDDING_ONNX_QUANTIZED", "true").lower() in ("1", "true", "yes")
+    model = OnnxEmbeddingModel(
+        str(onnx_dir),
+        quantized=quantized,
+        num_threads=int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+    )
+    if model.model_name != model_name:
+        raise ValueError(f"Mô hình ONNX được export từ {model.model_name}, không phải {model_name}")
+    logger.info(f"Loaded ONNX embedding model from {onnx_dir} (quantized={quantized})")
+    return model
+
+def cosine_similarities(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity giữa từng cặp hàng của a và b
+    """
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+def export_onnx(
+    model_name: str = MODEL_NAME,
+    output_dir: str = "app/data/onnx",
+    opset: int = 14,
+    min_cosine: float = ONNX_MIN_COSINE
+) -> Dict:
+    """
+    Export transformer của SentenceTransformer sang ONNX, lượng tử hóa động int8 và kiểm tra
+    sai số so với PyTorch. Cần torch, sentence-transformers và onnx (chỉ lúc export).
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    model = SentenceTransformer(model_name, device="cpu")
+    pooling = model[1]
+    if not getattr(pooling, "pooling_mode_mean_tokens", False) or len(model) > 2:
+        raise ValueError("Backend ONNX chỉ hỗ trợ mô hình Transformer + mean pooling")
+
+    transformer = model[0].auto_model.eval()
+    transformer.config.return_dict = False
+    tokenizer = model.tokenizer
+    sample = tokenizer(CALIBRATION_SENTENCES[:2], padding=True, return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample["input_ids"], sample["attention_mask"]),
+            str(output_dir / ONNX_MODEL_FILE),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state", "pooler_output"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"}
+            },
+            opset_version=opset
+        )
+    quantize_dynamic(
+        str(output_dir / ONNX_MODEL_FILE),
+        str(output_dir / ONNX_QUANTIZED_MODEL_FILE),
+        weight_type=QuantType.QInt8
+    )
+    tokenizer.save_pretrained(str(output_dir))
+
+    config = {
+        "model_name": model_name,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "pooling": "mean"
+    }
+    with open(output_dir / CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    # Kiểm tra sai số của cả hai bản ONNX so với PyTorch
+    reference = model.encode(CALIBRATION_SENTENCES, convert_to_numpy=True)
+    for quantized in (False, True):
+        onnx_model = OnnxEmbeddingModel(str(output_dir), quantized=quantized)
+        similarities = cosine_similarities(reference, onnx_model.encode(CALIBRATION_SENTENCES))
+        key = "int8_min_cosine" if quantized else "fp32_min_cosine"
+        config[key] = round(float(similarities.min()), 5)
+        if similarities.min() < min_cosine:
+            raise ValueError(
+                f"Embedding ONNX ({'int8' if quantized else 'fp32'}) lệch quá ngưỡng: "
+                f"cosine nhỏ nhất {similarities.min():.4f} < {min_cosine}"
+            )
+
+    with open(output_dir / CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    logger.info(f"Exported ONNX embedding model to {output_dir}: {config}")
+    return config
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export mô hình embedding sang ONNX (int8)")
+    parser.add_argument("--model-name", default=MODEL_NAME)
+    parser.add_argument("--output-dir", default=os.getenv("EMBEDDING_ONNX_DIR", "app/data/onnx"))
+    parser.add_argument("--min-cosine", type=float, default=ONNX_MIN_COSINE)
+    args = parser.parse_args()
+    export_onnx(args.model_name, args.output_dir, min_cosine=args.min_cosine)
@@ -0,0 +1,288 @@
+from array import array
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Union
+import json
+import numpy as np
+from app.models.document_store import DocumentStore
+from app.utils.file_utils import atomic_write
+
+# Trường dạng chuỗi lặp lại nhiều (mỗi document có nhiều đoạn) được mã hóa theo từ điển
+CATEGORICAL_FIELDS = ("id", "title", "source", "category", "date")
+# Trường số nguyên (vị trí đoạn trong document)
+INTEGER_FIELDS = ("start", "end")
+DATE_FIELD = "date"
+
+# Mã 0 của cột từ điển và giá trị INT_MISSING của cột số nghĩa là không có trường đó
+MISSING_CODE = 0
+INT_MISSING = -2 ** 31
+
+# Khóa bộ lọc cho khoảng ngày (so sánh theo ngày, bao gồm hai đầu mút)
+DATE_FROM = "date_from"
+DATE_TO = "date_to"
+
+# Một số định dạng ngày thường gặp ngoài ISO 8601 (ví dụ ngày lấy từ trang tin tức)
+DATE_FORMATS = ("%d/%m/%Y", "%d/%m/%Y %H:%M", "%B %d, %Y", "%b %d, %Y", "%Y/%m/%d")
+
+# Tên các file của metadata trên đĩa: mỗi cột một file .npy (ánh xạ được bằng mmap).
+# Từ điển giá trị của mỗi trường là một kho văn bản {field}.values (xem DocumentStore)
+# kèm các mã sắp theo giá trị {field}.values.order.npy; trường ngoài cột lưu dạng JSON
+VALUES_SUFFIX = ".values"
+ORDER_SUFFIX = ".values.order.npy"
+EXTRA_FILE = "extra.jsonl"
+DAYS_COLUMN = "days"
+PRESENT_COLUMN = "present"
+
+_EPOCH = date(1970, 1, 1)
+
+def to_epoch_day(value: Any) -> Optional[int]:
+    """
+    Chuyển date/datetime/chuỗi ngày thành số ngày kể từ 1970-01-01, None nếu không đọc được
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        value = value.date()
+    elif isinstance(value, str):
+        text = value.strip()
+        try:
+            value = datetime.fromisoformat(text.replace("Z", "+00:00")).date()
+        except ValueError:
+            for date_format in DATE_FORMATS:
+                try:
+                    value = datetime.strptime(text, date_format).date()
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+    if not isinstance(value, date):
+        return None
+    return (value - _EPOCH).days
+
+class MetadataStore:
+    def __init__(self):
+        """
+        Lưu metadata của các vector theo cột, mỗi hàng ứng với một vector ID.
+        Trường chuỗi lặp lại (id, title, source, category, date) lưu mã uint32 trỏ vào
+        từ điển giá trị, start/end lưu int32, ngày được chuyển thêm thành số ngày int32
+        để lọc theo khoảng thời gian. Trường khác (hoặc kiểu khác) lưu riêng theo hàng.
+        Từ điển giá trị (mã -> chuỗi) là DocumentStore nên cũng được ánh xạ chỉ đọc khi nạp.
+        """
+        self._values: Dict[str, DocumentStore] = {field: DocumentStore() for field in CATEGORICAL_FIELDS}
+        # Tra mã theo giá trị: dict khi ghi, tìm kiếm nhị phân trên _order khi nạp bằng mmap
+        self._codes: Dict[str, Dict[str, int]] = {field: {} for field in CATEGORICAL_FIELDS}
+        self._order: Dict[str, memoryview] = {}
+        self._categorical: Dict[str, array] = {field: array("I") for field in CATEGORICAL_FIELDS}
+        self._integers: Dict[str, array] = {field: array("i") for field in INTEGER_FIELDS}
+        self._days = array("i")
+        self._present = array("B")
+        self._extra: Dict[int, Dict] = {}
+        self._count = 0
+        self.read_only = False
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, row: int) -> bool:
+        return 0 <= row < len(self._present) and bool(self._present[row])
+
+    @property
+    def size(self) -> int:
+        """
+        Số hàng đã cấp phát (vector ID lớn nhất + 1)
+        """
+        return len(self._present)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError("Metadata được nạp bằng mmap chỉ đọc")
+
+    def _grow(self, size: int):
+        missing = size - len(self._present)
+        if missing <= 0:
+            return
+        for column in self._categorical.values():
+            column.extend([MISSING_CODE] * missing)
+        for column in self._integers.values():
+            column.extend([INT_MISSING] * missing)
+        self._days.extend([INT_MISSING] * missing)
+        self._present.extend([0] * missing)
+
+    def _encode(self, field: str, value: str) -> int:
+        codes = self._codes[field]
+        code = codes.get(value)
+        if code is None:
+            values = self._values[field]
+            code = codes[value] = max(values.size, MISSING_CODE + 1)
+            values[code] = value
+        return code
+
+    def _lookup(self, field: str, value: str) -> Optional[int]:
+        """
+        Mã của một giá trị, None nếu không có hàng nào mang giá trị đó. Metadata nạp bằng
+        mmap tìm kiếm nhị phân trên các mã đã sắp theo giá trị (thứ tự byte UTF-8 trùng
+        thứ tự chuỗi) thay vì dựng dict giá trị trong mỗi worker.
+        """
+        if not self.read_only:
+            return self._codes[field].get(value)
+        values, order = self._values[field], self._order[field]
+        key = value.encode("utf-8")
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(values.view(order[middle])) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and bytes(values.view(order[low])) == key:
+            return int(order[low])
+        return None
+
+    def set(self, row: int, meta: Dict):
+        """
+        Ghi (hoặc ghi đè) metadata của một vector ID
+        """
+        self._check_writable()
+        self._grow(row + 1)
+        if not self._present[row]:
+            self._count += 1
+        self._present[row] = 1
+        extra = {}
+        for field in CATEGORICAL_FIELDS:
+            self._categorical[field][row] = MISSING_CODE
+        for field in INTEGER_FIELDS:
+            self._integers[field][row] = INT_MISSING
+        for field, value in meta.items():
+            if field in self._categorical and isinstance(value, str):
+                self._categorical[field][row] = self._encode(field, value)
+            elif field in self._integers and type(value) is int and INT_MISSING < value < 2 ** 31:
+                self._integers[field][row] = value
+            else:
+                extra[field] = value
+        day = to_epoch_day(meta.get(DATE_FIELD)) if DATE_FIELD in meta else None
+        self._days[row] = day if day is not None else INT_MISSING
+        if extra:
+            self._extra[row] = extra
+        else:
+            self._extra.pop(row, None)
+
+    def get(self, row: int) -> Dict:
+        """
+        Ghép lại metadata của một vector ID thành dict (theo thứ tự trường cố định)
+        """
+        if row not in self:
+            raise KeyError(row)
+        meta = {}
+        for field, column in self._categorical.items():
+            code = int(column[row])
+            if code != MISSING_CODE:
+                meta[field] = self._values[field][code]
+        for field, column in self._integers.items():
+            value = int(column[row])
+            if value != INT_MISSING:
+                meta[field] = value
+        meta.update(self._extra.get(row, {}))
+        return meta
+
+    def delete(self, row: int):
+        self._check_writable()
+        if row not in self:
+            return
+        self._present[row] = 0
+        self._count -= 1
+        for column in self._categorical.values():
+            column[row] = MISSING_CODE
+        self._days[row] = INT_MISSING
+        self._extra.pop(row, None)
+
+    def _field_mask(self, field: str, values: Iterable[Any]) -> np.ndarray:
+        """
+        Hàng có trường field bằng một trong các giá trị (chỉ hỗ trợ các trường lưu theo cột)
+        """
+        if field in self._categorical:
+            codes = [self._lookup(field, value) for value in values if isinstance(value, str)]
+            codes = [code for code in codes if code is not None]
+            column = np.asarray(self._categorical[field])
+            return np.isin(column, np.asarray(codes, dtype=np.uint32))
+        if field in self._integers:
+            column = np.asarray(self._integers[field])
+            return np.isin(column, np.asarray([value for value in values if type(value) is int], dtype=np.int64))
+        raise ValueError(f"Không hỗ trợ lọc theo trường metadata: {field}")
+
+    def mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        """
+        Mảng bool theo vector ID của các hàng thỏa mọi điều kiện trong filters:
+        {"category": "news"}, {"source": ["A", "B"]}, {"date_from": "2024-01-01", "date_to": date.today()}
+        """
+        mask = np.asarray(self._present).astype(bool)
+        for field, condition in filters.items():
+            if field in (DATE_FROM, DATE_TO):
+                day = to_epoch_day(condition)
+                if day is None:
+                    raise ValueError(f"Giá trị ngày không hợp lệ cho {field}: {condition!r}")
+                days = np.asarray(self._days)
+                mask &= days != INT_MISSING
+                mask &= days >= day if field == DATE_FROM else days <= day
+                continue
+            values = condition if isinstance(condition, (list, tuple, set, frozenset)) else [condition]
+            mask &= self._field_mask(field, values)
+        return mask
+
+    def _columns(self) -> Dict[str, Any]:
+        return {**self._categorical, **self._integers, DAYS_COLUMN: self._days, PRESENT_COLUMN: self._present}
+
+    def save(self, directory: Union[str, Path]):
+        """
+        Lưu mỗi cột thành một file .npy, cùng từ điển giá trị và các trường ngoài cột
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, column in self._columns().items():
+            with atomic_write(directory / f"{name}.npy", "wb") as f:
+                np.save(f, np.asarray(column))
+        
+        for field, values in self._values.items():
+            values.save(directory, name=f"{field}{VALUES_SUFFIX}")
+            order = sorted(values, key=values.__getitem__)
+            with atomic_write(directory / f"{field}{ORDER_SUFFIX}", "wb") as f:
+                np.save(f, np.asarray(order, dtype=np.uint32))
+        
+        with atomic_write(directory / EXTRA_FILE) as f:
+            for row, extra in self._extra.items():
+                f.write(json.dumps({"row": row, "metadata": extra}, ensure_ascii=False))
+                f.write("\n")
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], mmap_mode: bool = True) -> "MetadataStore":
+        """
+        Nạp metadata. Với mmap_mode=True các cột và từ điển giá trị được ánh xạ chỉ đọc
+        (dùng chung giữa các worker); ngược lại được đọc vào bộ nhớ để có thể ghi thêm
+        """
+        directory = Path(directory)
+        store = cls()
+        for field in CATEGORICAL_FIELDS:
+            values = DocumentStore.load(directory, mmap_mode=mmap_mode, name=f"{field}{VALUES_SUFFIX}")
+            store._values[field] = values
+            if mmap_mode:
+                store._order[field] = memoryview(np.load(directory / f"{field}{ORDER_SUFFIX}", mmap_mode="r"))
+            else:
+                store._codes[field] = {values[code]: code for code in values}
+        
+        columns = {}
+        for name, column in store._columns().items():
+            values = np.load(directory / f"{name}.npy", mmap_mode="r" if mmap_mode else None)
+            # memoryview trên vùng ánh xạ: đọc từng phần tử ra int nhanh hơn chỉ mục numpy
+            columns[name] = memoryview(values) if mmap_mode else array(column.typecode, values.tobytes())
+        store._categorical = {field: columns[field] for field in CATEGORICAL_FIELDS}
+        store._integers = {field: columns[field] for field in INTEGER_FIELDS}
+        store._days = columns[DAYS_COLUMN]
+        store._present = columns[PRESENT_COLUMN]
+        store._count = int(np.count_nonzero(np.asarray(store._present)))
+        
+        with open(directory / EXTRA_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                store._extra[record["row"]] = record["metadata"]
+        store.read_only = mmap_mode
+        return store
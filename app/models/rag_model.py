@@ -1,58 +1,483 @@
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple, Union
+from itertools import groupby
+from pathlib import Path
+import hashlib
+import json
 import faiss
-from sentence_transformers import SentenceTransformer
-import torch
+import numpy as np
+from loguru import logger
+from app.models import vector_index
+from app.models.document_store import DocumentStore
+from app.models.metadata_store import MetadataStore
+from app.utils.file_utils import atomic_path, atomic_write
+from app.models.embedding_backend import MODEL_NAME, EmbeddingModel, load_embedding_model
+
+# Tên các file của chỉ mục lưu trên đĩa
+INDEX_FILE = "index.faiss"
+RECORDS_FILE = "records.jsonl"
+METADATA_DIR = "metadata"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 3
 
 class RAGModel:
-    def __init__(self):
-        # Khởi tạo mô hình embedding
-        self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        embedding_model: Optional[EmbeddingModel] = None,
+        embedding_backend: Optional[str] = None,
+        encode_batch_size: int = 64,
+        index_type: str = vector_index.INDEX_FLAT,
+        index_config: Optional[Dict] = None,
+        expected_size: Optional[int] = None
+    ):
+        # Khởi tạo mô hình embedding (có thể dùng lại mô hình đã nạp khi tạo lại index).
+        # Backend "torch" (SentenceTransformer) hoặc "onnx" (ONNX Runtime int8) cho cùng không gian vector.
+        self.model_name = model_name
+        self.embedding_model = embedding_model or load_embedding_model(model_name, embedding_backend)
+        self.encode_batch_size = encode_batch_size
+        
+        # Khởi tạo FAISS index (flat, IVF-Flat, IVF-PQ, HNSW hoặc "auto" theo expected_size),
+        # mọi loại đều hỗ trợ add_with_ids để thêm/xóa vector theo ID.
+        # index_config: nlist, pq_m, pq_nbits, hnsw_m, ef_construction, nprobe, ef_search, max_train_size
+        self.dimension = self.embedding_model.get_sentence_embedding_dimension()  # 384 với MiniLM-L12
+        self.index_config = index_config or {}
+        self.index_type = vector_index.resolve_index_type(index_type, expected_size)
+        self.index = vector_index.build_index(
+            self.index_type, self.dimension, expected_size, **self.index_config
+        )
+        self._apply_search_params()
+        
+        # Index IVF cần huấn luyện: gom embeddings của các lô đầu làm mẫu huấn luyện
+        self.max_train_size = self.index_config.get("max_train_size", vector_index.DEFAULT_MAX_TRAIN_SIZE)
+        self._train_size = vector_index.training_size(self.index, self.max_train_size)
+        self._train_buffer: List[Tuple[np.ndarray, np.ndarray]] = []
+        
+        # Lưu trữ văn bản (buffer UTF-8 liền + bảng offset) và metadata (theo cột) theo ID trong FAISS
+        self.documents = DocumentStore()
+        self.metadata = MetadataStore()
+        
+        # Hash nội dung của từng vector và danh sách vector của từng document ID
+        self._content_keys: Dict[int, str] = {}
+        self._key_to_id: Dict[str, int] = {}
+        self._doc_ids: Dict[str, List[int]] = {}
+        self._next_id = 0
+        # Index nạp bằng mmap chỉ đọc bản ghi (doc_id, hash nội dung) khi cần
+        self._records_path: Optional[Path] = None
+        
+        # Index nạp bằng mmap chỉ dùng để đọc
+        self.read_only = False
+        
+    @staticmethod
+    def _content_key(doc_id: str, text: str) -> str:
+        """
+        Hash của (document ID, nội dung) dùng để bỏ qua đoạn văn bản đã có trong index
+        """
+        return hashlib.sha1(f"{doc_id}\x00{text}".encode("utf-8")).hexdigest()
+        
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError("Index được nạp ở chế độ mmap chỉ đọc, hãy nạp lại với mmap=False để thay đổi documents")
+            
+    def _check_removable(self):
+        if not self.supports_remove:
+            raise ValueError(f"Index {self.index_type} không hỗ trợ xóa vector, cần đánh chỉ mục lại toàn bộ")
+            
+    @property
+    def supports_remove(self) -> bool:
+        return vector_index.supports_remove(self.index_type)
+        
+    def _apply_search_params(self):
+        vector_index.set_search_params(
+            self.index,
+            nprobe=self.index_config.get("nprobe"),
+            ef_search=self.index_config.get("ef_search")
+        )
+            
+    def _iter_records(
+        self,
+        documents: Iterable[str],
+        metadata: Optional[Iterable[Dict]],
+        doc_ids: Optional[Iterable[str]]
+    ) -> Iterator[Tuple[str, Dict, str]]:
+        """
+        Ghép documents, metadata và document ID; ID mặc định lấy từ metadata["id"]
+        """
+        metadata = iter(metadata) if metadata is not None else None
+        doc_ids = iter(doc_ids) if doc_ids is not None else None
+        for text in documents:
+            meta = next(metadata, None) if metadata is not None else None
+            meta = meta if meta is not None else {}
+            doc_id = next(doc_ids, None) if doc_ids is not None else None
+            doc_id = str(doc_id if doc_id is not None else meta.get("id", ""))
+            yield text, meta, doc_id
+            
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Tạo embeddings float32 đã chuẩn hóa L2, liên tục trong bộ nhớ để đưa thẳng vào FAISS
+        """
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=self.encode_batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+        # Không sao chép nếu dữ liệu đã là float32 liên tục
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
         
-        # Khởi tạo FAISS index
-        self.dimension = 384  # Kích thước vector của mô hình
-        self.index = faiss.IndexFlatL2(self.dimension)
+    def _add_batch(self, batch: List[Tuple[str, Dict, str, str]]):
+        """
+        Encode và thêm một lô (text, metadata, doc_id, content_key) vào index
+        """
+        embeddings = self.encode([text for text, _, _, _ in batch])
+        ids = np.arange(self._next_id, self._next_id + len(batch), dtype=np.int64)
+        if self.index.is_trained:
+            self.index.add_with_ids(embeddings, ids)
+        else:
+            self._train_buffer.append((embeddings, ids))
+            if sum(len(buffered_ids) for _, buffered_ids in self._train_buffer) >= self._train_size:
+                self._flush_train_buffer()
+        self._next_id += len(batch)
         
-        # Lưu trữ documents và metadata
-        self.documents = []
-        self.metadata = []
+        for vector_id, (text, meta, doc_id, key) in zip(ids.tolist(), batch):
+            self.documents[vector_id] = text
+            self.metadata.set(vector_id, meta)
+            self._content_keys[vector_id] = key
+            self._key_to_id[key] = vector_id
+            self._doc_ids.setdefault(doc_id, []).append(vector_id)
+            
+    def _flush_train_buffer(self):
+        """
+        Huấn luyện index trên các embeddings đã gom rồi thêm chúng vào index
+        """
+        if not self._train_buffer:
+            return
+        embeddings = np.concatenate([embeddings for embeddings, _ in self._train_buffer])
+        ids = np.concatenate([ids for _, ids in self._train_buffer])
+        self._train_buffer = []
+        if not self.index.is_trained:
+            logger.info(f"Training {self.index_type} index on {min(len(embeddings), self.max_train_size)} vectors")
+            vector_index.train_index(self.index, embeddings, self.max_train_size)
+            self._apply_search_params()
+        self.index.add_with_ids(embeddings, ids)
         
-    def add_documents(self, documents: List[str], metadata: List[Dict] = None):
+    def _remove_ids(self, ids: List[int]):
         """
-        Thêm documents vào hệ thống RAG
+        Xóa các vector khỏi index cùng documents/metadata tương ứng
         """
-        if metadata is None:
-            metadata = [{} for _ in documents]
+        if not ids:
+            return
+        self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+        for vector_id in ids:
+            self.documents.delete(vector_id)
+            self.metadata.delete(vector_id)
+            key = self._content_keys.pop(vector_id, None)
+            if key is not None:
+                self._key_to_id.pop(key, None)
+                
+    def add_documents(
+        self,
+        documents: Iterable[str],
+        metadata: Optional[Iterable[Dict]] = None,
+        doc_ids: Optional[Iterable[str]] = None,
+        batch_size: Optional[int] = None
+    ) -> int:
+        """
+        Thêm documents vào hệ thống RAG. documents/metadata có thể là generator:
+        dữ liệu được encode và thêm vào index theo từng lô batch_size phần tử.
+        Đoạn văn bản đã có (cùng document ID và nội dung) được bỏ qua trước khi encode.
+        Trả về số vector thực sự được thêm.
+        """
+        self._check_writable()
+        batch_size = batch_size or self.encode_batch_size
+        
+        added = 0
+        skipped = 0
+        pending: List[Tuple[str, Dict, str, str]] = []
+        pending_keys = set()
+        for text, meta, doc_id in self._iter_records(documents, metadata, doc_ids):
+            key = self._content_key(doc_id, text)
+            if key in self._key_to_id or key in pending_keys:
+                skipped += 1
+                continue
+            pending.append((text, meta, doc_id, key))
+            pending_keys.add(key)
+            if len(pending) >= batch_size:
+                self._add_batch(pending)
+                added += len(pending)
+                pending, pending_keys = [], set()
+                logger.debug(f"Encoded {added} documents")
+                
+        if pending:
+            self._add_batch(pending)
+            added += len(pending)
+        # Corpus nhỏ hơn mẫu huấn luyện: huấn luyện trên toàn bộ những gì đã có
+        self._flush_train_buffer()
             
-        # Tạo embeddings cho documents
-        embeddings = self.embedding_model.encode(documents)
+        logger.info(f"Added {added} documents to RAG index ({skipped} duplicates skipped)")
+        return added
         
-        # Thêm vào FAISS index
-        self.index.add(embeddings.astype('float32'))
+    def upsert_documents(
+        self,
+        documents: Iterable[str],
+        metadata: Optional[Iterable[Dict]] = None,
+        doc_ids: Optional[Iterable[str]] = None,
+        batch_size: Optional[int] = None
+    ) -> Dict[str, int]:
+        """
+        Thay thế toàn bộ các đoạn của mỗi document ID bằng các đoạn mới.
+        Các đoạn liên tiếp cùng document ID được xem là một document; chỉ các đoạn
+        có nội dung thay đổi mới được encode lại, đoạn không còn tồn tại bị xóa.
+        """
+        self._check_writable()
+        self._check_removable()
+        batch_size = batch_size or self.encode_batch_size
         
-        # Lưu documents và metadata
-        self.documents.extend(documents)
-        self.metadata.extend(metadata)
+        stats = {"added": 0, "removed": 0, "unchanged": 0}
+        pending: List[Tuple[str, Dict, str, str]] = []
+        seen_doc_ids = set()
+        records = self._iter_records(documents, metadata, doc_ids)
+        for doc_id, group in groupby(records, key=lambda record: record[2]):
+            new_records = {}
+            for text, meta, _ in group:
+                new_records.setdefault(self._content_key(doc_id, text), (text, meta))
+                
+            # Document ID xuất hiện lại (không liên tiếp) thì chỉ thêm, không xóa đoạn vừa upsert
+            if doc_id not in seen_doc_ids:
+                seen_doc_ids.add(doc_id)
+                old_ids = self._doc_ids.get(doc_id, [])
+                stale_ids = {i for i in old_ids if self._content_keys[i] not in new_records}
+                self._remove_ids(list(stale_ids))
+                self._doc_ids[doc_id] = [i for i in old_ids if i not in stale_ids]
+                stats["removed"] += len(stale_ids)
+            
+            for key, (text, meta) in new_records.items():
+                if key in self._key_to_id:
+                    # Nội dung không đổi: chỉ cập nhật metadata
+                    self.metadata.set(self._key_to_id[key], meta)
+                    stats["unchanged"] += 1
+                    continue
+                pending.append((text, meta, doc_id, key))
+                if len(pending) >= batch_size:
+                    self._add_batch(pending)
+                    stats["added"] += len(pending)
+                    pending = []
+                    
+        if pending:
+            self._add_batch(pending)
+            stats["added"] += len(pending)
+        self._flush_train_buffer()
+            
+        logger.info(f"Upserted documents into RAG index: {stats}")
+        return stats
         
-    def retrieve(self, query: str, k: int = 3) -> List[Dict]:
+    def delete_documents(self, doc_ids: Iterable[str]) -> int:
         """
-        Truy xuất k documents liên quan nhất cho câu query
+        Xóa toàn bộ các đoạn của các document ID, trả về số vector đã xóa
         """
-        # Tạo embedding cho query
-        query_embedding = self.embedding_model.encode([query])
+        self._check_writable()
+        self._check_removable()
+        ids = []
+        for doc_id in doc_ids:
+            ids.extend(self._doc_ids.pop(str(doc_id), []))
+        self._remove_ids(ids)
+        return len(ids)
+        
+    def document_ids(self) -> List[str]:
+        """
+        Danh sách document ID đang có trong index
+        """
+        self._load_records()
+        return [doc_id for doc_id, ids in self._doc_ids.items() if ids]
+        
+    def retrieve(self, query: str, k: int = 3, filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        Truy xuất k documents liên quan nhất cho câu query (lọc theo metadata nếu có filters)
+        """
+        return self.retrieve_batch([query], k, filters)[0]
+        
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        k: int = 3,
+        filters: Optional[Dict] = None,
+        return_embeddings: bool = False
+    ) -> Union[List[List[Dict]], Tuple[List[List[Dict]], Optional[np.ndarray]]]:
+        """
+        Truy xuất k documents cho nhiều query cùng lúc: một lần encode theo lô
+        và một lần index.search cho cả lô.
+        filters lọc theo metadata trước khi tìm kiếm, ví dụ {"category": "news"},
+        {"source": ["Wikipedia", "Facebook"]}, {"date_from": "2024-01-01"}: các vector
+        không thỏa được loại bằng IDSelectorBitmap ngay trong FAISS, không phải lấy dư
+        kết quả rồi lọc lại. Với index xấp xỉ (IVF, HNSW) và bộ lọc rất hẹp, số kết quả
+        có thể ít hơn k.
+        Với return_embeddings=True trả về thêm embedding (đã chuẩn hóa L2) của các query
+        để dùng lại, ví dụ cho cache câu trả lời, mà không phải encode lại.
+        """
+        query_embeddings = None
+        if queries and (return_embeddings or self.index.ntotal):
+            query_embeddings = self.encode(list(queries))
+        batch_results = self._search(query_embeddings, len(queries), k, filters)
+        return (batch_results, query_embeddings) if return_embeddings else batch_results
+        
+    def _search(self, query_embeddings: Optional[np.ndarray], count: int, k: int, filters: Optional[Dict]) -> List[List[Dict]]:
+        if query_embeddings is None or self.index.ntotal == 0:
+            return [[] for _ in range(count)]
+            
+        params = None
+        if filters:
+            mask = self.metadata.mask(filters)
+            selected = int(mask.sum())
+            if not selected:
+                return [[] for _ in range(count)]
+            if selected < self.index.ntotal:
+                # bitmap phải còn sống tới khi search xong
+                selector, bitmap = vector_index.id_selector(mask)
+                params = vector_index.search_parameters(self.index, selector)
+            k = min(k, selected)
         
         # Tìm k documents gần nhất
-        distances, indices = self.index.search(query_embedding.astype('float32'), k)
+        distances, indices = self.index.search(query_embeddings, min(k, self.index.ntotal), params=params)
         
         # Trả về documents và metadata tương ứng
-        results = []
-        for idx in indices[0]:
-            results.append({
-                'document': self.documents[idx],
-                'metadata': self.metadata[idx]
-            })
-            
-        return results
+        batch_results = []
+        for row_distances, row_indices in zip(distances, indices):
+            results = []
+            for distance, idx in zip(row_distances, row_indices):
+                # FAISS trả về -1 khi không đủ kết quả
+                if idx < 0 or idx not in self.documents:
+                    continue
+                results.append({
+                    'document': self.documents[idx],
+                    'metadata': self.metadata.get(idx),
+                    'distance': float(distance)
+                })
+            batch_results.append(results)
+            
+        return batch_results
     
+    def save(self, index_dir: str, extra: Optional[Dict] = None):
+        """
+        Lưu FAISS index, documents/metadata và manifest xuống thư mục index_dir.
+        Manifest được ghi sau cùng nên một lần lưu dở dang sẽ bị từ chối khi nạp.
+        Khi nhiều tiến trình dùng chung index_dir, gọi trong directory_lock(index_dir).
+        """
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Ghi ra file tạm (tên duy nhất) rồi os.replace để không làm hỏng index đang được dùng
+        with atomic_path(index_dir / INDEX_FILE) as tmp_index:
+            faiss.write_index(self.index, str(tmp_index))
+        
+        # Văn bản và metadata lưu dạng nhị phân để nạp lại bằng mmap
+        self.documents.save(index_dir)
+        self.metadata.save(index_dir / METADATA_DIR)
+        
+        self._load_records()
+        with atomic_write(index_dir / RECORDS_FILE) as f:
+            for doc_id, ids in self._doc_ids.items():
+                for vector_id in ids:
+                    f.write(json.dumps({
+                        "id": vector_id,
+                        "doc_id": doc_id,
+                        "key": self._content_keys[vector_id]
+                    }, ensure_ascii=False))
+                    f.write("\n")
+        
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "model_name": self.model_name,
+            "dimension": self.dimension,
+            "count": self.index.ntotal,
+            "normalized": True,
+            "index": vector_index.describe(self.index),
+            "extra": extra or {}
+        }
+        with atomic_write(index_dir / MANIFEST_FILE) as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        
+    @staticmethod
+    def read_manifest(index_dir: str) -> Optional[Dict]:
+        """
+        Đọc manifest của index đã lưu, trả về None nếu chưa có
+        """
+        manifest_path = Path(index_dir) / MANIFEST_FILE
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+        
+    def load(self, index_dir: str, mmap: bool = True) -> Dict:
+        """
+        Nạp index đã lưu. Với mmap=True, index FAISS, văn bản và metadata được ánh xạ chỉ
+        đọc nên các worker cùng nạp một index dùng chung page cache thay vì mỗi tiến trình
+        giữ một bản sao (cờ đọc theo loại index, xem vector_index.mmap_io_flags).
+        Từ chối index được tạo bởi mô hình embedding hoặc kích thước vector khác.
+        """
+        index_dir = Path(index_dir)
+        manifest = self.read_manifest(index_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"Không tìm thấy manifest trong {index_dir}")
+            
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Phiên bản manifest không được hỗ trợ: {manifest.get('version')}")
+        if manifest.get("model_name") != self.model_name:
+            raise ValueError(
+                f"Index được tạo bởi mô hình {manifest.get('model_name')}, "
+                f"không khớp với mô hình hiện tại {self.model_name}"
+            )
+        if manifest.get("dimension") != self.dimension:
+            raise ValueError(
+                f"Kích thước vector của index ({manifest.get('dimension')}) "
+                f"không khớp với mô hình ({self.dimension})"
+            )
+            
+        io_flags = 0
+        if mmap:
+            io_flags = vector_index.mmap_io_flags(manifest.get("index", {}).get("type", vector_index.INDEX_FLAT))
+        index = faiss.read_index(str(index_dir / INDEX_FILE), io_flags)
+        if index.d != self.dimension or index.ntotal != manifest.get("count"):
+            raise ValueError("Index trên đĩa không khớp với manifest")
+            
+        documents = DocumentStore.load(index_dir, mmap_mode=mmap)
+        if len(documents) != index.ntotal:
+            raise ValueError("Số documents trên đĩa không khớp với index")
+        metadata = MetadataStore.load(index_dir / METADATA_DIR, mmap_mode=mmap)
+        if len(metadata) != len(documents):
+            raise ValueError("Metadata trên đĩa không khớp với documents")
+            
+        self.index = index
+        self.index_type = vector_index.index_type_of(index)
+        self._apply_search_params()
+        self._train_size = 0
+        self._train_buffer = []
+        self.documents = documents
+        self.metadata = metadata
+        self._content_keys = {}
+        self._key_to_id = {}
+        self._doc_ids = {}
+        self._records_path = index_dir / RECORDS_FILE
+        self._next_id = documents.size
+        self.read_only = mmap
+        # Index chỉ đọc không cần bản ghi để truy vấn, chỉ đọc khi cần (document_ids, save)
+        if not mmap:
+            self._load_records()
+        return manifest
+        
+    def _load_records(self):
+        """
+        Đọc bản ghi (vector ID, document ID, hash nội dung) của index đã nạp, nếu chưa đọc
+        """
+        if self._records_path is None:
+            return
+        with open(self._records_path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                vector_id = record["id"]
+                self._content_keys[vector_id] = record["key"]
+                self._key_to_id[record["key"]] = vector_id
+                self._doc_ids.setdefault(record["doc_id"], []).append(vector_id)
+        self._records_path = None
+        
     def generate_response(self, query: str, retrieved_docs: List[Dict]) -> str:
         """
         Tạo câu trả lời dựa trên query và documents đã truy xuất
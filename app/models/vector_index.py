@@ -0,0 +1,209 @@
+from typing import Dict, Optional, Tuple
+import math
+import faiss
+import numpy as np
+
+# Các loại index FAISS được hỗ trợ
+INDEX_FLAT = "flat"
+INDEX_IVF_FLAT = "ivf_flat"
+INDEX_IVF_PQ = "ivf_pq"
+INDEX_HNSW = "hnsw"
+INDEX_AUTO = "auto"
+INDEX_TYPES = (INDEX_FLAT, INDEX_IVF_FLAT, INDEX_IVF_PQ, INDEX_HNSW)
+
+# Ngưỡng số vector khi chọn loại index tự động
+AUTO_FLAT_MAX_SIZE = 50_000
+
+# FAISS khuyến nghị ít nhất 39 điểm huấn luyện cho mỗi centroid
+TRAIN_POINTS_PER_CENTROID = 39
+DEFAULT_MAX_TRAIN_SIZE = 100_000
+
+DEFAULT_NPROBE = 16
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 80
+DEFAULT_EF_SEARCH = 64
+DEFAULT_PQ_NBITS = 8
+
+def choose_index_type(expected_size: int) -> str:
+    """
+    Chọn loại index theo kích thước corpus. Chỉ chọn các loại hỗ trợ xóa vector
+    (flat, IVF) để cập nhật index tăng dần; HNSW phải chọn tường minh. IVF-PQ cũng
+    phải chọn tường minh: không có bước xếp hạng lại bằng vector gốc, recall@10 với
+    pq_m mặc định chỉ khoảng 0.6 (IVF-Flat ~1.0), đổi lấy bộ nhớ nhỏ hơn nhiều lần.
+    """
+    if expected_size < AUTO_FLAT_MAX_SIZE:
+        return INDEX_FLAT
+    return INDEX_IVF_FLAT
+
+def resolve_index_type(index_type: str, expected_size: Optional[int] = None) -> str:
+    """
+    Chuẩn hóa tên loại index, "auto" được thay bằng loại phù hợp với expected_size
+    """
+    index_type = (index_type or INDEX_FLAT).lower()
+    if index_type == INDEX_AUTO:
+        return choose_index_type(expected_size or 0)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Loại index không hợp lệ: {index_type} (hỗ trợ: {', '.join(INDEX_TYPES)}, auto)")
+    return index_type
+
+def default_nlist(expected_size: Optional[int]) -> int:
+    """
+    Số cluster IVF mặc định ~ 4 * sqrt(N), đủ nhỏ để mỗi centroid có đủ điểm huấn luyện
+    """
+    if not expected_size:
+        return 256
+    nlist = int(4 * math.sqrt(expected_size))
+    return max(1, min(nlist, expected_size // TRAIN_POINTS_PER_CENTROID))
+
+def default_pq_m(dimension: int) -> int:
+    """
+    Số sub-quantizer PQ mặc định: ~8 chiều mỗi sub-vector, phải chia hết dimension
+    """
+    m = max(1, dimension // 8)
+    while dimension % m:
+        m -= 1
+    return m
+
+def supports_remove(index_type: str) -> bool:
+    """
+    HNSW của FAISS không hỗ trợ remove_ids, nên không cập nhật tăng dần được
+    """
+    return index_type != INDEX_HNSW
+
+def mmap_io_flags(index_type: str) -> int:
+    """
+    Cờ faiss.read_index để ánh xạ index chỉ đọc thay vì đọc vào bộ nhớ của tiến trình:
+    - IVF: IO_FLAG_MMAP nạp inverted lists dạng OnDiskInvertedLists (không dùng kèm
+      IO_FLAG_MMAP_IFC, FAISS báo lỗi với IVF);
+    - flat, HNSW: mảng vector chỉ được ánh xạ với IO_FLAG_MMAP_IFC (FAISS >= 1.10),
+      bản cũ hơn vẫn đọc toàn bộ vector.
+    """
+    if index_type in (INDEX_IVF_FLAT, INDEX_IVF_PQ):
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+def build_index(
+    index_type: str,
+    dimension: int,
+    expected_size: Optional[int] = None,
+    nlist: Optional[int] = None,
+    pq_m: Optional[int] = None,
+    pq_nbits: int = DEFAULT_PQ_NBITS,
+    hnsw_m: int = DEFAULT_HNSW_M,
+    ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+    **_
+) -> faiss.Index:
+    """
+    Tạo index FAISS (L2) hỗ trợ add_with_ids. Index IVF cần được huấn luyện trước khi thêm vector.
+    """
+    index_type = resolve_index_type(index_type, expected_size)
+    if index_type == INDEX_FLAT:
+        return faiss.IndexIDMap(faiss.IndexFlatL2(dimension))
+
+    if index_type == INDEX_HNSW:
+        hnsw = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        hnsw.hnsw.efConstruction = ef_construction
+        return faiss.IndexIDMap(hnsw)
+
+    # Index IVF tự quản lý ID nên không cần bọc IndexIDMap
+    nlist = nlist or default_nlist(expected_size)
+    quantizer = faiss.IndexFlatL2(dimension)
+    if index_type == INDEX_IVF_FLAT:
+        return faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    return faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m or default_pq_m(dimension), pq_nbits)
+
+def training_size(index: faiss.Index, max_train_size: int = DEFAULT_MAX_TRAIN_SIZE) -> int:
+    """
+    Số vector cần gom trước khi huấn luyện index (0 nếu index không cần huấn luyện)
+    """
+    if index.is_trained:
+        return 0
+    ivf = faiss.extract_index_ivf(index)
+    points = ivf.nlist * TRAIN_POINTS_PER_CENTROID
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        points = max(points, (1 << ivf.pq.nbits) * TRAIN_POINTS_PER_CENTROID)
+    return min(points, max_train_size)
+
+def train_index(index: faiss.Index, embeddings: np.ndarray, max_train_size: int = DEFAULT_MAX_TRAIN_SIZE, seed: int = 1234):
+    """
+    Huấn luyện index IVF trên một mẫu ngẫu nhiên tối đa max_train_size vector
+    """
+    if index.is_trained:
+        return
+    ivf = faiss.extract_index_ivf(index)
+    if len(embeddings) < ivf.nlist:
+        raise ValueError(f"Cần ít nhất {ivf.nlist} vector để huấn luyện index IVF, chỉ có {len(embeddings)}")
+    if len(embeddings) > max_train_size:
+        sample = np.random.default_rng(seed).choice(len(embeddings), max_train_size, replace=False)
+        embeddings = embeddings[np.sort(sample)]
+    index.train(embeddings)
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """
+    Đặt tham số tìm kiếm: nprobe cho IVF, efSearch cho HNSW
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search or DEFAULT_EF_SEARCH
+        return
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    ivf.nprobe = min(nprobe or DEFAULT_NPROBE, ivf.nlist)
+
+def index_type_of(index: faiss.Index) -> str:
+    """
+    Xác định loại index từ đối tượng FAISS (dùng khi nạp index từ đĩa)
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return INDEX_HNSW
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return INDEX_IVF_PQ
+    if isinstance(inner, faiss.IndexIVF):
+        return INDEX_IVF_FLAT
+    return INDEX_FLAT
+
+def recall_at_k(ground_truth: np.ndarray, results: np.ndarray, k: int) -> float:
+    """
+    Tỉ lệ trung bình k láng giềng đúng (theo index flat) được index xấp xỉ trả về
+    """
+    hits = 0
+    for expected, found in zip(ground_truth[:, :k], results[:, :k]):
+        hits += len(set(expected.tolist()) & set(found.tolist()))
+    return hits / float(ground_truth.shape[0] * k)
+
+def describe(index: faiss.Index) -> Dict:
+    """
+    Thông tin tóm tắt của index để báo cáo / ghi vào manifest
+    """
+    info = {"type": index_type_of(index), "ntotal": int(index.ntotal)}
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        info.update({"nlist": int(ivf.nlist), "nprobe": int(ivf.nprobe)})
+    except RuntimeError:
+        pass
+    return info
+
+def id_selector(mask: np.ndarray) -> Tuple[faiss.IDSelector, np.ndarray]:
+    """
+    Tạo IDSelectorBitmap từ mảng bool theo vector ID (mask[i] = True nếu ID i được chọn).
+    Trả về cả bitmap để giữ tham chiếu trong lúc tìm kiếm, vì FAISS không sao chép nó.
+    """
+    bitmap = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+    return faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)), bitmap
+
+def search_parameters(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """
+    Tham số tìm kiếm kèm bộ lọc ID, giữ nguyên nprobe/efSearch hiện tại của index
+    (tham số truyền theo lời gọi thay thế tham số đặt trên index)
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return faiss.SearchParameters(sel=selector)
+    return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
@@ -0,0 +1,96 @@
+from typing import Dict, Optional
+from loguru import logger
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from app.utils.lru_cache import LRUCache
+
+class AnalysisCache:
+    def __init__(self, db_path: Optional[Path] = None, maxsize: Optional[int] = None):
+        """
+        Cache kết quả phân tích văn bản theo nội dung: tầng LRU trong bộ nhớ
+        và tầng SQLite trên đĩa để giữ kết quả qua các lần khởi động lại
+        """
+        self.db_path = Path(db_path or os.getenv("ANALYSIS_CACHE_PATH", "app/data/analysis_cache.sqlite3"))
+        self.memory = LRUCache(maxsize=maxsize or int(os.getenv("ANALYSIS_CACHE_SIZE", "2000")))
+        self.disk_hits = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str, analysis_type: str, model: str, prompt_version: str) -> str:
+        """
+        Tạo key từ hash của văn bản, loại phân tích, model và phiên bản prompt
+        """
+        payload = json.dumps([text, analysis_type, model, prompt_version], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _read(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, key: str, value: Dict):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time())
+            )
+            conn.commit()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """
+        Tra cứu bộ nhớ trước, sau đó tới SQLite (ngoài event loop)
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        try:
+            value = await asyncio.to_thread(self._read, key)
+        except Exception as e:
+            logger.error(f"Error reading analysis cache: {str(e)}")
+            return None
+        if value is not None:
+            self.disk_hits += 1
+            self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: Dict):
+        """
+        Lưu kết quả vào cả hai tầng cache
+        """
+        self.memory.set(key, value)
+        try:
+            await asyncio.to_thread(self._write, key, value)
+        except Exception as e:
+            logger.error(f"Error writing analysis cache: {str(e)}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict:
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        return stats
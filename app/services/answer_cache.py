@@ -0,0 +1,145 @@
+from typing import Dict, List, Optional
+from loguru import logger
+import os
+import numpy as np
+from app.utils.lru_cache import LRUCache
+from app.utils.text_utils import clean_text
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None,
+        threshold: Optional[float] = None
+    ):
+        if maxsize is None:
+            maxsize = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+        if ttl is None:
+            ttl = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+        if threshold is None:
+            threshold = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        # Ngưỡng cosine similarity để coi hai câu hỏi là tương đương
+        self.threshold = threshold
+        # Embedding của các câu hỏi đã cache xếp chồng thành một ma trận để tra cứu bằng
+        # một phép nhân ma trận; hàng của mục đã bị LRUCache loại được dọn khi gặp lại
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        """
+        Chuẩn hóa câu hỏi làm key (bỏ dấu câu, khoảng trắng thừa, chữ hoa)
+        """
+        return clean_text(question)
+
+    def get_exact(self, question: str) -> Optional[Dict]:
+        """
+        Tra cứu theo câu hỏi đã chuẩn hóa, không cần tính embedding
+        """
+        entry = self.cache.get(self.normalize(question))
+        if entry is None:
+            return None
+        self.exact_hits += 1
+        return entry["result"]
+
+    def get_similar(self, embedding: Optional[np.ndarray]) -> Optional[Dict]:
+        """
+        Tra cứu câu hỏi tương tự nhất theo embedding (đã chuẩn hóa L2)
+        """
+        if embedding is not None and self._keys:
+            scores = self._matrix[:len(self._keys)] @ np.asarray(embedding, dtype=np.float32).ravel()
+            stale = []
+            try:
+                while True:
+                    best = int(np.argmax(scores))
+                    score = float(scores[best])
+                    if score < self.threshold:
+                        break
+                    entry = self.cache.get(self._keys[best])
+                    if entry is not None:
+                        self.semantic_hits += 1
+                        logger.debug(f"Semantic cache hit (similarity={score:.3f})")
+                        return entry["result"]
+                    # Mục đã hết hạn hoặc bị loại: thử câu hỏi tương tự kế tiếp
+                    stale.append(self._keys[best])
+                    scores[best] = -np.inf
+            finally:
+                for key in stale:
+                    self._remove_row(key)
+
+        self.misses += 1
+        return None
+
+    def _remove_row(self, key: str):
+        """
+        Xóa hàng của key khỏi ma trận embedding (chuyển hàng cuối vào chỗ trống)
+        """
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        last_key = self._keys.pop()
+        if last_key != key:
+            self._matrix[row] = self._matrix[len(self._keys)]
+            self._keys[row] = last_key
+            self._rows[last_key] = row
+
+    def _prune(self):
+        """
+        Xóa hàng của các mục không còn trong cache (bị loại theo LRU hoặc hết hạn)
+        """
+        for key in [key for key in self._keys if key not in self.cache]:
+            self._remove_row(key)
+
+    def set(self, question: str, embedding: Optional[np.ndarray], result: Dict):
+        """
+        Lưu câu trả lời cho câu hỏi
+        """
+        if embedding is None:
+            return
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        if self._keys and vector.shape[0] != self._matrix.shape[1]:
+            # Mô hình embedding đổi kích thước vector: các mục cũ không so sánh được
+            self.clear()
+        key = self.normalize(question)
+        self.cache.set(key, {"result": result})
+        row = self._rows.get(key)
+        if row is None:
+            # LRUCache loại mục mà không báo: dọn theo đợt khi số hàng gấp đôi maxsize
+            if len(self._keys) >= 2 * self.cache.maxsize:
+                self._prune()
+            row = len(self._keys)
+            if row >= self._matrix.shape[0]:
+                matrix = np.zeros((max(2 * row, 16), vector.shape[0]), dtype=np.float32)
+                if row:
+                    matrix[:row] = self._matrix[:row]
+                self._matrix = matrix
+            self._keys.append(key)
+            self._rows[key] = row
+        self._matrix[row] = vector
+
+    def clear(self):
+        self.cache.clear()
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._keys = []
+        self._rows = {}
+
+    def stats(self) -> Dict:
+        """
+        Thống kê hit/miss của cache câu trả lời
+        """
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "size": len(self.cache),
+            "maxsize": self.cache.maxsize,
+            "evictions": self.cache.evictions,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0
+        }
@@ -0,0 +1,184 @@
+from typing import Any, Callable, Dict, Optional
+from loguru import logger
+import asyncio
+import os
+import threading
+import time
+
+class ServiceContainer:
+    def __init__(self):
+        """
+        Tạo các service dùng chung một cách lười biếng: mỗi service chỉ được khởi tạo
+        một lần, ở lần truy cập đầu tiên, và được chia sẻ giữa các service khác.
+        Module service cũng chỉ được import khi cần để import app.main nhanh.
+        """
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._warm_up_task: Optional[asyncio.Task] = None
+        # Bật warm-up (nạp mô hình embedding, index, encode thử) ngay khi khởi động
+        self.warm_up_on_startup = os.getenv("WARM_UP_ON_STARTUP", "true").lower() == "true"
+        self.ready = False
+        self.started_at: Optional[float] = None
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Lấy service theo tên, tạo bằng factory nếu chưa có (an toàn giữa các luồng)
+        """
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = factory()
+                self.timings[f"build_{name}"] = round(time.perf_counter() - start, 4)
+                logger.debug(f"Built service {name} in {self.timings[f'build_{name}']}s")
+            return self._instances[name]
+
+    @property
+    def llm_service(self):
+        from app.services.llm_service import LLMService
+        return self._get("llm_service", LLMService)
+
+    @property
+    def analysis_cache(self):
+        from app.services.analysis_cache import AnalysisCache
+        return self._get("analysis_cache", AnalysisCache)
+
+    @property
+    def deepseek_service(self):
+        from app.services.deepseek_service import DeepSeekService
+        return self._get("deepseek_service", lambda: DeepSeekService(self.analysis_cache))
+
+    @property
+    def knowledge_base_store(self):
+        from app.services.knowledge_base_store import KnowledgeBaseStore
+        return self._get("knowledge_base_store", KnowledgeBaseStore)
+
+    @property
+    def rag_service(self):
+        from app.services.rag_service import RAGService
+        return self._get("rag_service", lambda: RAGService(self.llm_service, self.knowledge_base_store))
+
+    @property
+    def search_service(self):
+        from app.services.search_service import SearchService
+        return self._get("search_service", lambda: SearchService(
+            self.rag_service,
+            self.knowledge_base_store,
+            llm_service=self.llm_service,
+            deepseek_service=self.deepseek_service
+        ))
+
+    @property
+    def post_analysis_service(self):
+        from app.services.post_analysis_service import PostAnalysisService
+        return self._get("post_analysis_service", lambda: PostAnalysisService(
+            llm_service=self.llm_service,
+            deepseek_service=self.deepseek_service
+        ))
+
+    def get_if_built(self, name: str) -> Optional[Any]:
+        """
+        Trả về service nếu đã được tạo, không tạo mới (dùng khi tắt ứng dụng / báo cáo)
+        """
+        return self._instances.get(name)
+
+    async def warm_up(self):
+        """
+        Tạo các service, nạp mô hình embedding và index, encode một câu để lần truy vấn
+        đầu tiên không phải chịu chi phí khởi tạo. Lỗi được ghi lại cho /health.
+        """
+        start = time.perf_counter()
+        try:
+            rag_service = self.rag_service
+            await rag_service.initialize()
+            if rag_service.rag_model is None:
+                raise RuntimeError("RAG model failed to initialize")
+            await rag_service.retrieve("warm up", k=1)
+            self.timings["warm_up_rag"] = round(time.perf_counter() - start, 4)
+
+            self.ready = True
+            self.errors.pop("warm_up", None)
+            logger.info(f"Services ready in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            self.errors["warm_up"] = str(e)
+            logger.error(f"Error warming up services: {str(e)}")
+        finally:
+            self.timings["warm_up"] = round(time.perf_counter() - start, 4)
+
+    def _start_background_refresh(self):
+        """
+        Khởi động cập nhật cơ sở tri thức nền, độc lập với warm-up (kể cả khi warm-up
+        bị tắt hoặc lỗi); lỗi khi tạo service được ghi lại cho /health
+        """
+        try:
+            self.search_service.start_background_refresh()
+            self.errors.pop("background_refresh", None)
+        except Exception as e:
+            self.errors["background_refresh"] = str(e)
+            logger.error(f"Error starting knowledge base refresh: {str(e)}")
+
+    async def startup(self):
+        """
+        Khởi tạo HTTP client dùng chung, chạy warm-up nền và tác vụ cập nhật cơ sở
+        tri thức; ứng dụng nhận request ngay, /health báo chưa sẵn sàng cho tới khi warm-up xong
+        """
+        from app.services.http_client import start_http_client
+
+        self.started_at = time.time()
+        await start_http_client()
+        if self.warm_up_on_startup:
+            self._warm_up_task = asyncio.create_task(self.warm_up())
+        else:
+            self.ready = True
+        self._start_background_refresh()
+
+    async def shutdown(self):
+        """
+        Hủy warm-up đang chạy, dừng tác vụ nền, đóng HTTP client và cache trên đĩa
+        """
+        from app.services.http_client import close_http_client
+
+        if self._warm_up_task is not None and not self._warm_up_task.done():
+            self._warm_up_task.cancel()
+            await asyncio.gather(self._warm_up_task, return_exceptions=True)
+        search_service = self.get_if_built("search_service")
+        if search_service is not None:
+            await search_service.stop_background_refresh()
+        rag_service = self.get_if_built("rag_service")
+        if rag_service is not None:
+            await rag_service.close()
+        await close_http_client()
+        analysis_cache = self.get_if_built("analysis_cache")
+        if analysis_cache is not None:
+            analysis_cache.close()
+
+    def health(self) -> Dict:
+        """
+        Trạng thái sẵn sàng của ứng dụng và các service đã khởi tạo
+        """
+        rag_service = self.get_if_built("rag_service")
+        rag_model = rag_service.rag_model if rag_service is not None else None
+        warming_up = self._warm_up_task is not None and not self._warm_up_task.done()
+        if self.ready:
+            status = "ok"
+        elif warming_up:
+            status = "starting"
+        else:
+            status = "unavailable"
+        return {
+            "status": status,
+            "ready": self.ready,
+            "uptime": round(time.time() - self.started_at, 1) if self.started_at else 0.0,
+            "services": sorted(self._instances),
+            "rag_index": {
+                "loaded": rag_model is not None,
+                "documents": int(rag_model.index.ntotal) if rag_model is not None else 0,
+                "type": rag_model.index_type if rag_model is not None else None
+            },
+            "timings": self.timings,
+            "errors": self.errors
+        }
@@ -1,14 +1,23 @@
 import os
-from typing import List, Dict
+from typing import List, Dict, Optional, Set, Union
+import asyncio
+import hashlib
 import json
+from urllib.parse import urldefrag, urljoin, urlparse
 from bs4 import BeautifulSoup
-import requests
+import httpx
+from loguru import logger
+from app.services.http_client import get_http_client
 
 class DataService:
     def __init__(self, data_dir: str = "data/raw"):
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
-        
+        # Trạng thái crawl của từng URL (ETag, Last-Modified, hash nội dung) để bỏ qua trang không đổi
+        self.crawl_state_path = os.path.join(data_dir, "crawl_state.json")
+        self.per_host_limit = int(os.getenv("CRAWL_PER_HOST_LIMIT", "4"))
+        self.crawl_concurrency = int(os.getenv("CRAWL_CONCURRENCY", "16"))
+
     def save_document(self, content: str, metadata: Dict, filename: str):
         """
         Lưu document và metadata vào file
@@ -20,7 +29,18 @@ class DataService:
         }
         with open(filepath, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
-            
+
+    def _remove_stale_documents(self, prefix: str, count: int):
+        """
+        Xóa các file {prefix}{i}.json có i >= count (trang nay có ít bài viết hơn lần trước)
+        """
+        for filename in os.listdir(self.data_dir):
+            if not (filename.startswith(prefix) and filename.endswith(".json")):
+                continue
+            index = filename[len(prefix):-len(".json")]
+            if index.isdigit() and int(index) >= count:
+                os.remove(os.path.join(self.data_dir, filename))
+
     def load_document(self, filename: str) -> Dict:
         """
         Đọc document từ file
@@ -28,35 +48,190 @@ class DataService:
         filepath = os.path.join(self.data_dir, filename)
         with open(filepath, "r", encoding="utf-8") as f:
             return json.load(f)
-            
-    def crawl_facebook_help(self, url: str) -> List[Dict]:
+
+    def _load_crawl_state(self) -> Dict[str, Dict]:
         """
-        Crawl dữ liệu từ trang trợ giúp Facebook
+        Đọc trạng thái crawl lần trước
         """
+        if not os.path.exists(self.crawl_state_path):
+            return {}
         try:
-            response = requests.get(url)
-            soup = BeautifulSoup(response.text, "html.parser")
-            
-            # TODO: Implement specific crawling logic for Facebook Help
-            # This is just a placeholder
-            documents = []
-            for article in soup.find_all("article"):
-                title = article.find("h2").text
-                content = article.find("div", class_="content").text
-                documents.append({
-                    "content": content,
-                    "metadata": {
-                        "title": title,
-                        "source": url
-                    }
-                })
-                
-            return documents
-            
+            with open(self.crawl_state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
         except Exception as e:
-            print(f"Error crawling Facebook Help: {str(e)}")
-            return []
-            
+            logger.error(f"Error loading crawl state: {str(e)}")
+            return {}
+
+    def _save_crawl_state(self, state: Dict[str, Dict]):
+        """
+        Lưu trạng thái crawl (ghi file tạm rồi thay thế)
+        """
+        tmp_path = f"{self.crawl_state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.crawl_state_path)
+
+    def _parse_help_page(self, url: str, html: str) -> Dict:
+        """
+        Trích xuất các bài viết và liên kết từ một trang trợ giúp Facebook
+        """
+        soup = BeautifulSoup(html, "html.parser")
+
+        documents = []
+        for article in soup.find_all("article"):
+            title = article.find("h2")
+            content = article.find("div", class_="content")
+            if not title or not content:
+                continue
+            documents.append({
+                "content": content.get_text(" ", strip=True),
+                "metadata": {
+                    "title": title.get_text(strip=True),
+                    "source": url
+                }
+            })
+
+        links = []
+        for anchor in soup.find_all("a", href=True):
+            link, _ = urldefrag(urljoin(url, anchor["href"]))
+            if urlparse(link).scheme in ("http", "https"):
+                links.append(link)
+
+        return {"documents": documents, "links": links}
+
+    async def _fetch_page(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        state: Dict,
+        host_limits: Dict[str, asyncio.Semaphore]
+    ) -> Optional[httpx.Response]:
+        """
+        GET có điều kiện (If-None-Match / If-Modified-Since), giới hạn số kết nối mỗi host
+        """
+        headers = {}
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+        host = urlparse(url).netloc
+        semaphore = host_limits.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+        async with semaphore:
+            try:
+                return await client.get(url, headers=headers, follow_redirects=True)
+            except httpx.HTTPError as e:
+                logger.warning(f"Error fetching {url}: {str(e)}")
+                return None
+
+    async def crawl_facebook_help(
+        self,
+        start_urls: Union[str, List[str]],
+        max_pages: int = 100,
+        follow_links: bool = True,
+        client: Optional[httpx.AsyncClient] = None
+    ) -> List[Dict]:
+        """
+        Crawl dữ liệu từ trang trợ giúp Facebook.
+        Các trang trong frontier được tải song song (giới hạn theo host), trang không đổi
+        (304 hoặc cùng hash nội dung) được bỏ qua; chỉ trả về và lưu các document mới/thay đổi.
+        """
+        if isinstance(start_urls, str):
+            start_urls = [start_urls]
+        client = client or get_http_client()
+
+        crawl_state = await asyncio.to_thread(self._load_crawl_state)
+        # Chỉ theo các liên kết cùng host và cùng tiền tố đường dẫn với URL bắt đầu
+        scopes = [(urlparse(url).netloc, urlparse(url).path.rsplit("/", 1)[0]) for url in start_urls]
+
+        def in_scope(link: str) -> bool:
+            parsed = urlparse(link)
+            return any(parsed.netloc == host and parsed.path.startswith(prefix) for host, prefix in scopes)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        seen: Set[str] = set()
+        # Trang trả về 304 không có nội dung để lấy liên kết, nên nạp lại các URL
+        # đã crawl lần trước vào frontier để không bỏ sót trang con
+        known_urls = [url for url in crawl_state if follow_links and in_scope(url)]
+        for url in list(start_urls) + known_urls:
+            if url not in seen and len(seen) < max_pages:
+                seen.add(url)
+                queue.put_nowait(url)
+
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+        changed_documents: List[Dict] = []
+        stats = {"fetched": 0, "not_modified": 0, "unchanged": 0, "changed": 0, "failed": 0}
+
+        async def worker():
+            while True:
+                url = await queue.get()
+                try:
+                    await process(url)
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.error(f"Error crawling {url}: {str(e)}")
+                finally:
+                    queue.task_done()
+
+        async def process(url: str):
+            state = crawl_state.get(url, {})
+            response = await self._fetch_page(client, url, state, host_limits)
+            if response is None or response.status_code not in (200, 304):
+                stats["failed"] += 1
+                return
+            stats["fetched"] += 1
+
+            if response.status_code == 304:
+                stats["not_modified"] += 1
+                return
+
+            html = response.text
+            parsed = await asyncio.to_thread(self._parse_help_page, url, html)
+            content_hash = hashlib.sha256(
+                json.dumps(parsed["documents"], ensure_ascii=False, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+
+            if content_hash == state.get("content_hash"):
+                stats["unchanged"] += 1
+            else:
+                stats["changed"] += 1
+                url_key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+                for i, document in enumerate(parsed["documents"]):
+                    await asyncio.to_thread(
+                        self.save_document,
+                        document["content"],
+                        document["metadata"],
+                        f"help_{url_key}_{i}.json"
+                    )
+                await asyncio.to_thread(self._remove_stale_documents, f"help_{url_key}_", len(parsed["documents"]))
+                changed_documents.extend(parsed["documents"])
+
+            crawl_state[url] = {
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+                "content_hash": content_hash
+            }
+
+            if follow_links:
+                for link in parsed["links"]:
+                    if len(seen) >= max_pages:
+                        break
+                    if link not in seen and in_scope(link):
+                        seen.add(link)
+                        queue.put_nowait(link)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.crawl_concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        await asyncio.to_thread(self._save_crawl_state, crawl_state)
+        logger.info(f"Crawled {len(seen)} URLs: {stats}")
+        return changed_documents
+
     def process_facebook_post(self, post_url: str) -> Dict:
         """
         Xử lý và phân tích bài đăng Facebook
@@ -70,4 +245,4 @@ class DataService:
                 "comments": 10,
                 "shares": 5
             }
-        } 
\ No newline at end of file
+        }
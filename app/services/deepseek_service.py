@@ -1,20 +1,70 @@
-from typing import Dict, List
-import aiohttp
+from typing import Dict, List, Optional
 from loguru import logger
 import os
 import json
+import httpx
+from app.services.http_client import get_http_client
+from app.services.model_router import ModelCallError, ModelRouter, check_response
+from app.services.analysis_cache import AnalysisCache
+from app.utils.context_builder import ContextBuilder, TokenUsage, count_message_tokens
+from app.utils.text_utils import truncate_to_tokens
+
+# Tăng khi thay đổi prompt phân tích để không dùng lại kết quả cache cũ
+PROMPT_VERSION = "2"
+
+# Số token tối thiểu giữ lại cho mỗi văn bản khi phân tích theo lô
+MIN_BATCH_TEXT_TOKENS = 64
+
+def compact_prompt(prompt: str) -> str:
+    """
+    Bỏ khoảng trắng thụt lề ở đầu mỗi dòng của prompt (không mang thông tin nhưng vẫn tốn token)
+    """
+    return "\n".join(line.strip() for line in prompt.strip().splitlines())
 
 class DeepSeekService:
-    def __init__(self):
+    def __init__(self, analysis_cache: Optional[AnalysisCache] = None):
         self.api_key = os.getenv("OPENROUTER_API_KEY")
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
-        self.model = "deepseek/deepseek-r1-zero:free"
+        self.api_url = os.getenv("DEEPSEEK_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+        # Model chính và các model dự phòng (phân tách bằng dấu phẩy). Mặc định chỉ dùng
+        # model miễn phí; thêm model dự phòng (có thể tính phí) qua biến môi trường
+        models = [model.strip() for model in os.getenv("DEEPSEEK_MODELS", "deepseek/deepseek-r1-zero:free").split(",") if model.strip()]
+        self.model = models[0]
+        self.timeout = 30.0
+        self.router = ModelRouter.from_env(models, max_attempts=3)
+        self.analysis_cache = analysis_cache or AnalysisCache()
+        # Giới hạn token (đếm cục bộ) của cơ sở tri thức trong prompt tìm kiếm,
+        # của văn bản cần phân tích và của câu hỏi
+        self.context_tokens = int(os.getenv("DEEPSEEK_CONTEXT_TOKENS", "2000"))
+        self.input_max_tokens = int(os.getenv("DEEPSEEK_INPUT_MAX_TOKENS", "1500"))
+        self.question_max_tokens = int(os.getenv("DEEPSEEK_QUESTION_MAX_TOKENS", "256"))
+        self.context_builder = ContextBuilder(self.context_tokens)
+        self.token_usage = TokenUsage()
+        
+    async def _request(self, model: str, headers: Dict[str, str], data: Dict) -> Dict:
+        """
+        Gửi request tới một model; 429/5xx/timeout là ModelCallError để router chuyển model khác
+        """
+        client = get_http_client()
+        try:
+            response = await client.post(self.api_url, headers=headers, json={**data, "model": model}, timeout=self.timeout)
+        except httpx.TimeoutException:
+            raise ModelCallError(f"Timeout calling {model}")
+        except httpx.HTTPError as e:
+            raise ModelCallError(f"HTTP error calling {model}: {str(e)}")
+        check_response(response, model)
+        if response.status_code != 200:
+            logger.error(f"OpenRouter API error: {response.text}")
+            raise Exception(f"OpenRouter API error: {response.status_code}")
+        return response.json()
         
-    async def get_completion(self, prompt: str, max_tokens: int = 1000) -> Dict:
+    async def get_completion(self, prompt: str, max_tokens: int = 1000, usage: Optional[Dict] = None) -> Dict:
         """
-        Gọi API OpenRouter để lấy kết quả
+        Gọi API OpenRouter để lấy kết quả, định tuyến qua ModelRouter (hedging, chuyển model
+        khi lỗi). usage (thống kê cắt/chọn ngữ cảnh của prompt) được bổ sung số token ước
+        lượng và số token API trả về, rồi trả kèm kết quả.
         """
         try:
+            prompt = compact_prompt(prompt)
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json",
@@ -23,7 +73,6 @@ class DeepSeekService:
             }
             
             data = {
-                "model": self.model,
                 "messages": [
                     {"role": "system", "content": "Bạn là một trợ lý AI chuyên gia về Facebook, có khả năng phân tích và tìm kiếm thông tin chính xác."},
                     {"role": "user", "content": prompt}
@@ -33,28 +82,58 @@ class DeepSeekService:
                 "top_p": 0.95
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, headers=headers, json=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            "answer": result["choices"][0]["message"]["content"],
-                            "sources": []  # OpenRouter không cung cấp sources
-                        }
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"OpenRouter API error: {error_text}")
-                        raise Exception(f"OpenRouter API error: {response.status}")
+            usage = dict(usage or {})
+            usage["estimated_prompt_tokens"] = count_message_tokens(data["messages"])
+            
+            try:
+                result, model = await self.router.run(lambda model: self._request(model, headers, data))
+            except ModelCallError as e:
+                raise Exception(f"OpenRouter API error: {str(e)}")
+            api_usage = result.get("usage") or {}
+            usage["prompt_tokens"] = api_usage.get("prompt_tokens")
+            usage["completion_tokens"] = api_usage.get("completion_tokens")
+            usage["model"] = model
+            logger.info(f"Prompt usage ({model}): {usage}")
+            self.token_usage.record(usage)
+            return {
+                "answer": result["choices"][0]["message"]["content"],
+                "sources": [],  # OpenRouter không cung cấp sources
+                "model": model,
+                "usage": usage
+            }
                         
         except Exception as e:
             logger.error(f"Error in OpenRouter API call: {str(e)}")
             raise
             
+    def _analysis_key(self, text: str, analysis_type: str, model: Optional[str] = None) -> str:
+        return AnalysisCache.make_key(text, analysis_type, model or self.model, PROMPT_VERSION)
+        
+    async def _get_cached_analysis(self, text: str, analysis_type: str) -> Optional[Dict]:
+        """
+        Tìm kết quả đã cache theo từng model (model chính trước, rồi các model dự phòng),
+        vì kết quả được lưu theo model đã thực sự trả lời
+        """
+        for model in self.router.models:
+            cached = await self.analysis_cache.get(self._analysis_key(text, analysis_type, model))
+            if cached is not None:
+                return cached
+        return None
+        
     async def analyze_text(self, text: str, analysis_type: str = "general") -> Dict:
         """
-        Phân tích văn bản với DeepSeek
+        Phân tích văn bản với DeepSeek, dùng lại kết quả đã cache cho cùng nội dung
         """
         try:
+            cached = await self._get_cached_analysis(text, analysis_type)
+            if cached is not None:
+                return cached
+            original_text = text
+                
+            # Bài đăng quá dài được cắt ở ranh giới câu
+            text, _, truncated = truncate_to_tokens(text, self.input_max_tokens)
+            usage = {"truncated": int(truncated)}
+            
             if analysis_type == "general":
                 prompt = f"""
                 Phân tích văn bản sau đây một cách chi tiết:
@@ -93,26 +172,121 @@ class DeepSeekService:
                     "keywords": ["từ 1", "từ 2", ...]
                 }}
                 """
+            elif analysis_type == "combined":
+                prompt = f"""
+                Phân tích văn bản sau đây một cách chi tiết:
+                
+                {text}
+                
+                Hãy cung cấp:
+                1. Tóm tắt nội dung chính
+                2. Các chủ đề được đề cập
+                3. Các điểm quan trọng
+                4. Cảm xúc chính (tích cực/tiêu cực/trung tính)
+                5. Mức độ cảm xúc (0-1)
+                6. Các từ khóa cảm xúc
+                
+                Định dạng trả về:
+                {{
+                    "summary": "tóm tắt",
+                    "topics": ["chủ đề 1", "chủ đề 2", ...],
+                    "key_points": ["điểm 1", "điểm 2", ...],
+                    "sentiment": "cảm xúc",
+                    "intensity": 0.5,
+                    "keywords": ["từ 1", "từ 2", ...]
+                }}
+                """
             else:
                 raise ValueError(f"Unknown analysis type: {analysis_type}")
                 
-            result = await self.get_completion(prompt)
-            return json.loads(result["answer"])
+            result = await self.get_completion(prompt, usage=usage)
+            analysis = json.loads(result["answer"])
+            await self.analysis_cache.set(self._analysis_key(original_text, analysis_type, result["model"]), analysis)
+            return analysis
             
         except Exception as e:
             logger.error(f"Error in analyze_text: {str(e)}")
             raise
             
+    async def analyze_texts_batch(self, texts: List[str]) -> List[Dict]:
+        """
+        Phân tích tổng quan nhiều văn bản trong một lần gọi API.
+        Chỉ các văn bản chưa có trong cache mới được gửi đi.
+        """
+        try:
+            # Kết quả cùng định dạng với analyze_text(..., "general") nên dùng chung cache
+            analyses = [await self._get_cached_analysis(text, "general") for text in texts]
+            missing = [i for i, analysis in enumerate(analyses) if analysis is None]
+            if not missing:
+                return analyses
+            if len(missing) == 1:
+                i = missing[0]
+                analyses[i] = await self.analyze_text(texts[i], "general")
+                return analyses
+                
+            # Chia đều giới hạn token cho các văn bản trong lô
+            text_budget = max(self.input_max_tokens // len(missing), MIN_BATCH_TEXT_TOKENS)
+            missing_texts = []
+            usage = {"truncated": 0}
+            for i in missing:
+                text, _, truncated = truncate_to_tokens(texts[i], text_budget)
+                missing_texts.append(text)
+                usage["truncated"] += int(truncated)
+            numbered_texts = "\n\n".join(
+                f"Văn bản {i}:\n{text}" for i, text in enumerate(missing_texts, 1)
+            )
+            prompt = f"""
+            Phân tích từng văn bản sau đây:
+            
+            {numbered_texts}
+            
+            Với mỗi văn bản, hãy cung cấp:
+            1. Tóm tắt nội dung chính
+            2. Các chủ đề được đề cập
+            3. Cảm xúc và giọng điệu
+            4. Các điểm quan trọng
+            
+            Định dạng trả về là một mảng JSON gồm đúng {len(missing_texts)} phần tử, theo thứ tự các văn bản:
+            [
+                {{
+                    "summary": "tóm tắt",
+                    "topics": ["chủ đề 1", "chủ đề 2", ...],
+                    "sentiment": "cảm xúc",
+                    "key_points": ["điểm 1", "điểm 2", ...]
+                }}
+            ]
+            
+            Chỉ trả về JSON, không kèm text khác.
+            """
+            
+            result = await self.get_completion(prompt, max_tokens=400 * len(missing_texts), usage=usage)
+            batch_analyses = json.loads(result["answer"])
+            if not isinstance(batch_analyses, list) or len(batch_analyses) != len(missing_texts):
+                raise ValueError("Số kết quả phân tích không khớp với số văn bản")
+                
+            for i, analysis in zip(missing, batch_analyses):
+                analyses[i] = analysis
+                await self.analysis_cache.set(self._analysis_key(texts[i], "general", result["model"]), analysis)
+            return analyses
+            
+        except Exception as e:
+            logger.error(f"Error in analyze_texts_batch: {str(e)}")
+            raise
+            
     async def search_knowledge(self, query: str, knowledge_base: List[Dict]) -> List[Dict]:
         """
-        Tìm kiếm thông tin trong cơ sở tri thức với DeepSeek
+        Xếp hạng lại và giải thích các mục ứng viên (đã được chọn trước cục bộ) với DeepSeek
         """
         try:
-            # Chuyển đổi knowledge_base thành chuỗi JSON
-            kb_text = "\n".join([
-                f"Tiêu đề: {item.get('title', '')}\nNội dung: {item.get('content', '')}\n"
-                for item in knowledge_base
-            ])
+            # Các mục đã được xếp hạng: chọn theo thứ tự trong giới hạn token, mỗi mục
+            # không quá phần chia đều của giới hạn, bỏ mục gần trùng lặp
+            query, _, query_truncated = truncate_to_tokens(query, self.question_max_tokens)
+            packed, usage = self.context_builder.pack(
+                [f"Tiêu đề: {item.get('title', '')}\nNội dung: {item.get('content', '')}" for item in knowledge_base],
+                max_passage_tokens=max(self.context_tokens // max(len(knowledge_base), 1), MIN_BATCH_TEXT_TOKENS)
+            )
+            usage["truncated"] += int(query_truncated)
+            kb_text = "\n\n".join(text for _, text in packed)
             
             prompt = f"""
             Tìm kiếm thông tin liên quan đến câu hỏi sau trong cơ sở tri thức:
@@ -135,7 +309,7 @@ class DeepSeekService:
             Chỉ trả về JSON, không kèm text khác.
             """
             
-            result = await self.get_completion(prompt)
+            result = await self.get_completion(prompt, usage=usage)
             try:
                 # Thử parse JSON từ kết quả
                 search_results = json.loads(result["answer"])
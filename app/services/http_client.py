@@ -0,0 +1,67 @@
+import os
+from typing import Optional
+import httpx
+from loguru import logger
+
+# Client HTTP dùng chung cho toàn bộ ứng dụng (OpenRouter, Graph API, crawler)
+_client: Optional[httpx.AsyncClient] = None
+
+def _http2_available() -> bool:
+    """
+    Kiểm tra thư viện h2 đã được cài đặt để bật HTTP/2 hay chưa
+    """
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _build_client() -> httpx.AsyncClient:
+    """
+    Tạo AsyncClient với connection pool và keep-alive theo cấu hình môi trường
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+    )
+    timeout = httpx.Timeout(
+        float(os.getenv("HTTP_TIMEOUT", "30")),
+        connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+    )
+    http2 = os.getenv("HTTP_ENABLE_HTTP2", "true").lower() == "true" and _http2_available()
+
+    logger.info(
+        f"Creating shared HTTP client (http2={http2}, "
+        f"max_connections={limits.max_connections}, "
+        f"max_keepalive={limits.max_keepalive_connections})"
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+async def start_http_client() -> httpx.AsyncClient:
+    """
+    Khởi tạo client dùng chung khi ứng dụng khởi động
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Lấy client dùng chung, tự tạo nếu chưa được khởi tạo (ví dụ khi chạy script)
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+async def close_http_client():
+    """
+    Đóng client dùng chung khi ứng dụng tắt
+    """
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("Shared HTTP client closed")
+    _client = None
@@ -0,0 +1,134 @@
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+from pathlib import Path
+from datetime import datetime
+import asyncio
+import json
+import os
+import threading
+
+class KnowledgeBaseStore:
+    def __init__(
+        self,
+        knowledge_base_path: Path = Path("app/data/knowledge_base.json"),
+        last_update_path: Path = Path("app/data/last_update.json")
+    ):
+        self.knowledge_base_path = Path(knowledge_base_path)
+        self.last_update_path = Path(last_update_path)
+
+        # Bản cơ sở tri thức đã parse, chỉ đọc lại khi (mtime, size) của file thay đổi
+        self._items: List[Dict] = []
+        self._signature: Optional[Tuple[int, int]] = None
+        self._last_update: Optional[datetime] = None
+        # Tăng mỗi khi nội dung cơ sở tri thức trong bộ nhớ thay đổi
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        """
+        Lấy (mtime, size) của file cơ sở tri thức, None nếu file không tồn tại
+        """
+        try:
+            stat = self.knowledge_base_path.stat()
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> List[Dict]:
+        """
+        Trả về cơ sở tri thức đã cache, chỉ parse lại file JSON khi file thay đổi.
+        Hàm đồng bộ, cần gọi qua get() từ event loop.
+        """
+        with self._lock:
+            signature = self._file_signature()
+            if signature == self._signature:
+                return self._items
+
+            if signature is None:
+                logger.warning("Knowledge base file not found")
+                items = []
+            else:
+                try:
+                    with open(self.knowledge_base_path, "r", encoding="utf-8") as f:
+                        items = json.load(f)
+                except Exception as e:
+                    logger.error(f"Error loading knowledge base: {str(e)}")
+                    return self._items
+
+            self._items = items
+            self._signature = signature
+            self.version += 1
+            logger.info(f"Loaded knowledge base with {len(items)} items (version {self.version})")
+            return self._items
+
+    async def get(self) -> List[Dict]:
+        """
+        Lấy cơ sở tri thức đã cache; kiểm tra thay đổi file ngoài event loop.
+        Danh sách trả về được dùng chung, không được sửa trực tiếp.
+        """
+        return await asyncio.to_thread(self.load)
+
+    def _save(self, items: List[Dict]):
+        """
+        Ghi cơ sở tri thức ra file tạm rồi thay thế file cũ, sau đó cập nhật cache
+        """
+        with self._lock:
+            self.knowledge_base_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.knowledge_base_path.with_suffix(".json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.knowledge_base_path)
+
+            self._items = items
+            self._signature = self._file_signature()
+            self.version += 1
+
+    async def save(self, items: List[Dict]):
+        """
+        Lưu cơ sở tri thức (ngoài event loop)
+        """
+        try:
+            await asyncio.to_thread(self._save, items)
+        except Exception as e:
+            logger.error(f"Error saving knowledge base: {str(e)}")
+
+    def _read_last_update(self) -> datetime:
+        """
+        Đọc thời gian cập nhật cuối cùng từ file
+        """
+        try:
+            if self.last_update_path.exists():
+                with open(self.last_update_path, "r") as f:
+                    data = json.load(f)
+                    return datetime.fromisoformat(data["last_update"])
+            return datetime.min
+        except Exception as e:
+            logger.error(f"Error getting last update: {str(e)}")
+            return datetime.min
+
+    async def get_last_update(self) -> datetime:
+        """
+        Lấy thời gian cập nhật cuối cùng, chỉ đọc file ở lần gọi đầu tiên
+        """
+        if self._last_update is None:
+            self._last_update = await asyncio.to_thread(self._read_last_update)
+        return self._last_update
+
+    def _write_last_update(self, timestamp: datetime):
+        """
+        Ghi thời gian cập nhật cuối cùng ra file
+        """
+        self.last_update_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.last_update_path, "w") as f:
+            json.dump({"last_update": timestamp.isoformat()}, f)
+
+    async def save_last_update(self):
+        """
+        Lưu thời gian cập nhật cuối cùng (ngoài event loop)
+        """
+        timestamp = datetime.now()
+        try:
+            await asyncio.to_thread(self._write_last_update, timestamp)
+            self._last_update = timestamp
+        except Exception as e:
+            logger.error(f"Error saving last update: {str(e)}")
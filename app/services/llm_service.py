@@ -1,7 +1,12 @@
 import os
+import json
 import httpx
-from typing import Dict, List
+from typing import AsyncIterator, Dict, Optional, Tuple
 from loguru import logger
+from app.services.http_client import get_http_client
+from app.services.model_router import ModelCallError, ModelRouter, check_response
+from app.utils.context_builder import ContextBuilder, TokenUsage, count_message_tokens
+from app.utils.text_utils import truncate_to_tokens
 
 class LLMService:
     def __init__(self):
@@ -10,97 +15,250 @@ class LLMService:
             logger.error("OPENROUTER_API_KEY not found in environment variables")
             raise ValueError("OPENROUTER_API_KEY is required")
             
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
-        # Sử dụng model phổ biến và ổn định hơn
-        self.model = "mistralai/mistral-7b-instruct"
+        # URL cấu hình được để chạy với server giả lập (API tương thích OpenAI)
+        self.api_url = os.getenv("LLM_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+        # Model chính (phổ biến và ổn định) và các model dự phòng, phân tách bằng dấu phẩy
+        models = [model.strip() for model in os.getenv("LLM_MODELS", "mistralai/mistral-7b-instruct").split(",") if model.strip()]
+        self.model = models[0]
         self.timeout = 30.0
         self.max_retries = 3
+        self.router = ModelRouter.from_env(models, max_attempts=self.max_retries)
+        # Giới hạn token (đếm cục bộ) của ngữ cảnh tài liệu và câu hỏi trong prompt
+        self.context_tokens = int(os.getenv("LLM_CONTEXT_TOKENS", "1500"))
+        self.question_max_tokens = int(os.getenv("LLM_QUESTION_MAX_TOKENS", "256"))
+        self.context_builder = ContextBuilder(self.context_tokens)
+        self.token_usage = TokenUsage()
 
-    async def get_completion(self, question: str) -> Dict[str, List[str]]:
+    def _build_headers(self) -> Dict[str, str]:
         """
-        Gọi API để lấy câu trả lời từ model
+        Tạo headers cho request tới OpenRouter
         """
-        headers = {
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
             "HTTP-Referer": "http://localhost:8000",
             "X-Title": "Facebook RAG Chatbot"
         }
 
+    def _build_payload(
+        self,
+        question: str,
+        context: Optional[str] = None,
+        stream: bool = False,
+        usage: Optional[Dict] = None
+    ) -> Tuple[Dict, Dict]:
+        """
+        Tạo payload cho request tới OpenRouter cùng thống kê token của prompt
+        (bổ sung vào usage, ví dụ thống kê chọn ngữ cảnh của ContextBuilder).
+        Câu hỏi và ngữ cảnh vượt giới hạn token được cắt ở ranh giới câu.
+        """
+        question, _, question_truncated = truncate_to_tokens(question, self.question_max_tokens)
+        context_truncated = False
+        if context:
+            context, _, context_truncated = truncate_to_tokens(context, self.context_tokens)
+        if context:
+            system_prompt = (
+                "Bạn là một chatbot chuyên gia về Facebook. Hãy trả lời câu hỏi ngắn gọn, "
+                "chỉ dựa trên các tài liệu tham khảo được cung cấp. Nếu tài liệu không chứa "
+                "thông tin cần thiết, hãy nói rằng bạn không tìm thấy thông tin."
+            )
+            user_content = f"Tài liệu tham khảo:\n{context}\n\nCâu hỏi: {question}"
+        else:
+            system_prompt = "Bạn là một chatbot chuyên gia về Facebook. Hãy trả lời câu hỏi dựa trên kiến thức của bạn."
+            user_content = question
+
         messages = [
-            {"role": "system", "content": "Bạn là một chatbot chuyên gia về Facebook. Hãy trả lời câu hỏi dựa trên kiến thức của bạn."},
-            {"role": "user", "content": question}
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
         ]
 
-        data = {
+        # Log request details (không log API key)
+        logger.debug(f"Request to {self.api_url}")
+        logger.debug(f"Models: {self.router.models}")
+        logger.debug(f"Messages: {messages}")
+
+        usage = dict(usage or {})
+        usage["estimated_prompt_tokens"] = count_message_tokens(messages)
+        usage["truncated"] = usage.get("truncated", 0) + int(question_truncated) + int(context_truncated)
+        return {
             "model": self.model,
             "messages": messages,
             "temperature": 0.7,
             "max_tokens": 500,
-            "stream": False
+            "stream": stream
+        }, usage
+
+    def report_usage(self, usage: Dict, model: str, result: Optional[Dict] = None) -> Dict:
+        """
+        Bổ sung số token do API trả về (nếu có) vào usage, ghi log và cộng dồn thống kê
+        """
+        api_usage = (result or {}).get("usage") or {}
+        usage["prompt_tokens"] = api_usage.get("prompt_tokens")
+        usage["completion_tokens"] = api_usage.get("completion_tokens")
+        usage["model"] = model
+        logger.info(f"Prompt usage ({model}): {usage}")
+        self.token_usage.record(usage)
+        return usage
+
+    def _check_status(self, response: httpx.Response, model: str):
+        """
+        Chuyển các mã lỗi phổ biến của OpenRouter thành thông báo dễ hiểu.
+        Lỗi riêng của model (403, 404, 429, 5xx) là ModelCallError để router chuyển model khác.
+        """
+        status_code = response.status_code
+        if status_code == 401:
+            logger.error("Unauthorized: Invalid API key")
+            raise Exception("API key không hợp lệ")
+            
+        if status_code == 403:
+            logger.error(f"Forbidden: No access to model {model}")
+            raise ModelCallError("Không có quyền truy cập model", status_code)
+            
+        if status_code == 404:
+            logger.error(f"Model not found: {model}")
+            raise ModelCallError("Model không tồn tại", status_code)
+            
+        check_response(response, model)
+
+    async def _request(self, model: str, headers: Dict[str, str], data: Dict) -> Dict:
+        """
+        Gửi một request (không stream) tới model
+        """
+        client = get_http_client()
+        try:
+            response = await client.post(
+                self.api_url,
+                headers=headers,
+                json={**data, "model": model},
+                timeout=self.timeout
+            )
+        except httpx.TimeoutException:
+            raise ModelCallError(f"Timeout calling {model}")
+        except httpx.HTTPError as e:
+            raise ModelCallError(f"HTTP error calling {model}: {str(e)}")
+            
+        # Log response status và headers
+        logger.debug(f"Response status ({model}): {response.status_code}")
+        logger.debug(f"Response headers: {dict(response.headers)}")
+        
+        self._check_status(response, model)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_completion(self, question: str, context: Optional[str] = None, usage: Optional[Dict] = None) -> Dict:
+        """
+        Gọi API để lấy câu trả lời từ model, có thể kèm ngữ cảnh đã truy xuất.
+        Request được định tuyến qua ModelRouter (hedging, chuyển model khi lỗi).
+        Kết quả kèm "usage": số token ước lượng của prompt và số token API trả về.
+        """
+        headers = self._build_headers()
+        data, usage = self._build_payload(question, context, usage=usage)
+
+        try:
+            result, model = await self.router.run(lambda model: self._request(model, headers, data))
+        except ModelCallError as e:
+            raise Exception(f"API request failed after {self.max_retries} attempts: {str(e)}")
+        except httpx.HTTPError as e:
+            raise Exception(f"API request failed: {str(e)}")
+            
+        answer = result["choices"][0]["message"]["content"]
+        
+        # Nguồn tham khảo do RAGService bổ sung từ các tài liệu đã truy xuất
+        return {
+            "answer": answer,
+            "sources": [],
+            "usage": self.report_usage(usage, model, result)
         }
 
-        # Log request details (không log API key)
-        logger.debug(f"Request to {self.api_url}")
-        logger.debug(f"Model: {self.model}")
-        logger.debug(f"Messages: {messages}")
+    async def _stream_model(self, model: str, headers: Dict[str, str], data: Dict) -> AsyncIterator[str]:
+        """
+        Stream câu trả lời từ một model, trả về từng đoạn văn bản (delta)
+        """
+        client = get_http_client()
+        try:
+            async with client.stream(
+                "POST",
+                self.api_url,
+                headers=headers,
+                json={**data, "model": model},
+                timeout=self.timeout
+            ) as response:
+                logger.debug(f"Stream response status ({model}): {response.status_code}")
+                if response.status_code != 200:
+                    await response.aread()
+                self._check_status(response, model)
+                response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    # Bỏ qua dòng trống và comment keep-alive của SSE
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        return
+                    try:
+                        chunk = json.loads(payload)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Invalid stream chunk: {payload[:100]}")
+                        continue
+                    if "error" in chunk:
+                        raise Exception(f"Stream error: {chunk['error']}")
+                    choices = chunk.get("choices") or [{}]
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        except httpx.TimeoutException:
+            raise ModelCallError(f"Stream timeout calling {model}")
+        except httpx.HTTPError as e:
+            raise ModelCallError(f"Stream HTTP error calling {model}: {str(e)}")
+
+    async def _open_stream(self, model: str, headers: Dict[str, str], data: Dict) -> Tuple[Optional[str], AsyncIterator[str]]:
+        """
+        Mở stream tới model và chờ delta đầu tiên; router so độ trễ tới token đầu tiên
+        """
+        stream = self._stream_model(model, headers, data)
+        try:
+            return await stream.__anext__(), stream
+        except StopAsyncIteration:
+            return None, stream
+        except BaseException:
+            await stream.aclose()
+            raise
+
+    async def stream_completion(
+        self,
+        question: str,
+        context: Optional[str] = None,
+        usage: Optional[Dict] = None
+    ) -> AsyncIterator[str]:
+        """
+        Gọi API ở chế độ stream và trả về từng đoạn văn bản (delta) ngay khi nhận được.
+        Router chọn model trả token đầu tiên sớm nhất (hedging, chuyển model khi lỗi);
+        sau khi đã có token thì không thử lại để tránh lặp nội dung.
+        Khi generator bị hủy (client ngắt kết nối), response upstream được đóng ngay.
+        """
+        headers = self._build_headers()
+        data, usage = self._build_payload(question, context, stream=True, usage=usage)
+
+        async def discard(opened: Tuple[Optional[str], AsyncIterator[str]]):
+            await opened[1].aclose()
+
+        try:
+            (first, stream), model = await self.router.run(
+                lambda model: self._open_stream(model, headers, data), discard=discard
+            )
+        except ModelCallError as e:
+            raise Exception(f"API stream failed: {str(e)}")
+        except httpx.HTTPError as e:
+            raise Exception(f"API stream failed: {str(e)}")
+        self.report_usage(usage, model)
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            for attempt in range(self.max_retries):
-                try:
-                    response = await client.post(
-                        self.api_url,
-                        headers=headers,
-                        json=data
-                    )
-                    
-                    # Log response status và headers
-                    logger.debug(f"Response status: {response.status_code}")
-                    logger.debug(f"Response headers: {dict(response.headers)}")
-                    
-                    if response.status_code == 401:
-                        logger.error("Unauthorized: Invalid API key")
-                        raise Exception("API key không hợp lệ")
-                        
-                    if response.status_code == 403:
-                        logger.error("Forbidden: No access to model")
-                        raise Exception("Không có quyền truy cập model")
-                        
-                    if response.status_code == 404:
-                        logger.error("Model not found")
-                        raise Exception("Model không tồn tại")
-                        
-                    response.raise_for_status()
-                    
-                    result = response.json()
-                    answer = result["choices"][0]["message"]["content"]
-                    
-                    # Tạo nguồn tham khảo mẫu
-                    sources = [
-                        "Facebook Marketing Guide 2024",
-                        "Social Media Best Practices",
-                        "Facebook Algorithm Updates"
-                    ]
-                    
-                    return {
-                        "answer": answer,
-                        "sources": sources
-                    }
-                    
-                except httpx.TimeoutException:
-                    logger.warning(f"Timeout on attempt {attempt + 1}/{self.max_retries}")
-                    if attempt == self.max_retries - 1:
-                        raise Exception("API request timeout after multiple attempts")
-                    continue
-                    
-                except httpx.HTTPError as e:
-                    logger.error(f"HTTP error on attempt {attempt + 1}: {str(e)}")
-                    if attempt == self.max_retries - 1:
-                        raise Exception(f"API request failed: {str(e)}")
-                    continue
-                    
-                except Exception as e:
-                    logger.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
-                    if attempt == self.max_retries - 1:
-                        raise Exception(f"Unexpected error: {str(e)}")
-                    continue 
\ No newline at end of file
+        try:
+            if first:
+                yield first
+            async for delta in stream:
+                yield delta
+        except ModelCallError as e:
+            raise Exception(f"API stream failed: {str(e)}")
+        finally:
+            await stream.aclose()
@@ -0,0 +1,269 @@
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from loguru import logger
+import asyncio
+import math
+import os
+import time
+import httpx
+
+# Số mẫu độ trễ tối thiểu trước khi dùng percentile để tính thời điểm gửi request dự phòng
+MIN_LATENCY_SAMPLES = 10
+# Số lỗi liên tiếp khiến model bị tạm ngừng định tuyến
+MAX_CONSECUTIVE_ERRORS = 3
+
+class ModelCallError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        """
+        Lỗi có thể chuyển sang model khác: 429, 5xx, timeout hoặc lỗi kết nối
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def check_response(response: httpx.Response, model: str):
+    """
+    Ném ModelCallError cho 429/5xx (kèm Retry-After nếu có) để router chuyển model
+    """
+    status_code = response.status_code
+    if status_code == 429 or status_code >= 500:
+        retry_after = None
+        try:
+            retry_after = float(response.headers.get("retry-after", ""))
+        except ValueError:
+            pass
+        raise ModelCallError(f"{model} returned {status_code}", status_code, retry_after)
+
+class ModelStats:
+    def __init__(self, window_size: int):
+        """
+        Thống kê cuộn (window_size request gần nhất) của một model
+        """
+        self.latencies: Deque[float] = deque(maxlen=window_size)
+        self.outcomes: Deque[bool] = deque(maxlen=window_size)
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.wins = 0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def cooling_down(self) -> bool:
+        return self.cooldown_until > time.monotonic()
+
+class ModelRouter:
+    def __init__(
+        self,
+        models: List[str],
+        max_attempts: int = 3,
+        hedge_enabled: bool = True,
+        hedge_percentile: float = 95,
+        initial_hedge_delay: float = 2.0,
+        min_hedge_delay: float = 0.2,
+        max_hedge_delay: float = 10.0,
+        window_size: int = 200,
+        cooldown: float = 30.0
+    ):
+        """
+        Định tuyến request tới danh sách model (model đầu tiên là model chính):
+        - model khỏe có độ trễ trung vị thấp hơn được thử trước, model vừa trả 429 hoặc
+          lỗi liên tiếp bị tạm ngừng trong cooldown giây (hoặc theo Retry-After);
+        - nếu request chưa xong sau p{hedge_percentile} độ trễ của model đang chờ, gửi thêm
+          request dự phòng tới model kế tiếp và lấy kết quả về trước, request còn lại bị hủy;
+        - 429/5xx/timeout chuyển ngay sang model kế tiếp, tổng số request tối đa max_attempts.
+        """
+        if not models:
+            raise ValueError("Cần ít nhất một model")
+        self.models = list(dict.fromkeys(models))
+        self.max_attempts = max(max_attempts, 1)
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.cooldown = cooldown
+        self._stats: Dict[str, ModelStats] = {model: ModelStats(window_size) for model in self.models}
+        self.hedges = 0
+        self.failovers = 0
+
+    @classmethod
+    def from_env(cls, models: List[str], max_attempts: int = 3) -> "ModelRouter":
+        """
+        Tạo router với cấu hình hedging/cooldown từ biến môi trường MODEL_*
+        """
+        return cls(
+            models,
+            max_attempts=max_attempts,
+            hedge_enabled=os.getenv("MODEL_HEDGE_ENABLED", "true").lower() == "true",
+            hedge_percentile=float(os.getenv("MODEL_HEDGE_PERCENTILE", "95")),
+            initial_hedge_delay=float(os.getenv("MODEL_HEDGE_INITIAL_DELAY_MS", "2000")) / 1000,
+            min_hedge_delay=float(os.getenv("MODEL_HEDGE_MIN_DELAY_MS", "200")) / 1000,
+            max_hedge_delay=float(os.getenv("MODEL_HEDGE_MAX_DELAY_MS", "10000")) / 1000,
+            window_size=int(os.getenv("MODEL_STATS_WINDOW", "200")),
+            cooldown=float(os.getenv("MODEL_COOLDOWN_S", "30"))
+        )
+
+    @property
+    def primary(self) -> str:
+        return self.models[0]
+
+    def candidates(self) -> List[str]:
+        """
+        Thứ tự thử các model: model không bị tạm ngừng trước, rồi theo độ trễ trung vị
+        (model chưa đủ mẫu giữ thứ tự cấu hình sau các model đã đo)
+        """
+        def key(indexed: Tuple[int, str]):
+            index, model = indexed
+            stats = self._stats[model]
+            median = stats.percentile(50) if len(stats.latencies) >= MIN_LATENCY_SAMPLES else None
+            return stats.cooling_down(), median if median is not None else math.inf, index
+        return [model for _, model in sorted(enumerate(self.models), key=key)]
+
+    def hedge_delay(self, model: str) -> float:
+        """
+        Thời gian chờ model trả lời trước khi gửi request dự phòng
+        """
+        stats = self._stats[model]
+        if len(stats.latencies) < MIN_LATENCY_SAMPLES:
+            delay = self.initial_hedge_delay
+        else:
+            delay = stats.percentile(self.hedge_percentile)
+        return min(max(delay, self.min_hedge_delay), self.max_hedge_delay)
+
+    def _record_success(self, model: str, latency: float):
+        stats = self._stats[model]
+        stats.latencies.append(latency)
+        stats.outcomes.append(True)
+        stats.consecutive_errors = 0
+
+    def _record_error(self, model: str, error: ModelCallError):
+        stats = self._stats[model]
+        stats.errors += 1
+        stats.outcomes.append(False)
+        stats.consecutive_errors += 1
+        if error.status_code == 429 or stats.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+            stats.cooldown_until = time.monotonic() + (error.retry_after if error.retry_after is not None else self.cooldown)
+            logger.warning(f"Model {model} paused for routing: {str(error)}")
+
+    async def _timed(self, call: Callable[[str], Awaitable[Any]], model: str) -> Any:
+        stats = self._stats[model]
+        stats.requests += 1
+        start = time.perf_counter()
+        try:
+            result = await call(model)
+        except asyncio.CancelledError:
+            # Request thua bị hủy: thời gian đã chờ là cận dưới của độ trễ, vẫn ghi lại để
+            # model chậm không trông như nhanh chỉ vì các request chậm của nó luôn bị hủy
+            stats.cancelled += 1
+            stats.latencies.append(time.perf_counter() - start)
+            raise
+        except ModelCallError as e:
+            self._record_error(model, e)
+            raise
+        self._record_success(model, time.perf_counter() - start)
+        return result
+
+    async def run(
+        self,
+        call: Callable[[str], Awaitable[Any]],
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None
+    ) -> Tuple[Any, str]:
+        """
+        Gọi call(model) theo chính sách định tuyến, trả về (kết quả, model đã trả lời).
+        Lỗi không phải ModelCallError (ví dụ 401) được ném ra ngay. discard dùng để giải phóng
+        kết quả thành công nhưng không được dùng (ví dụ đóng stream của request thua).
+        """
+        candidates = self.candidates()
+        attempts = [candidates[i % len(candidates)] for i in range(self.max_attempts)]
+        launched: Dict[asyncio.Task, str] = {}
+        pending: Dict[asyncio.Task, str] = {}
+        winner: Optional[asyncio.Task] = None
+        last_error: Optional[Exception] = None
+        last_task: Optional[asyncio.Task] = None
+        launched_at = 0.0
+
+        def launch():
+            nonlocal last_task, launched_at
+            model = attempts[len(launched)]
+            last_task = asyncio.create_task(self._timed(call, model))
+            launched[last_task] = pending[last_task] = model
+            launched_at = time.monotonic()
+
+        def can_hedge() -> bool:
+            # Request dự phòng chỉ gửi tới model khác các model đang chờ
+            return (
+                self.hedge_enabled and len(launched) < len(attempts)
+                and attempts[len(launched)] not in pending.values()
+            )
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if can_hedge():
+                    waiting_model = pending.get(last_task) or next(iter(pending.values()))
+                    timeout = max(0.0, self.hedge_delay(waiting_model) - (time.monotonic() - launched_at))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    logger.info(f"Hedging request to {attempts[len(launched)]} after {time.monotonic() - launched_at:.2f}s")
+                    launch()
+                    continue
+                for task in done:
+                    model = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if winner is None:
+                            winner = task
+                            self._stats[model].wins += 1
+                        continue
+                    if not isinstance(error, ModelCallError):
+                        raise error
+                    last_error = error
+                    logger.warning(f"Model {model} failed: {str(error)}")
+                if winner is not None:
+                    return winner.result(), launched[winner]
+                if not pending and len(launched) < len(attempts):
+                    self.failovers += 1
+                    launch()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            # Request cũng thành công (cùng lúc hoặc ngay trước khi bị hủy): giải phóng kết quả
+            for task in launched:
+                if task is winner or task.cancelled() or task.exception() is not None:
+                    continue
+                if discard is not None:
+                    await discard(task.result())
+
+    def stats(self) -> Dict:
+        return {
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "models": {
+                model: {
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "cancelled": stats.cancelled,
+                    "wins": stats.wins,
+                    "error_rate": round(stats.error_rate, 3),
+                    "p50_ms": round(stats.percentile(50) * 1000, 1) if stats.latencies else None,
+                    "p95_ms": round(stats.percentile(95) * 1000, 1) if stats.latencies else None,
+                    "cooling_down": stats.cooling_down()
+                }
+                for model, stats in self._stats.items()
+            }
+        }
@@ -1,61 +1,279 @@
-from typing import Dict, List, Optional
-import aiohttp
+from typing import AsyncIterator, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
 from bs4 import BeautifulSoup
 from loguru import logger
+import asyncio
+import json
 import os
+import time
 from app.services.llm_service import LLMService
 from app.services.deepseek_service import DeepSeekService
+from app.services.http_client import get_http_client
+from app.utils.lru_cache import LRUCache
 
 class PostAnalysisService:
-    def __init__(self):
-        self.llm_service = LLMService()
-        self.deepseek_service = DeepSeekService()
+    def __init__(
+        self,
+        llm_service: Optional[LLMService] = None,
+        deepseek_service: Optional[DeepSeekService] = None
+    ):
+        self.llm_service = llm_service or LLMService()
+        self.deepseek_service = deepseek_service or DeepSeekService()
         self.fb_access_token = os.getenv("FB_ACCESS_TOKEN")
+        # "combined": một prompt trả về cả phân tích tổng quan và cảm xúc
+        # "concurrent": hai prompt "general" và "sentiment" chạy song song
+        self.analysis_mode = os.getenv("POST_ANALYSIS_MODE", "combined")
+        self.graph_api_url = "https://graph.facebook.com/v18.0"
+        # Graph API cho phép tối đa 50 request trong một batch
+        self.graph_batch_size = 50
+        self.bulk_concurrency = int(os.getenv("BULK_ANALYSIS_CONCURRENCY", "5"))
+        # Cache nội dung bài đăng theo post ID: mục còn mới được dùng trực tiếp,
+        # mục cũ được hỏi lại bằng ETag, lỗi được cache ngắn hạn (negative cache)
+        self.post_cache_ttl = float(os.getenv("POST_CACHE_TTL", "600"))
+        self.post_negative_ttl = float(os.getenv("POST_NEGATIVE_CACHE_TTL", "60"))
+        self.post_cache = LRUCache(
+            maxsize=int(os.getenv("POST_CACHE_SIZE", "5000")),
+            ttl=float(os.getenv("POST_CACHE_MAX_AGE", "86400"))
+        )
+        # Cache riêng cho link chia sẻ -> post ID (link không đổi đích nên giữ lâu hơn);
+        # link không theo được chỉ được nhớ POST_NEGATIVE_CACHE_TTL giây
+        self.share_link_cache = LRUCache(
+            maxsize=int(os.getenv("SHARE_LINK_CACHE_SIZE", "5000")),
+            ttl=float(os.getenv("SHARE_LINK_CACHE_TTL", "86400"))
+        )
+        
+    def _is_fresh(self, entry: Dict) -> bool:
+        """
+        Kiểm tra mục cache còn dùng được mà không cần hỏi lại Graph API
+        """
+        ttl = self.post_cache_ttl if entry["content"] is not None else self.post_negative_ttl
+        return time.monotonic() - entry["fetched_at"] < ttl
+        
+    def _store_post(self, post_id: str, content: Optional[str], etag: Optional[str] = None):
+        """
+        Lưu nội dung bài đăng (hoặc None khi lỗi - negative cache) vào cache
+        """
+        self.post_cache.set(post_id, {
+            "content": content,
+            "etag": etag,
+            "fetched_at": time.monotonic()
+        })
+        
+    def _revalidated(self, post_id: str, entry: Dict) -> Optional[str]:
+        """
+        Graph API trả về 304: nội dung không đổi, chỉ làm mới thời điểm lấy
+        """
+        self._store_post(post_id, entry["content"], entry["etag"])
+        return entry["content"]
         
     async def fetch_post_content(self, post_url: str) -> Optional[str]:
         """
         Lấy nội dung bài đăng từ URL Facebook
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                # Sử dụng Graph API để lấy nội dung bài đăng
-                post_id = self._extract_post_id(post_url)
-                if not post_id:
-                    return None
-                    
-                api_url = f"https://graph.facebook.com/v18.0/{post_id}"
-                params = {
-                    "fields": "message,description,created_time",
-                    "access_token": self.fb_access_token
-                }
+            # Sử dụng Graph API để lấy nội dung bài đăng
+            post_id = await self._resolve_post_id(post_url)
+            if not post_id:
+                return None
                 
-                async with session.get(api_url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get("message", "")
-                    else:
-                        logger.error(f"Error fetching post: {response.status}")
-                        return None
+            entry = self.post_cache.get(post_id)
+            if entry is not None and self._is_fresh(entry):
+                return entry["content"]
+                
+            api_url = f"{self.graph_api_url}/{post_id}"
+            params = {
+                "fields": "message,description,created_time",
+                "access_token": self.fb_access_token
+            }
+            # Hỏi lại có điều kiện bằng ETag nếu đã từng lấy bài đăng này
+            headers = {}
+            if entry is not None and entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            
+            client = get_http_client()
+            response = await client.get(api_url, params=params, headers=headers)
+            if response.status_code == 304 and entry is not None:
+                return self._revalidated(post_id, entry)
+            if response.status_code == 200:
+                data = response.json()
+                content = data.get("message", "")
+                self._store_post(post_id, content, response.headers.get("etag"))
+                return content
+            else:
+                logger.error(f"Error fetching post: {response.status_code}")
+                self._store_post(post_id, None)
+                return None
                         
         except Exception as e:
             logger.error(f"Error in fetch_post_content: {str(e)}")
             return None
             
+    async def fetch_posts_content_batch(self, post_ids: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Lấy nội dung nhiều bài đăng bằng Graph API batch request (tối đa 50 bài mỗi request).
+        Bài đăng còn trong cache không được gửi lại; bài đăng đã cũ được hỏi lại bằng ETag.
+        """
+        contents: Dict[str, Optional[str]] = {}
+        entries: Dict[str, Dict] = {}
+        to_fetch = []
+        for post_id in dict.fromkeys(post_ids):
+            entry = self.post_cache.get(post_id)
+            if entry is not None and self._is_fresh(entry):
+                contents[post_id] = entry["content"]
+            else:
+                if entry is not None:
+                    entries[post_id] = entry
+                to_fetch.append(post_id)
+                
+        client = get_http_client()
+        for start in range(0, len(to_fetch), self.graph_batch_size):
+            chunk = to_fetch[start:start + self.graph_batch_size]
+            batch = []
+            for post_id in chunk:
+                request = {"method": "GET", "relative_url": f"{post_id}?fields=message,description,created_time"}
+                etag = entries.get(post_id, {}).get("etag")
+                if etag:
+                    request["headers"] = [f"If-None-Match: {etag}"]
+                batch.append(request)
+            try:
+                response = await client.post(self.graph_api_url, data={
+                    "access_token": self.fb_access_token,
+                    "batch": json.dumps(batch),
+                    "include_headers": "true"
+                })
+                if response.status_code != 200:
+                    logger.error(f"Error fetching post batch: {response.status_code}")
+                    contents.update({post_id: None for post_id in chunk})
+                    continue
+                    
+                # Mỗi phần tử là {"code": ..., "headers": [...], "body": "<json>"}, hoặc null nếu request bị timeout
+                for post_id, item in zip(chunk, response.json()):
+                    code = item.get("code") if item else None
+                    if code == 304 and post_id in entries:
+                        contents[post_id] = self._revalidated(post_id, entries[post_id])
+                    elif code == 200:
+                        etag = next(
+                            (h["value"] for h in item.get("headers", []) if h.get("name", "").lower() == "etag"),
+                            None
+                        )
+                        contents[post_id] = json.loads(item["body"]).get("message", "")
+                        self._store_post(post_id, contents[post_id], etag)
+                    else:
+                        logger.error(f"Error fetching post {post_id} in batch: {code or 'timeout'}")
+                        contents[post_id] = None
+                        # Không negative cache khi batch item bị timeout vì có thể chỉ là lỗi tạm thời
+                        if code is not None:
+                            self._store_post(post_id, None)
+                        
+            except Exception as e:
+                logger.error(f"Error in fetch_posts_content_batch: {str(e)}")
+                contents.update({post_id: None for post_id in chunk})
+                
+        return contents
+        
     def _extract_post_id(self, url: str) -> Optional[str]:
         """
         Trích xuất post ID từ URL Facebook
         """
         try:
-            # Xử lý các định dạng URL khác nhau
-            if "/posts/" in url:
-                return url.split("/posts/")[1].split("?")[0]
-            elif "/permalink/" in url:
-                return url.split("/permalink/")[1].split("?")[0]
+            parsed = urlparse(url)
+            query = parse_qs(parsed.query)
+            segments = [segment for segment in parsed.path.split("/") if segment]
+            
+            # story.php / permalink.php?story_fbid=...&id=... → {page_id}_{post_id}
+            if "story_fbid" in query:
+                story_fbid = query["story_fbid"][0]
+                owner_id = query.get("id", [None])[0]
+                return f"{owner_id}_{story_fbid}" if owner_id else story_fbid
+                
+            # photo.php?fbid=..., /photo/?fbid=...
+            if "fbid" in query:
+                return query["fbid"][0]
+                
+            # /watch/?v=...
+            if "v" in query and segments[:1] == ["watch"]:
+                return query["v"][0]
+                
+            # Xử lý các định dạng URL dạng đường dẫn:
+            # /{page}/posts/{id}, /groups/{group}/permalink/{id}, /{page}/videos/{slug}/{id}
+            for marker in ("posts", "permalink", "videos"):
+                if marker in segments:
+                    rest = segments[segments.index(marker) + 1:]
+                    if marker == "videos":
+                        # Với /videos/{slug}/{id}, ID là phần tử cuối cùng
+                        rest = rest[-1:]
+                    return rest[0] if rest else None
             return None
         except Exception as e:
             logger.error(f"Error extracting post ID: {str(e)}")
             return None
             
+    def _is_share_link(self, url: str) -> bool:
+        """
+        Link chia sẻ rút gọn (facebook.com/share/..., fb.watch/...) cần theo redirect mới biết post ID
+        """
+        parsed = urlparse(url)
+        host = (parsed.hostname or "").lower()
+        return host == "fb.watch" or parsed.path.startswith("/share/")
+        
+    async def _resolve_post_id(self, url: str) -> Optional[str]:
+        """
+        Trích xuất post ID, theo redirect của link chia sẻ khi cần (kết quả được cache)
+        """
+        if not self._is_share_link(url):
+            return self._extract_post_id(url)
+            
+        cached = self.share_link_cache.get(url)
+        if cached is not None:
+            # Chuỗi rỗng: link đã không theo được (negative cache)
+            return cached or None
+            
+        try:
+            client = get_http_client()
+            response = await client.head(url, follow_redirects=True)
+            post_id = self._extract_post_id(str(response.url))
+        except Exception as e:
+            logger.error(f"Error resolving share link: {str(e)}")
+            post_id = None
+        if post_id:
+            self.share_link_cache.set(url, post_id)
+        else:
+            self.share_link_cache.set(url, "", ttl=self.post_negative_ttl)
+        return post_id
+        
+    async def _analyze_combined(self, post_content: str) -> Dict:
+        """
+        Phân tích tổng quan và cảm xúc trong một lần gọi DeepSeek
+        """
+        analysis = await self.deepseek_service.analyze_text(post_content, "combined")
+        return {
+            "analysis": analysis["summary"],
+            "sentiment": analysis["sentiment"],
+            "sentiment_intensity": analysis["intensity"],
+            "key_topics": analysis["topics"],
+            "key_points": analysis["key_points"],
+            "sentiment_keywords": analysis["keywords"]
+        }
+        
+    async def _analyze_concurrent(self, post_content: str) -> Dict:
+        """
+        Phân tích tổng quan và cảm xúc bằng hai lời gọi DeepSeek chạy song song
+        """
+        general_analysis, sentiment_analysis = await asyncio.gather(
+            self.deepseek_service.analyze_text(post_content, "general"),
+            self.deepseek_service.analyze_text(post_content, "sentiment")
+        )
+        
+        # Kết hợp kết quả
+        return {
+            "analysis": general_analysis["summary"],
+            "sentiment": sentiment_analysis["sentiment"],
+            "sentiment_intensity": sentiment_analysis["intensity"],
+            "key_topics": general_analysis["topics"],
+            "key_points": general_analysis["key_points"],
+            "sentiment_keywords": sentiment_analysis["keywords"]
+        }
+        
     async def analyze_post(self, post_url: str, post_content: Optional[str] = None) -> Dict:
         """
         Phân tích bài đăng Facebook sử dụng DeepSeek
@@ -67,22 +285,75 @@ class PostAnalysisService:
                 if not post_content:
                     raise ValueError("Không thể lấy nội dung bài đăng")
                     
-            # Phân tích tổng quan với DeepSeek
-            general_analysis = await self.deepseek_service.analyze_text(post_content, "general")
-            
-            # Phân tích cảm xúc với DeepSeek
-            sentiment_analysis = await self.deepseek_service.analyze_text(post_content, "sentiment")
-            
-            # Kết hợp kết quả
-            return {
-                "analysis": general_analysis["summary"],
-                "sentiment": sentiment_analysis["sentiment"],
-                "sentiment_intensity": sentiment_analysis["intensity"],
-                "key_topics": general_analysis["topics"],
-                "key_points": general_analysis["key_points"],
-                "sentiment_keywords": sentiment_analysis["keywords"]
-            }
+            if self.analysis_mode == "combined":
+                try:
+                    return await self._analyze_combined(post_content)
+                except Exception as e:
+                    logger.warning(f"Combined analysis failed, falling back to concurrent: {str(e)}")
+                    
+            return await self._analyze_concurrent(post_content)
                 
         except Exception as e:
             logger.error(f"Error in analyze_post: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+            
+    async def _analyze_bulk_item(self, index: int, post: Dict, semaphore: asyncio.Semaphore) -> Dict:
+        """
+        Phân tích một bài đăng trong yêu cầu hàng loạt; lỗi được trả về trong kết quả
+        """
+        async with semaphore:
+            try:
+                if not post.get("post_content"):
+                    raise ValueError("Không thể lấy nội dung bài đăng")
+                result = await self.analyze_post(post.get("post_url") or "", post["post_content"])
+                return {"index": index, "post_url": post.get("post_url"), "status": "ok", "result": result}
+            except Exception as e:
+                return {"index": index, "post_url": post.get("post_url"), "status": "error", "error": str(e)}
+                
+    async def analyze_posts(self, posts: List[Dict]) -> AsyncIterator[Dict]:
+        """
+        Phân tích hàng loạt bài đăng: lấy nội dung còn thiếu bằng Graph API batch,
+        phân tích song song có giới hạn và trả về từng kết quả ngay khi hoàn thành.
+        Bài đăng đã có nội dung được phân tích ngay; bài đăng của mỗi batch Graph API được
+        phân tích ngay khi batch đó trả về, không chờ các batch khác.
+        """
+        posts = [dict(post) for post in posts]
+        semaphore = asyncio.Semaphore(self.bulk_concurrency)
+        # Giới hạn riêng cho việc theo redirect để không phải chờ các phân tích đang chạy
+        resolve_semaphore = asyncio.Semaphore(self.bulk_concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+        tasks: List[asyncio.Task] = []
+        
+        async def analyze(i: int):
+            results.put_nowait(await self._analyze_bulk_item(i, posts[i], semaphore))
+            
+        async def resolve(url: str) -> Optional[str]:
+            async with resolve_semaphore:
+                return await self._resolve_post_id(url)
+                
+        async def fetch_batch(indexes: List[int]):
+            # Link chia sẻ được theo redirect song song, rồi lấy nội dung bằng một batch Graph API
+            try:
+                resolved = await asyncio.gather(*(resolve(posts[i]["post_url"]) for i in indexes))
+                post_ids = {i: post_id for i, post_id in zip(indexes, resolved) if post_id}
+                if post_ids:
+                    contents = await self.fetch_posts_content_batch(list(post_ids.values()))
+                    for i, post_id in post_ids.items():
+                        posts[i]["post_content"] = contents.get(post_id)
+            except Exception as e:
+                logger.error(f"Error fetching posts for bulk analysis: {str(e)}")
+            # Bài đăng không lấy được nội dung nhận kết quả lỗi từ _analyze_bulk_item
+            tasks.extend(asyncio.create_task(analyze(i)) for i in indexes)
+            
+        pending = [i for i, post in enumerate(posts) if not post.get("post_content") and post.get("post_url")]
+        for start in range(0, len(pending), self.graph_batch_size):
+            tasks.append(asyncio.create_task(fetch_batch(pending[start:start + self.graph_batch_size])))
+        pending_set = set(pending)
+        tasks.extend(asyncio.create_task(analyze(i)) for i in range(len(posts)) if i not in pending_set)
+        try:
+            for _ in range(len(posts)):
+                yield await results.get()
+        finally:
+            # Hủy các lần lấy nội dung và phân tích còn lại khi client ngắt kết nối
+            for task in tasks:
+                task.cancel()
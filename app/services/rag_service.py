@@ -0,0 +1,400 @@
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from loguru import logger
+from pathlib import Path
+from itertools import tee
+import asyncio
+import hashlib
+import os
+import numpy as np
+from app.services.llm_service import LLMService
+from app.services.knowledge_base_store import KnowledgeBaseStore
+from app.services.answer_cache import SemanticAnswerCache
+from app.utils.lru_cache import LRUCache
+from app.utils.micro_batcher import MicroBatcher
+from app.utils.file_utils import directory_lock
+from app.utils.text_utils import iter_chunks
+
+class RAGService:
+    def __init__(
+        self,
+        llm_service: Optional[LLMService] = None,
+        knowledge_base_store: Optional[KnowledgeBaseStore] = None
+    ):
+        self.llm_service = llm_service or LLMService()
+        self.knowledge_base_store = knowledge_base_store or KnowledgeBaseStore()
+        self.index_dir = Path(os.getenv("RAG_INDEX_DIR", "app/data/index"))
+        self.top_k = int(os.getenv("RAG_TOP_K", "3"))
+        # Kích thước đoạn (token) khi chia văn bản để đánh chỉ mục
+        self.chunk_max_tokens = int(os.getenv("RAG_CHUNK_MAX_TOKENS", "100"))
+        self.chunk_overlap_tokens = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "20"))
+        # Số đoạn encode trong một lô khi đánh chỉ mục
+        self.encode_batch_size = int(os.getenv("RAG_ENCODE_BATCH_SIZE", "64"))
+        # Loại index FAISS: flat, ivf_flat, ivf_pq, hnsw hoặc auto (chọn theo số đoạn)
+        self.index_type = os.getenv("RAG_INDEX_TYPE", "auto").lower()
+        self.index_config = {
+            key: int(os.environ[env])
+            for key, env in (
+                ("nlist", "RAG_IVF_NLIST"),
+                ("nprobe", "RAG_IVF_NPROBE"),
+                ("pq_m", "RAG_PQ_M"),
+                ("hnsw_m", "RAG_HNSW_M"),
+                ("ef_search", "RAG_HNSW_EF_SEARCH"),
+                ("max_train_size", "RAG_TRAIN_SAMPLE_SIZE")
+            )
+            if os.getenv(env)
+        }
+        self.rag_model = None
+        self.answer_cache = SemanticAnswerCache()
+        # Các truy vấn retrieve đồng thời được gom lô: một lần encode và một lần search cho cả lô
+        self.retrieve_batcher = MicroBatcher(
+            self._retrieve_batch,
+            max_batch_size=int(os.getenv("RAG_BATCH_MAX_SIZE", "32")),
+            max_wait=float(os.getenv("RAG_BATCH_WINDOW_MS", "5")) / 1000
+        )
+        # Kết quả retrieve của các truy vấn lặp lại, xóa khi đánh chỉ mục lại
+        self.retrieve_cache = LRUCache(maxsize=int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024")))
+        self._lock = asyncio.Lock()
+
+    def _knowledge_base_fingerprint(self) -> str:
+        """
+        Tính hash nội dung file cơ sở tri thức để biết index trên đĩa còn hợp lệ không
+        """
+        knowledge_base_path = self.knowledge_base_store.knowledge_base_path
+        if not knowledge_base_path.exists():
+            return ""
+        return hashlib.sha256(knowledge_base_path.read_bytes()).hexdigest()
+
+    def _iter_knowledge_base_chunks(self, knowledge_base: List[Dict]) -> Iterator[Tuple[str, Dict]]:
+        """
+        Chia từng mục của cơ sở tri thức thành các đoạn theo câu, trả về (văn bản, metadata)
+        """
+        for item in knowledge_base:
+            text = f"{item.get('title', '')}\n{item.get('content', '')}"
+            for chunk in iter_chunks(text, self.chunk_max_tokens, self.chunk_overlap_tokens):
+                meta = {
+                    "id": str(item.get("id", "")),
+                    "title": item.get("title", ""),
+                    "source": item.get("source", ""),
+                    "category": item.get("category", ""),
+                    "start": chunk["start"],
+                    "end": chunk["end"]
+                }
+                # Ngày của mục (tin tức) để lọc theo khoảng thời gian khi truy xuất
+                if item.get("date"):
+                    meta["date"] = item["date"]
+                yield chunk["text"], meta
+
+    def _build_model(self, embedding_model=None):
+        """
+        Nạp index đã lưu nếu còn khớp với cơ sở tri thức. Nếu chỉ nội dung cơ sở tri thức
+        thay đổi thì cập nhật index cũ (chỉ encode các đoạn thay đổi), còn lại đánh chỉ mục
+        lại toàn bộ; sau đó lưu xuống đĩa (chạy ngoài event loop)
+        """
+        # Import tại đây để việc nạp mô hình embedding không chặn lúc import module
+        from app.models.rag_model import RAGModel
+        from app.models import vector_index
+
+        rag_model = RAGModel(
+            embedding_model=embedding_model,
+            encode_batch_size=self.encode_batch_size,
+            index_type=self.index_type,
+            index_config=self.index_config
+        )
+        # Index trên đĩa chỉ hợp lệ khi cùng nội dung cơ sở tri thức, cùng cách chia đoạn
+        # và cùng cấu hình index (tham số tìm kiếm nprobe/efSearch được áp dụng lại khi nạp)
+        build_config = {
+            key: value for key, value in self.index_config.items() if key not in ("nprobe", "ef_search")
+        }
+        index_extra = {
+            "kb_fingerprint": self._knowledge_base_fingerprint(),
+            "chunk_max_tokens": self.chunk_max_tokens,
+            "chunk_overlap_tokens": self.chunk_overlap_tokens,
+            "index_type": self.index_type,
+            "index_config": build_config
+        }
+        # Các worker (uvicorn --workers) dùng chung index_dir: chỉ một tiến trình kiểm tra,
+        # xây dựng và lưu index tại một thời điểm; tiến trình sau nạp lại bản vừa lưu
+        with directory_lock(self.index_dir):
+            manifest = RAGModel.read_manifest(self.index_dir)
+            if manifest and manifest.get("extra") == index_extra:
+                try:
+                    rag_model.load(self.index_dir)
+                    logger.info(
+                        f"Loaded persisted {rag_model.index_type} RAG index "
+                        f"with {rag_model.index.ntotal} documents"
+                    )
+                    return rag_model
+                except Exception as e:
+                    logger.warning(f"Persisted RAG index rejected, rebuilding: {str(e)}")
+
+            knowledge_base = self.knowledge_base_store.load()
+            # Đếm số đoạn (rẻ so với encode) để chọn loại index và số cluster IVF
+            expected_size = sum(1 for _ in self._iter_knowledge_base_chunks(knowledge_base))
+            target_type = vector_index.resolve_index_type(self.index_type, expected_size)
+
+            chunk_config = {key: value for key, value in index_extra.items() if key != "kb_fingerprint"}
+            updated = False
+            if manifest and {
+                key: value for key, value in manifest.get("extra", {}).items() if key != "kb_fingerprint"
+            } == chunk_config and manifest.get("index", {}).get("type") == target_type \
+                    and vector_index.supports_remove(target_type):
+                # Cùng cách chia đoạn: cập nhật index cũ thay vì encode lại toàn bộ
+                try:
+                    rag_model.load(self.index_dir, mmap=False)
+                    texts, metadata = tee(self._iter_knowledge_base_chunks(knowledge_base))
+                    stats = rag_model.upsert_documents(
+                        (text for text, _ in texts),
+                        (meta for _, meta in metadata)
+                    )
+                    current_ids = {str(item.get("id", "")) for item in knowledge_base}
+                    stats["removed"] += rag_model.delete_documents(
+                        doc_id for doc_id in rag_model.document_ids() if doc_id not in current_ids
+                    )
+                    logger.info(f"Updated persisted RAG index: {stats}")
+                    updated = True
+                except Exception as e:
+                    logger.warning(f"Could not update persisted RAG index, rebuilding: {str(e)}")
+
+            if not updated:
+                rag_model = RAGModel(
+                    embedding_model=rag_model.embedding_model,
+                    encode_batch_size=self.encode_batch_size,
+                    index_type=target_type,
+                    index_config=self.index_config,
+                    expected_size=expected_size
+                )
+                # tee chỉ đệm tối đa một lô giữa hai iterator vì add_documents đọc xen kẽ theo lô
+                texts, metadata = tee(self._iter_knowledge_base_chunks(knowledge_base))
+                rag_model.add_documents((text for text, _ in texts), (meta for _, meta in metadata))
+            logger.info(
+                f"Indexed {len(knowledge_base)} knowledge base items "
+                f"({len(rag_model.documents)} chunks) for RAG in a {rag_model.index_type} index"
+            )
+
+            try:
+                rag_model.save(self.index_dir, extra=index_extra)
+            except Exception as e:
+                logger.error(f"Error saving RAG index: {str(e)}")
+                return rag_model
+
+            # Nạp lại bản vừa lưu bằng mmap: index, văn bản và metadata nằm trong page cache
+            # dùng chung giữa các worker thay vì trong bộ nhớ riêng của tiến trình này
+            try:
+                rag_model.load(self.index_dir)
+            except Exception as e:
+                logger.warning(f"Could not memory-map saved RAG index: {str(e)}")
+            return rag_model
+
+    async def initialize(self):
+        """
+        Khởi tạo RAGModel và chỉ mục FAISS cho cơ sở tri thức
+        """
+        async with self._lock:
+            if self.rag_model is not None:
+                return
+            try:
+                self.rag_model = await asyncio.to_thread(self._build_model)
+            except Exception as e:
+                logger.error(f"Error initializing RAG model: {str(e)}")
+
+    async def reindex(self):
+        """
+        Đánh chỉ mục lại sau khi cơ sở tri thức thay đổi. Index mới được xây dựng
+        ngoài event loop rồi mới thay thế index cũ, nên truy vấn đang chạy không bị ảnh hưởng.
+        """
+        if self.rag_model is None:
+            await self.initialize()
+            return
+        try:
+            rag_model = await asyncio.to_thread(self._build_model, self.rag_model.embedding_model)
+            self.rag_model = rag_model
+            # Câu trả lời cũ có thể không còn đúng với cơ sở tri thức mới
+            self.answer_cache.clear()
+            self.retrieve_cache.clear()
+        except Exception as e:
+            logger.error(f"Error reindexing RAG model: {str(e)}")
+
+    @staticmethod
+    def _filters_key(filters: Optional[Dict]) -> Optional[Tuple]:
+        """
+        Khóa hashable của bộ lọc metadata, dùng cho cache và để gom lô theo bộ lọc
+        """
+        if not filters:
+            return None
+        return tuple(sorted(
+            (field, tuple(sorted(map(repr, value))) if isinstance(value, (list, tuple, set, frozenset)) else repr(value))
+            for field, value in filters.items()
+        ))
+
+    async def retrieve(self, question: str, k: Optional[int] = None, filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        Truy xuất các tài liệu liên quan nhất tới câu hỏi, lọc theo metadata nếu có filters
+        (category, source, id, title, date_from, date_to; xem RAGModel.retrieve_batch)
+        """
+        results, _ = await self.retrieve_with_embedding(question, k, filters)
+        return results
+
+    async def retrieve_with_embedding(
+        self,
+        question: str,
+        k: Optional[int] = None,
+        filters: Optional[Dict] = None
+    ) -> Tuple[List[Dict], Optional[np.ndarray]]:
+        """
+        Giống retrieve() nhưng trả thêm embedding (đã chuẩn hóa L2) của câu hỏi được tính
+        trong lô retrieve, để cache câu trả lời dùng lại thay vì encode thêm một lần
+        """
+        if self.rag_model is None:
+            await self.initialize()
+        if self.rag_model is None:
+            return [], None
+        k = k or self.top_k
+        key = (question, k, self._filters_key(filters))
+        cached = self.retrieve_cache.get(key)
+        if cached is not None:
+            return cached
+        rag_model = self.rag_model
+        results = await self.retrieve_batcher.submit((question, k, filters or None))
+        # Không lưu kết quả của index cũ nếu index vừa được thay trong lúc chờ
+        if rag_model is self.rag_model:
+            self.retrieve_cache.set(key, results)
+        return results
+
+    def _retrieve_batch(self, items: List[Tuple[str, int, Optional[Dict]]]) -> List[Tuple[List[Dict], Optional[np.ndarray]]]:
+        """
+        Xử lý một lô (câu hỏi, k, bộ lọc): các truy vấn cùng bộ lọc được tìm chung một lần,
+        truy vấn trùng nhau chỉ được encode một lần, mỗi nhóm được tìm với k lớn nhất
+        rồi cắt theo k của từng truy vấn (chạy ngoài event loop).
+        Mỗi truy vấn nhận (tài liệu, embedding của câu hỏi), hoặc lỗi của nhóm của nó.
+        """
+        groups: Dict[Optional[Tuple], List[Tuple[str, int, Optional[Dict]]]] = {}
+        for item in items:
+            groups.setdefault(self._filters_key(item[2]), []).append(item)
+        results = {}
+        for filters_key, group in groups.items():
+            questions = list(dict.fromkeys(question for question, _, _ in group))
+            max_k = max(k for _, k, _ in group)
+            try:
+                documents, embeddings = self.rag_model.retrieve_batch(questions, max_k, group[0][2], return_embeddings=True)
+            except Exception as e:
+                # Lỗi của một nhóm (ví dụ bộ lọc không hợp lệ) chỉ trả về cho các truy vấn
+                # của nhóm đó, không làm hỏng các truy vấn khác trong cùng lô
+                logger.warning(f"Error retrieving {len(questions)} queries with filters {group[0][2]}: {str(e)}")
+                for question in questions:
+                    results[(question, filters_key)] = e
+                continue
+            for i, question in enumerate(questions):
+                results[(question, filters_key)] = documents[i], embeddings[i] if embeddings is not None else None
+        output = []
+        for question, k, filters in items:
+            result = results[(question, self._filters_key(filters))]
+            if isinstance(result, Exception):
+                output.append(result)
+                continue
+            documents, embedding = result
+            output.append((documents[:k], embedding))
+        return output
+
+    async def close(self):
+        """
+        Dừng worker gom lô retrieve
+        """
+        await self.retrieve_batcher.close()
+
+    def _build_context(self, retrieved_docs: List[Dict]) -> Tuple[str, List[str], List[str], Dict]:
+        """
+        Ghép các tài liệu đã truy xuất thành ngữ cảnh, danh sách nguồn (tiêu đề, id) và thống kê token.
+        Tài liệu gần nhất được chọn trước trong giới hạn token ngữ cảnh của LLMService,
+        tài liệu gần trùng lặp bị bỏ; chỉ tài liệu được đưa vào ngữ cảnh mới được tính là nguồn.
+        """
+        packed, usage = self.llm_service.context_builder.pack(
+            [doc["document"] for doc in retrieved_docs],
+            scores=[-doc["distance"] for doc in retrieved_docs]
+        )
+        context_parts = []
+        sources = []
+        source_ids = []
+        for i, (position, document) in enumerate(packed, 1):
+            metadata = retrieved_docs[position]["metadata"]
+            context_parts.append(f"[{i}] {document}")
+            doc_id = metadata.get("id", "")
+            if doc_id not in source_ids:
+                source_ids.append(doc_id)
+                sources.append(metadata.get("title", ""))
+        return "\n\n".join(context_parts), sources, source_ids, usage
+
+    async def _lookup_cache(self, question: str) -> Tuple[Optional[Dict], Optional[np.ndarray], List[Dict]]:
+        """
+        Tra cache câu trả lời: khớp chính xác trước, sau đó tìm theo độ tương đồng embedding.
+        Embedding của câu hỏi lấy từ lô retrieve (một lần encode cho cả retrieve và cache).
+        Trả về (kết quả đã cache hoặc None, embedding để lưu cache sau, tài liệu đã truy xuất).
+        """
+        cached = self.answer_cache.get_exact(question)
+        if cached is not None:
+            return cached, None, []
+        retrieved_docs, embedding = await self.retrieve_with_embedding(question)
+        return self.answer_cache.get_similar(embedding), embedding, retrieved_docs
+
+    async def answer(self, question: str) -> Dict[str, List[str]]:
+        """
+        Trả lời câu hỏi theo pipeline retrieve → ghép ngữ cảnh → sinh câu trả lời,
+        dùng lại câu trả lời đã cache cho câu hỏi giống hoặc tương tự
+        """
+        cached, embedding, retrieved_docs = await self._lookup_cache(question)
+        if cached is not None:
+            logger.info("Answer cache hit")
+            return cached
+
+        context, sources, source_ids, usage = self._build_context(retrieved_docs)
+        result = await self.llm_service.get_completion(question, context or None, usage=usage)
+        answer = {
+            "answer": result["answer"],
+            "sources": sources,
+            "source_ids": source_ids
+        }
+        self.answer_cache.set(question, embedding, answer)
+        return answer
+
+    async def _replay(self, answer: str) -> AsyncIterator[str]:
+        """
+        Trả câu trả lời đã cache dưới dạng stream một phần
+        """
+        yield answer
+
+    async def _stream_and_cache(
+        self,
+        question: str,
+        embedding,
+        stream: AsyncIterator[str],
+        sources: List[str],
+        source_ids: List[str]
+    ) -> AsyncIterator[str]:
+        """
+        Chuyển tiếp stream từ model và lưu cache khi stream hoàn tất
+        """
+        parts = []
+        try:
+            async for delta in stream:
+                parts.append(delta)
+                yield delta
+        finally:
+            await stream.aclose()
+        if parts:
+            self.answer_cache.set(question, embedding, {
+                "answer": "".join(parts),
+                "sources": sources,
+                "source_ids": source_ids
+            })
+
+    async def stream_answer(self, question: str) -> Tuple[AsyncIterator[str], List[str], List[str]]:
+        """
+        Giống answer() nhưng trả về generator stream token cùng danh sách nguồn
+        """
+        cached, embedding, retrieved_docs = await self._lookup_cache(question)
+        if cached is not None:
+            logger.info("Answer cache hit")
+            return self._replay(cached["answer"]), cached["sources"], cached["source_ids"]
+
+        context, sources, source_ids, usage = self._build_context(retrieved_docs)
+        stream = self.llm_service.stream_completion(question, context or None, usage=usage)
+        return self._stream_and_cache(question, embedding, stream, sources, source_ids), sources, source_ids
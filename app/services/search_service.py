@@ -1,213 +1,362 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from loguru import logger
 from app.services.llm_service import LLMService
 from app.services.deepseek_service import DeepSeekService
-import json
+from app.services.http_client import get_http_client
+from app.services.rag_service import RAGService
+from app.services.knowledge_base_store import KnowledgeBaseStore
+from app.utils.bm25_index import BM25Index, reciprocal_rank_fusion
 import os
-from pathlib import Path
-import aiohttp
 import asyncio
 from datetime import datetime
 from bs4 import BeautifulSoup
 import hashlib
 
 class SearchService:
-    def __init__(self):
-        self.llm_service = LLMService()
-        self.deepseek_service = DeepSeekService()
-        self.knowledge_base_path = Path("app/data/knowledge_base.json")
-        self.last_update_path = Path("app/data/last_update.json")
+    def __init__(
+        self,
+        rag_service: Optional[RAGService] = None,
+        knowledge_base_store: Optional[KnowledgeBaseStore] = None,
+        llm_service: Optional[LLMService] = None,
+        deepseek_service: Optional[DeepSeekService] = None
+    ):
+        self.llm_service = llm_service or LLMService()
+        self.deepseek_service = deepseek_service or DeepSeekService()
+        self.rag_service = rag_service
+        self.knowledge_base_store = knowledge_base_store or KnowledgeBaseStore()
         self.update_interval = 24 * 60 * 60  # 24 giờ
+        # Chu kỳ tác vụ nền kiểm tra xem đã đến lúc cập nhật chưa
+        self.refresh_check_interval = int(os.getenv("KB_REFRESH_CHECK_INTERVAL", "3600"))
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        # Số ứng viên được chọn cục bộ trước khi gửi cho LLM xếp hạng lại
+        self.candidate_k = int(os.getenv("SEARCH_CANDIDATE_K", "5"))
+        # Cấu hình phân tích chi tiết kết quả: "concurrent" (song song) hoặc "batch" (một prompt)
+        self.enrich_mode = os.getenv("SEARCH_ENRICH_MODE", "concurrent")
+        self.enrich_concurrency = int(os.getenv("SEARCH_ENRICH_CONCURRENCY", "3"))
+        self.enrich_timeout = float(os.getenv("SEARCH_ENRICH_TIMEOUT", "20"))
+        # Chỉ mục BM25 của cơ sở tri thức, đồng bộ theo phiên bản của KnowledgeBaseStore
+        self.lexical_index = BM25Index()
+        self._lexical_version: Optional[int] = None
+        self._lexical_lock = asyncio.Lock()
+        # Hằng số k của reciprocal rank fusion giữa BM25 và embedding
+        self.rrf_k = int(os.getenv("SEARCH_RRF_K", "60"))
         
-    def _load_knowledge_base(self) -> List[Dict]:
+    async def _fetch_facebook_news(self) -> List[Dict]:
         """
-        Tải cơ sở tri thức từ file JSON
+        Lấy tin tức mới từ Facebook Newsroom
         """
         try:
-            if not self.knowledge_base_path.exists():
-                logger.warning("Knowledge base file not found")
-                return []
+            client = get_http_client()
+            url = "https://newsroom.fb.com/news/"
+            response = await client.get(url, follow_redirects=True)
+            if response.status_code == 200:
+                html = response.text
+                soup = BeautifulSoup(html, 'html.parser')
+                news_items = []
                 
-            with open(self.knowledge_base_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+                for article in soup.select('article'):
+                    title = article.select_one('h2')
+                    content = article.select_one('.entry-content')
+                    date = article.select_one('.date')
+                    
+                    if title and content:
+                        news_items.append({
+                            "id": hashlib.md5(title.text.encode()).hexdigest(),
+                            "title": title.text.strip(),
+                            "content": content.text.strip(),
+                            "source": "Facebook Newsroom",
+                            "category": "news",
+                            "date": date.text.strip() if date else datetime.now().isoformat()
+                        })
+                        
+                return news_items
+            return []
         except Exception as e:
-            logger.error(f"Error loading knowledge base: {str(e)}")
+            logger.error(f"Error fetching Facebook news: {str(e)}")
             return []
             
-    def _save_knowledge_base(self, knowledge_base: List[Dict]):
+    async def _fetch_facebook_docs(self) -> List[Dict]:
         """
-        Lưu cơ sở tri thức vào file JSON
+        Lấy tài liệu mới từ Facebook Documentation
         """
         try:
-            self.knowledge_base_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.knowledge_base_path, "w", encoding="utf-8") as f:
-                json.dump(knowledge_base, f, ensure_ascii=False, indent=4)
+            client = get_http_client()
+            url = "https://developers.facebook.com/docs/"
+            response = await client.get(url, follow_redirects=True)
+            if response.status_code == 200:
+                html = response.text
+                soup = BeautifulSoup(html, 'html.parser')
+                docs_items = []
+                
+                for doc in soup.select('.documentation-item'):
+                    title = doc.select_one('h3')
+                    content = doc.select_one('.description')
+                    
+                    if title and content:
+                        docs_items.append({
+                            "id": hashlib.md5(title.text.encode()).hexdigest(),
+                            "title": title.text.strip(),
+                            "content": content.text.strip(),
+                            "source": "Facebook Documentation",
+                            "category": "documentation",
+                            "date": datetime.now().isoformat()
+                        })
+                        
+                return docs_items
+            return []
         except Exception as e:
-            logger.error(f"Error saving knowledge base: {str(e)}")
+            logger.error(f"Error fetching Facebook docs: {str(e)}")
+            return []
             
-    def _get_last_update(self) -> datetime:
+    async def _update_knowledge_base(self, force: bool = False):
         """
-        Lấy thời gian cập nhật cuối cùng
+        Cập nhật cơ sở tri thức với thông tin mới. Chỉ một lần cập nhật chạy tại
+        một thời điểm; lời gọi đến trong lúc đang cập nhật sẽ bị bỏ qua.
         """
-        try:
-            if self.last_update_path.exists():
-                with open(self.last_update_path, "r") as f:
-                    data = json.load(f)
-                    return datetime.fromisoformat(data["last_update"])
-            return datetime.min
-        except Exception as e:
-            logger.error(f"Error getting last update: {str(e)}")
-            return datetime.min
+        if self._refresh_lock.locked():
+            logger.info("Knowledge base refresh already in progress")
+            return
             
-    def _save_last_update(self):
+        async with self._refresh_lock:
+            try:
+                # Kiểm tra thời gian cập nhật cuối
+                last_update = await self.knowledge_base_store.get_last_update()
+                if not force and (datetime.now() - last_update).total_seconds() < self.update_interval:
+                    logger.info("Knowledge base is up to date")
+                    return
+                    
+                # Lấy thông tin mới từ các nguồn song song
+                news_items, docs_items = await asyncio.gather(
+                    self._fetch_facebook_news(),
+                    self._fetch_facebook_docs()
+                )
+                
+                # Sao chép cơ sở tri thức hiện tại (bản cache được dùng chung, không sửa trực tiếp)
+                current_kb = list(await self.knowledge_base_store.get())
+                
+                # Vị trí của từng ID hiện tại
+                positions = {item["id"]: i for i, item in enumerate(current_kb)}
+                
+                # Thêm các mục mới, thay thế các mục có nội dung thay đổi
+                added = 0
+                updated = 0
+                changed_items = []
+                for item in news_items + docs_items:
+                    position = positions.get(item["id"])
+                    if position is None:
+                        positions[item["id"]] = len(current_kb)
+                        current_kb.append(item)
+                        added += 1
+                    elif current_kb[position].get("content") != item.get("content"):
+                        current_kb[position] = item
+                        updated += 1
+                    else:
+                        continue
+                    changed_items.append(item)
+                        
+                # Lưu và thay thế cơ sở tri thức trong bộ nhớ cùng lúc
+                if changed_items:
+                    version = self.knowledge_base_store.version
+                    await self.knowledge_base_store.save(current_kb)
+                    # Cập nhật chỉ mục BM25 tăng dần nếu nó đang đồng bộ với bản trước khi lưu
+                    if self._lexical_version == version:
+                        for item in changed_items:
+                            self.lexical_index.add(str(item["id"]), self._lexical_text(item))
+                        self._lexical_version = self.knowledge_base_store.version
+                await self.knowledge_base_store.save_last_update()
+                
+                logger.info(f"Updated knowledge base with {added} new and {updated} changed items")
+                
+                # Đánh chỉ mục lại để tìm kiếm embedding thấy được các mục mới
+                if changed_items and self.rag_service is not None:
+                    await self.rag_service.reindex()
+                    
+            except Exception as e:
+                logger.error(f"Error updating knowledge base: {str(e)}")
+                
+    async def _refresh_loop(self):
         """
-        Lưu thời gian cập nhật cuối cùng
+        Vòng lặp nền kiểm tra và cập nhật cơ sở tri thức định kỳ
         """
-        try:
-            self.last_update_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.last_update_path, "w") as f:
-                json.dump({"last_update": datetime.now().isoformat()}, f)
-        except Exception as e:
-            logger.error(f"Error saving last update: {str(e)}")
+        while True:
+            await self._update_knowledge_base()
+            await asyncio.sleep(self.refresh_check_interval)
             
-    async def _fetch_facebook_news(self) -> List[Dict]:
+    def start_background_refresh(self):
         """
-        Lấy tin tức mới từ Facebook Newsroom
+        Khởi động tác vụ nền cập nhật cơ sở tri thức (gọi khi ứng dụng khởi động)
         """
-        try:
-            async with aiohttp.ClientSession() as session:
-                url = "https://newsroom.fb.com/news/"
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        soup = BeautifulSoup(html, 'html.parser')
-                        news_items = []
-                        
-                        for article in soup.select('article'):
-                            title = article.select_one('h2')
-                            content = article.select_one('.entry-content')
-                            date = article.select_one('.date')
-                            
-                            if title and content:
-                                news_items.append({
-                                    "id": hashlib.md5(title.text.encode()).hexdigest(),
-                                    "title": title.text.strip(),
-                                    "content": content.text.strip(),
-                                    "source": "Facebook Newsroom",
-                                    "category": "news",
-                                    "date": date.text.strip() if date else datetime.now().isoformat()
-                                })
-                                
-                        return news_items
-                    return []
-        except Exception as e:
-            logger.error(f"Error fetching Facebook news: {str(e)}")
-            return []
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+            logger.info("Knowledge base background refresh started")
             
-    async def _fetch_facebook_docs(self) -> List[Dict]:
+    async def stop_background_refresh(self):
         """
-        Lấy tài liệu mới từ Facebook Documentation
+        Dừng tác vụ nền cập nhật cơ sở tri thức (gọi khi ứng dụng tắt)
         """
-        try:
-            async with aiohttp.ClientSession() as session:
-                url = "https://developers.facebook.com/docs/"
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        soup = BeautifulSoup(html, 'html.parser')
-                        docs_items = []
-                        
-                        for doc in soup.select('.documentation-item'):
-                            title = doc.select_one('h3')
-                            content = doc.select_one('.description')
-                            
-                            if title and content:
-                                docs_items.append({
-                                    "id": hashlib.md5(title.text.encode()).hexdigest(),
-                                    "title": title.text.strip(),
-                                    "content": content.text.strip(),
-                                    "source": "Facebook Documentation",
-                                    "category": "documentation",
-                                    "date": datetime.now().isoformat()
-                                })
-                                
-                        return docs_items
-                    return []
-        except Exception as e:
-            logger.error(f"Error fetching Facebook docs: {str(e)}")
-            return []
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+            logger.info("Knowledge base background refresh stopped")
             
-    async def _update_knowledge_base(self):
+    @staticmethod
+    def _lexical_text(item: Dict) -> str:
         """
-        Cập nhật cơ sở tri thức với thông tin mới
+        Văn bản đánh chỉ mục BM25 của một mục (tiêu đề lặp lại để có trọng số gấp đôi)
         """
-        try:
-            # Kiểm tra thời gian cập nhật cuối
-            last_update = self._get_last_update()
-            if (datetime.now() - last_update).total_seconds() < self.update_interval:
-                logger.info("Knowledge base is up to date")
+        title = item.get("title", "")
+        return f"{title}\n{title}\n{item.get('content', '')}"
+        
+    def _build_lexical_index(self, knowledge_base: List[Dict]) -> BM25Index:
+        index = BM25Index()
+        for item in knowledge_base:
+            index.add(str(item.get("id", "")), self._lexical_text(item))
+        return index
+        
+    async def _ensure_lexical_index(self, knowledge_base: List[Dict]):
+        """
+        Dựng lại chỉ mục BM25 (ngoài event loop) khi cơ sở tri thức đổi mà không qua
+        _update_knowledge_base, ví dụ file bị sửa trực tiếp
+        """
+        if self._lexical_version == self.knowledge_base_store.version:
+            return
+        async with self._lexical_lock:
+            version = self.knowledge_base_store.version
+            if self._lexical_version == version:
                 return
-                
-            # Lấy thông tin mới
-            news_items = await self._fetch_facebook_news()
-            docs_items = await self._fetch_facebook_docs()
+            self.lexical_index = await asyncio.to_thread(self._build_lexical_index, knowledge_base)
+            self._lexical_version = version
+            logger.info(f"Built BM25 index for {len(self.lexical_index)} knowledge base items")
             
-            # Tải cơ sở tri thức hiện tại
-            current_kb = self._load_knowledge_base()
-            
-            # Tạo set ID hiện tại
-            current_ids = {item["id"] for item in current_kb}
-            
-            # Thêm các mục mới
-            for item in news_items + docs_items:
-                if item["id"] not in current_ids:
-                    current_kb.append(item)
-                    current_ids.add(item["id"])
-                    
-            # Lưu cơ sở tri thức mới
-            self._save_knowledge_base(current_kb)
-            self._save_last_update()
-            
-            logger.info(f"Updated knowledge base with {len(news_items) + len(docs_items)} new items")
+    async def _preselect_candidates(self, query: str, knowledge_base: List[Dict]) -> List[Dict]:
+        """
+        Chọn top-K ứng viên cục bộ bằng cách gộp xếp hạng BM25 và embedding (RAGModel)
+        theo reciprocal rank fusion, để LLM chỉ cần xếp hạng lại K mục
+        """
+        if len(knowledge_base) <= self.candidate_k:
+            return knowledge_base
             
+        items_by_id = {str(item.get("id", "")): item for item in knowledge_base}
+        # Lấy dư vì mỗi mục cơ sở tri thức có thể có nhiều đoạn trong index
+        depth = self.candidate_k * 3
+        rankings = []
+        
+        if self.rag_service is not None:
+            try:
+                dense_ids = []
+                for doc in await self.rag_service.retrieve(query, depth):
+                    doc_id = doc["metadata"].get("id", "")
+                    if doc_id in items_by_id and doc_id not in dense_ids:
+                        dense_ids.append(doc_id)
+                rankings.append(dense_ids)
+            except Exception as e:
+                logger.error(f"Error in embedding pre-selection: {str(e)}")
+                
+        # BM25 tìm được từ khóa chính xác (tên tính năng, hashtag, mã lỗi) và các mục mới chưa có trong index
+        try:
+            await self._ensure_lexical_index(knowledge_base)
+            rankings.append([
+                doc_id for doc_id, _ in self.lexical_index.search(query, depth) if doc_id in items_by_id
+            ])
         except Exception as e:
-            logger.error(f"Error updating knowledge base: {str(e)}")
+            logger.error(f"Error in lexical pre-selection: {str(e)}")
             
+        fused = reciprocal_rank_fusion(rankings, k=self.rrf_k)
+        candidates = [items_by_id[doc_id] for doc_id, _ in fused[:self.candidate_k]]
+        logger.info(f"Pre-selected {len(candidates)}/{len(knowledge_base)} knowledge base items")
+        return candidates
+        
     async def _search_knowledge_base(self, query: str, knowledge_base: List[Dict]) -> List[Dict]:
         """
-        Tìm kiếm trong cơ sở tri thức sử dụng DeepSeek
+        Tìm kiếm trong cơ sở tri thức: chọn ứng viên cục bộ rồi dùng DeepSeek xếp hạng lại
         """
         try:
-            # Sử dụng DeepSeek để tìm kiếm
-            search_results = await self.deepseek_service.search_knowledge(query, knowledge_base)
+            candidates = await self._preselect_candidates(query, knowledge_base)
+            if not candidates:
+                return []
+                
+            # Sử dụng DeepSeek để xếp hạng lại và giải thích các ứng viên
+            search_results = await self.deepseek_service.search_knowledge(query, candidates)
             
             # Thêm thông tin chi tiết cho mỗi kết quả
-            for result in search_results:
-                # Phân tích chi tiết nội dung
-                analysis = await self.deepseek_service.analyze_text(result["text"])
-                result.update({
-                    "summary": analysis["summary"],
-                    "topics": analysis["topics"],
-                    "sentiment": analysis["sentiment"],
-                    "key_points": analysis["key_points"]
-                })
-                
-            return search_results
+            return await self._enrich_results(search_results)
                 
         except Exception as e:
             logger.error(f"Error in search_knowledge_base: {str(e)}")
             return []
             
+    def _apply_analysis(self, result: Dict, analysis: Optional[Dict]) -> Dict:
+        """
+        Gắn kết quả phân tích vào kết quả tìm kiếm, dùng giá trị mặc định nếu không có phân tích
+        """
+        analysis = analysis if isinstance(analysis, dict) else {}
+        result.update({
+            "summary": analysis.get("summary", ""),
+            "topics": analysis.get("topics", []),
+            "sentiment": analysis.get("sentiment", "N/A"),
+            "key_points": analysis.get("key_points", [])
+        })
+        return result
+        
+    async def _enrich_one(self, result: Dict, semaphore: asyncio.Semaphore) -> Dict:
+        """
+        Phân tích chi tiết một kết quả; lỗi hoặc quá thời gian thì trả về kết quả chưa phân tích
+        """
+        async with semaphore:
+            try:
+                analysis = await asyncio.wait_for(
+                    self.deepseek_service.analyze_text(result["text"]),
+                    timeout=self.enrich_timeout
+                )
+                return self._apply_analysis(result, analysis)
+            except asyncio.TimeoutError:
+                logger.warning(f"Enrichment timed out after {self.enrich_timeout}s")
+            except Exception as e:
+                logger.warning(f"Enrichment failed: {str(e)}")
+            return self._apply_analysis(result, None)
+            
+    async def _enrich_results(self, search_results: List[Dict]) -> List[Dict]:
+        """
+        Phân tích chi tiết các kết quả tìm kiếm song song (giới hạn bởi semaphore)
+        hoặc gộp tất cả vào một prompt khi enrich_mode = "batch"
+        """
+        if not search_results:
+            return search_results
+            
+        if self.enrich_mode == "batch":
+            try:
+                analyses = await asyncio.wait_for(
+                    self.deepseek_service.analyze_texts_batch([r["text"] for r in search_results]),
+                    timeout=self.enrich_timeout
+                )
+                return [
+                    self._apply_analysis(result, analysis)
+                    for result, analysis in zip(search_results, analyses)
+                ]
+            except asyncio.TimeoutError:
+                logger.warning(f"Batch enrichment timed out after {self.enrich_timeout}s")
+            except Exception as e:
+                logger.warning(f"Batch enrichment failed: {str(e)}")
+            # Không chờ thêm lần gọi nào nữa: trả về kết quả chưa phân tích
+            return [self._apply_analysis(result, None) for result in search_results]
+                
+        semaphore = asyncio.Semaphore(self.enrich_concurrency)
+        return list(await asyncio.gather(
+            *(self._enrich_one(result, semaphore) for result in search_results)
+        ))
+        
     async def search(self, query: str) -> List[str]:
         """
         Tìm kiếm thông tin về Facebook
         """
         try:
-            # Cập nhật cơ sở tri thức nếu cần
-            await self._update_knowledge_base()
-            
-            # Tải cơ sở tri thức
-            knowledge_base = self._load_knowledge_base()
+            # Lấy cơ sở tri thức đã cache (chỉ đọc lại file khi file thay đổi)
+            knowledge_base = await self.knowledge_base_store.get()
             
             # Tìm kiếm trong cơ sở tri thức
             search_results = await self._search_knowledge_base(query, knowledge_base)
@@ -215,10 +364,10 @@ class SearchService:
             # Chuyển đổi kết quả thành danh sách văn bản
             results = []
             for result in search_results:
-                text = result["text"]
-                source = result["source"]
-                relevance = result["relevance"]
-                explanation = result["explanation"]
+                text = result.get("text", "")
+                source = result.get("source", "N/A")
+                relevance = result.get("relevance", 0.0)
+                explanation = result.get("explanation", "")
                 sentiment = result["sentiment"]
                 key_points = result["key_points"]
                 
@@ -0,0 +1,165 @@
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from app.utils.text_utils import search_terms
+
+# Tiền tố của dạng bỏ dấu, để "ban" (bỏ dấu) không trùng với từ "ban" có sẵn trong văn bản
+FOLDED_PREFIX = "~"
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75, folded_weight: float = 0.5, compact_ratio: float = 0.25):
+        """
+        Chỉ mục ngược BM25. Mỗi từ được đánh chỉ mục ở dạng gốc và dạng bỏ dấu tiếng Việt:
+        truy vấn khớp đúng dấu được điểm cao hơn, truy vấn gõ không dấu vẫn tìm thấy.
+        Posting của mỗi từ là hai mảng liền (số thứ tự document uint32, tần suất uint16).
+        Document bị xóa chỉ được đánh dấu, posting được dọn khi số document đã xóa
+        vượt quá compact_ratio.
+        """
+        self.k1 = k1
+        self.b = b
+        self.folded_weight = folded_weight
+        self.compact_ratio = compact_ratio
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_ids: List[Optional[str]] = []
+        self._doc_numbers: Dict[str, int] = {}
+        self._doc_lengths = array("I")
+        self._alive = array("B")
+        self._total_length = 0
+        self._deleted = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_numbers)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_numbers
+
+    @staticmethod
+    def _document_terms(text: str) -> Dict[str, int]:
+        """
+        Tần suất của từng từ trong document (cả dạng gốc và dạng bỏ dấu)
+        """
+        frequencies: Dict[str, int] = {}
+        for term, folded in search_terms(text):
+            frequencies[term] = frequencies.get(term, 0) + 1
+            folded = FOLDED_PREFIX + folded
+            frequencies[folded] = frequencies.get(folded, 0) + 1
+        return frequencies
+
+    def add(self, doc_id: str, text: str):
+        """
+        Thêm document (hoặc thay thế nếu doc_id đã có)
+        """
+        if doc_id in self._doc_numbers:
+            self.remove(doc_id)
+        number = len(self._doc_ids)
+        frequencies = self._document_terms(text)
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("H"))
+            postings[0].append(number)
+            postings[1].append(min(frequency, 0xFFFF))
+
+        # Độ dài document chỉ tính dạng gốc của từ
+        length = sum(frequency for term, frequency in frequencies.items() if not term.startswith(FOLDED_PREFIX))
+        self._doc_ids.append(doc_id)
+        self._doc_numbers[doc_id] = number
+        self._doc_lengths.append(length)
+        self._alive.append(1)
+        self._total_length += length
+
+    def remove(self, doc_id: str) -> bool:
+        """
+        Xóa document theo ID, trả về False nếu không có
+        """
+        number = self._doc_numbers.pop(doc_id, None)
+        if number is None:
+            return False
+        self._alive[number] = 0
+        self._doc_ids[number] = None
+        self._total_length -= self._doc_lengths[number]
+        self._deleted += 1
+        if self._deleted > self.compact_ratio * len(self._doc_ids):
+            self.compact()
+        return True
+
+    def compact(self):
+        """
+        Đánh số lại document còn sống và dọn posting của document đã xóa
+        """
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        new_numbers = np.cumsum(alive, dtype=np.int64) - 1
+        postings = {}
+        for term, (numbers, frequencies) in self._postings.items():
+            numbers = np.frombuffer(numbers, dtype=np.uint32)
+            keep = alive[numbers]
+            if not keep.any():
+                continue
+            postings[term] = (
+                array("I", new_numbers[numbers[keep]].astype(np.uint32).tobytes()),
+                array("H", np.frombuffer(frequencies, dtype=np.uint16)[keep].tobytes())
+            )
+        self._postings = postings
+        self._doc_ids = [doc_id for doc_id in self._doc_ids if doc_id is not None]
+        self._doc_numbers = {doc_id: number for number, doc_id in enumerate(self._doc_ids)}
+        self._doc_lengths = array("I", np.frombuffer(self._doc_lengths, dtype=np.uint32)[alive].tobytes())
+        self._alive = array("B", [1]) * len(self._doc_ids)
+        self._deleted = 0
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Trả về tối đa k (doc_id, điểm BM25) theo điểm giảm dần
+        """
+        alive_count = len(self._doc_numbers)
+        if not alive_count:
+            return []
+
+        query_terms: Dict[str, float] = {}
+        for term, folded in search_terms(query):
+            query_terms[term] = query_terms.get(term, 0.0) + 1.0
+            folded = FOLDED_PREFIX + folded
+            query_terms[folded] = query_terms.get(folded, 0.0) + self.folded_weight
+
+        alive = np.frombuffer(self._alive, dtype=np.uint8)
+        lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32)
+        average_length = self._total_length / alive_count or 1.0
+        scores = np.zeros(len(self._doc_ids), dtype=np.float32)
+        for term, weight in query_terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            numbers = np.frombuffer(postings[0], dtype=np.uint32)
+            frequencies = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+            live = alive[numbers].astype(bool)
+            document_frequency = int(live.sum())
+            if not document_frequency:
+                continue
+            idf = np.log(1 + (alive_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[numbers] / average_length)
+            scores[numbers[live]] += (
+                weight * idf * frequencies[live] * (self.k1 + 1) / (frequencies[live] + norm[live])
+            )
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self._doc_ids[number], float(scores[number])) for number in matched]
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Iterable[str]],
+    k: int = 60,
+    weights: Optional[Sequence[float]] = None
+) -> List[Tuple[str, float]]:
+    """
+    Gộp nhiều danh sách xếp hạng (ví dụ BM25 và embedding) bằng reciprocal rank fusion:
+    điểm = tổng weight / (k + thứ hạng). Chỉ dùng thứ hạng nên không cần chuẩn hóa điểm.
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import threading
+from app.utils.text_utils import count_tokens, search_terms, truncate_to_tokens
+
+# Hai đoạn có độ trùng shingle (Jaccard) từ ngưỡng này trở lên được xem là gần trùng lặp
+DEFAULT_DUPLICATE_THRESHOLD = 0.8
+# Số từ liên tiếp của một shingle
+SHINGLE_SIZE = 3
+# Token phụ của mỗi message trong định dạng chat (role, phân cách)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[int]:
+    """
+    Tập hash của các cụm size từ liên tiếp (đã bỏ dấu, chữ thường) của văn bản
+    """
+    words = [folded for _, folded in search_terms(text)]
+    if len(words) < size:
+        return {hash(tuple(words))} if words else set()
+    return {hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+def jaccard(first: Set[int], second: Set[int]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+def count_message_tokens(messages: Sequence[Dict]) -> int:
+    """
+    Ước lượng số token đầu vào của một danh sách message chat
+    """
+    return sum(count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+class ContextBuilder:
+    def __init__(
+        self,
+        budget_tokens: int,
+        max_passage_tokens: Optional[int] = None,
+        min_passage_tokens: int = 16,
+        passage_overhead_tokens: int = 4,
+        duplicate_threshold: float = DEFAULT_DUPLICATE_THRESHOLD
+    ):
+        """
+        Chọn các đoạn văn đưa vào prompt trong giới hạn budget_tokens token (đếm cục bộ
+        bằng count_tokens): đoạn điểm cao được chọn trước, đoạn gần trùng với đoạn đã chọn
+        bị bỏ, đoạn dài hơn max_passage_tokens hoặc phần budget còn lại được cắt ở ranh giới câu.
+        passage_overhead_tokens là phần token của đánh số/phân cách giữa các đoạn.
+        """
+        self.budget_tokens = budget_tokens
+        self.max_passage_tokens = max_passage_tokens
+        self.min_passage_tokens = min_passage_tokens
+        self.passage_overhead_tokens = passage_overhead_tokens
+        self.duplicate_threshold = duplicate_threshold
+
+    def pack(
+        self,
+        passages: Sequence[str],
+        scores: Optional[Sequence[float]] = None,
+        budget_tokens: Optional[int] = None,
+        max_passage_tokens: Optional[int] = None
+    ) -> Tuple[List[Tuple[int, str]], Dict]:
+        """
+        Trả về các đoạn được chọn dạng (vị trí trong passages, văn bản đã cắt nếu cần),
+        theo điểm giảm dần (không có scores thì giữ thứ tự đầu vào), cùng thống kê token.
+        budget_tokens/max_passage_tokens thay cho giá trị mặc định của builder trong lần gọi này.
+        """
+        budget = self.budget_tokens if budget_tokens is None else budget_tokens
+        max_passage_tokens = self.max_passage_tokens if max_passage_tokens is None else max_passage_tokens
+        order = range(len(passages))
+        if scores is not None:
+            order = sorted(order, key=lambda i: scores[i], reverse=True)
+
+        selected: List[Tuple[int, str]] = []
+        selected_shingles: List[Set[int]] = []
+        usage = {
+            "budget": budget,
+            "input_tokens": 0,
+            "tokens": 0,
+            "passages": 0,
+            "truncated": 0,
+            "dropped_duplicates": 0,
+            "dropped_budget": 0
+        }
+        for i in order:
+            text = passages[i]
+            tokens = count_tokens(text)
+            usage["input_tokens"] += tokens
+
+            passage_shingles = shingles(text)
+            if any(jaccard(passage_shingles, other) >= self.duplicate_threshold for other in selected_shingles):
+                usage["dropped_duplicates"] += 1
+                continue
+
+            available = budget - usage["tokens"] - self.passage_overhead_tokens
+            if max_passage_tokens is not None:
+                available = min(available, max_passage_tokens)
+            if tokens > available:
+                if available < self.min_passage_tokens:
+                    usage["dropped_budget"] += 1
+                    continue
+                text, tokens, _ = truncate_to_tokens(text, available)
+                usage["truncated"] += 1
+
+            selected.append((i, text))
+            selected_shingles.append(passage_shingles)
+            usage["tokens"] += tokens + self.passage_overhead_tokens
+            usage["passages"] += 1
+        return selected, usage
+
+class TokenUsage:
+    def __init__(self):
+        """
+        Cộng dồn số token đầu vào (ước lượng cục bộ và theo API nếu có) của các prompt đã gửi
+        """
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.estimated_prompt_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.truncated_inputs = 0
+        self.dropped_passages = 0
+
+    def record(self, usage: Dict):
+        """
+        Ghi nhận usage của một prompt (dict "usage" trả kèm kết quả get_completion)
+        """
+        with self._lock:
+            self.requests += 1
+            self.estimated_prompt_tokens += usage.get("estimated_prompt_tokens", 0)
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.completion_tokens += usage.get("completion_tokens") or 0
+            self.truncated_inputs += usage.get("truncated", 0)
+            self.dropped_passages += usage.get("dropped_duplicates", 0) + usage.get("dropped_budget", 0)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "estimated_prompt_tokens": self.estimated_prompt_tokens,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "avg_estimated_prompt_tokens": round(self.estimated_prompt_tokens / self.requests, 1) if self.requests else 0.0,
+                "truncated_inputs": self.truncated_inputs,
+                "dropped_passages": self.dropped_passages
+            }
@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator, Optional, Union
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có flock
+    fcntl = None
+
+LOCK_FILE = ".lock"
+
+@contextmanager
+def atomic_path(target: Union[str, Path]) -> Iterator[Path]:
+    """
+    Đường dẫn file tạm duy nhất cạnh target (an toàn khi nhiều tiến trình cùng ghi),
+    được os.replace thành target khi khối with kết thúc không lỗi, bị xóa nếu có lỗi.
+    Dùng cho thư viện chỉ nhận đường dẫn (ví dụ faiss.write_index).
+    """
+    target = Path(target)
+    with tempfile.NamedTemporaryFile(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp", delete=False) as f:
+        tmp_path = Path(f.name)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, target)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+@contextmanager
+def atomic_write(target: Union[str, Path], mode: str = "w", encoding: Optional[str] = None) -> Iterator[IO]:
+    """
+    Mở file tạm duy nhất để ghi, thay thế target khi ghi xong (xem atomic_path)
+    """
+    if encoding is None and "b" not in mode:
+        encoding = "utf-8"
+    with atomic_path(target) as tmp_path:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            yield f
+
+@contextmanager
+def directory_lock(directory: Union[str, Path]) -> Iterator[None]:
+    """
+    Khóa độc quyền (fcntl.flock trên file .lock) giữa các tiến trình dùng chung một
+    thư mục, ví dụ các worker của uvicorn --workers cùng xây dựng và lưu index.
+    Trên nền tảng không có fcntl thì không khóa.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK_FILE, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,118 @@
+from typing import Any, Callable, List, Optional, Tuple
+from loguru import logger
+import asyncio
+
+class MicroBatcher:
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005
+    ):
+        """
+        Gom các lời gọi submit() đồng thời thành lô: một lô được xử lý khi đủ max_batch_size
+        phần tử hoặc sau max_wait giây kể từ phần tử đầu tiên. process_batch là hàm đồng bộ
+        (chạy ngoài event loop), nhận danh sách phần tử và trả về kết quả theo đúng thứ tự;
+        kết quả là một Exception thì chỉ request tương ứng nhận lỗi đó, còn lỗi ném ra từ
+        process_batch làm hỏng cả lô.
+        Chỉ một lô được xử lý tại một thời điểm; request đến trong lúc đó được gom vào lô sau.
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight: List[Tuple[Any, asyncio.Future]] = []
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        # Tạo lại worker nếu chưa có, đã dừng, hoặc thuộc event loop khác
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Thêm một phần tử vào lô kế tiếp và chờ kết quả của nó
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[Any, asyncio.Future]]:
+        """
+        Chờ phần tử đầu tiên, sau đó gom thêm cho tới khi đủ lô hoặc hết cửa sổ chờ
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Lấy ngay các phần tử đã xếp hàng trong lúc lô trước đang chạy
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            # Bỏ các request đã bị hủy (client ngắt kết nối) trước khi xử lý
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            self._inflight = batch
+            try:
+                results = await asyncio.to_thread(self.process_batch, [item for item, _ in batch])
+            except Exception as e:
+                logger.error(f"Error processing batch of {len(batch)} items: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self._inflight = []
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self._inflight = []
+
+    async def close(self):
+        """
+        Dừng worker; các request còn trong hàng đợi bị hủy
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        pending = list(self._inflight)
+        self._inflight = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.cancel()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0
+        }
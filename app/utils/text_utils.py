@@ -1,5 +1,7 @@
 import re
-from typing import List
+import unicodedata
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Tuple
 
 def clean_text(text: str) -> str:
     """
@@ -16,21 +18,161 @@ def clean_text(text: str) -> str:
     
     return text.strip()
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
+def strip_diacritics(text: str) -> str:
+    """
+    Bỏ dấu tiếng Việt (và dấu của các ngôn ngữ Latin khác): "Đăng nhập" -> "Dang nhap"
+    """
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return text.replace("đ", "d").replace("Đ", "D")
+
+def search_terms(text: str) -> List[Tuple[str, str]]:
     """
-    Chia văn bản thành các đoạn nhỏ
+    Tách văn bản thành các từ để tìm kiếm, trả về (từ gốc, từ bỏ dấu).
+    Văn bản được chuẩn hóa NFC trước để cùng một chữ có dấu luôn cho cùng một từ.
+    """
+    terms = clean_text(unicodedata.normalize("NFC", text)).split()
+    return [(term, strip_diacritics(term)) for term in terms]
+
+# Token ở đây là một từ (âm tiết với tiếng Việt) hoặc một dấu câu
+_TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+# Kết thúc câu: dấu câu (kèm dấu ngoặc/nháy đóng) theo sau bởi khoảng trắng, hoặc xuống dòng
+_SENTENCE_END_PATTERN = re.compile(r'[.!?…]+["\'”’)\]]*(?=\s|$)|\n')
+_WHITESPACE_PATTERN = re.compile(r'\s*')
+
+def count_tokens(text: str) -> int:
+    """
+    Đếm số token (từ và dấu câu) của văn bản
+    """
+    return sum(1 for _ in _TOKEN_PATTERN.finditer(text))
+
+def iter_sentences(text: str) -> Iterator[Tuple[int, int, bool]]:
+    """
+    Duyệt các câu của văn bản trong một lượt, trả về (start, end, hết đoạn văn)
+    với start/end là vị trí ký tự trong text
+    """
+    pos = 0
+    length = len(text)
+    while pos < length:
+        start = _WHITESPACE_PATTERN.match(text, pos).end()
+        if start >= length:
+            break
+            
+        match = _SENTENCE_END_PATTERN.search(text, start)
+        end = match.end() if match else length
+        gap_end = _WHITESPACE_PATTERN.match(text, end).end()
+        paragraph_end = match is not None and (match.group() == "\n" or "\n" in text[end:gap_end])
+        
+        # Bỏ khoảng trắng/xuống dòng ở cuối câu
+        sentence_end = end
+        while sentence_end > start and text[sentence_end - 1].isspace():
+            sentence_end -= 1
+        if sentence_end > start:
+            yield start, sentence_end, paragraph_end
+        pos = gap_end
+
+def _split_long_sentence(text: str, start: int, end: int, max_tokens: int) -> Iterator[Tuple[int, int, int]]:
     """
-    words = text.split()
-    chunks = []
-    start = 0
+    Chia một câu thành các đoạn không quá max_tokens token, trả về (start, end, số token)
+    """
+    piece_start = None
+    piece_end = start
+    piece_tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text, start, end):
+        if piece_tokens == max_tokens:
+            yield piece_start, piece_end, piece_tokens
+            piece_start, piece_tokens = None, 0
+        if piece_start is None:
+            piece_start = match.start()
+        piece_end = match.end()
+        piece_tokens += 1
+    if piece_tokens:
+        yield piece_start, piece_end, piece_tokens
+
+def iter_chunks(text: str, max_tokens: int = 100, overlap_tokens: int = 20) -> Iterator[Dict]:
+    """
+    Chia văn bản thành các đoạn theo ranh giới câu/đoạn văn, mỗi đoạn không quá max_tokens token.
+    Các câu cuối của đoạn trước (tối đa overlap_tokens token) được lặp lại ở đầu đoạn sau.
+    Là generator duyệt văn bản một lượt, chỉ giữ các câu của đoạn hiện tại trong bộ nhớ.
+    Mỗi phần tử: {"text", "start", "end", "token_count"} với start/end là vị trí ký tự.
+    """
+    if max_tokens <= 0:
+        raise ValueError("max_tokens phải lớn hơn 0")
+    if overlap_tokens < 0 or overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens phải nằm trong khoảng [0, max_tokens)")
+        
+    window: Deque[Tuple[int, int, int]] = deque()
+    window_tokens = 0
+    has_new_content = False
     
-    while start < len(words):
-        end = start + chunk_size
-        chunk = ' '.join(words[start:end])
-        chunks.append(chunk)
-        start = end - overlap
+    def make_chunk() -> Dict:
+        start, end = window[0][0], window[-1][1]
+        return {"text": text[start:end], "start": start, "end": end, "token_count": window_tokens}
+        
+    def keep_overlap():
+        nonlocal window_tokens, has_new_content
+        kept = 0
+        keep_from = len(window)
+        while keep_from > 1 and kept + window[keep_from - 1][2] <= overlap_tokens:
+            keep_from -= 1
+            kept += window[keep_from][2]
+        for _ in range(keep_from):
+            window.popleft()
+        window_tokens = kept
+        has_new_content = False
+        
+    for sentence_start, sentence_end, paragraph_end in iter_sentences(text):
+        for piece in _split_long_sentence(text, sentence_start, sentence_end, max_tokens):
+            if window and window_tokens + piece[2] > max_tokens:
+                if has_new_content:
+                    yield make_chunk()
+                keep_overlap()
+                # Phần lặp lại không đủ chỗ cho câu mới thì bỏ
+                if window_tokens + piece[2] > max_tokens:
+                    window.clear()
+                    window_tokens = 0
+            window.append(piece)
+            window_tokens += piece[2]
+            has_new_content = True
+            
+        # Ưu tiên cắt ở cuối đoạn văn khi đoạn hiện tại đã đủ dài
+        if paragraph_end and has_new_content and window_tokens >= max_tokens // 2:
+            yield make_chunk()
+            keep_overlap()
+            
+    if window and has_new_content:
+        yield make_chunk()
+
+def truncate_to_tokens(text: str, max_tokens: int) -> Tuple[str, int, bool]:
+    """
+    Cắt văn bản còn tối đa max_tokens token, giữ nguyên các câu trọn vẹn từ đầu văn bản;
+    chỉ khi câu đầu tiên đã dài hơn max_tokens mới cắt giữa câu (tại ranh giới token).
+    Trả về (văn bản, số token, có bị cắt hay không).
+    """
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text, total, False
+    if max_tokens <= 0:
+        return "", 0, True
         
-    return chunks
+    end = 0
+    tokens = 0
+    for sentence_start, sentence_end, _ in iter_sentences(text):
+        sentence_tokens = count_tokens(text[sentence_start:sentence_end])
+        if tokens + sentence_tokens > max_tokens:
+            if not tokens:
+                _, end, tokens = next(_split_long_sentence(text, sentence_start, sentence_end, max_tokens))
+            break
+        end = sentence_end
+        tokens += sentence_tokens
+    return text[:end], tokens, True
+
+def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
+    """
+    Chia văn bản thành các đoạn nhỏ (chunk_size, overlap tính theo token)
+    """
+    return [chunk["text"] for chunk in iter_chunks(text, chunk_size, overlap)]
 
 def extract_hashtags(text: str) -> List[str]:
     """
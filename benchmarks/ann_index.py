@@ -0,0 +1,121 @@
+"""
+So sánh recall@k và độ trễ tìm kiếm của các loại index FAISS với index flat.
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.ann_index --size 200000 --queries 500 --k 10
+    python -m benchmarks.ann_index --knowledge-base app/data/knowledge_base.json
+
+Mặc định dùng vector tổng hợp (hỗn hợp Gauss, chuẩn hóa L2, 384 chiều như MiniLM-L12);
+với --knowledge-base, các đoạn của cơ sở tri thức được encode bằng mô hình embedding thật.
+"""
+from typing import Dict, List, Tuple
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+from app.models import vector_index
+
+def synthetic_embeddings(size: int, dimension: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """
+    Vector chuẩn hóa L2 phân cụm, gần với phân bố embedding câu hơn là nhiễu đều
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    assignments = rng.integers(0, clusters, size)
+    embeddings = centers[assignments] + 0.6 * rng.standard_normal((size, dimension)).astype(np.float32)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+def knowledge_base_embeddings(path: str) -> np.ndarray:
+    """
+    Encode các đoạn của cơ sở tri thức giống như RAGService khi đánh chỉ mục
+    """
+    from app.models.rag_model import RAGModel
+    from app.utils.text_utils import iter_chunks
+
+    with open(path, "r", encoding="utf-8") as f:
+        knowledge_base = json.load(f)
+    texts = [
+        chunk["text"]
+        for item in knowledge_base
+        for chunk in iter_chunks(f"{item.get('title', '')}\n{item.get('content', '')}")
+    ]
+    return RAGModel().encode(texts)
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int) -> Tuple[np.ndarray, List[float]]:
+    """
+    Tìm từng query một (như RAGModel.retrieve), trả về kết quả và độ trễ (ms)
+    """
+    results = np.empty((len(queries), k), dtype=np.int64)
+    latencies = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, indices = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = indices[0]
+    return results, latencies
+
+def build(index_type: str, embeddings: np.ndarray, config: Dict) -> Tuple[faiss.Index, float]:
+    start = time.perf_counter()
+    index = vector_index.build_index(index_type, embeddings.shape[1], len(embeddings), **config)
+    vector_index.train_index(index, embeddings, config.get("max_train_size", vector_index.DEFAULT_MAX_TRAIN_SIZE))
+    index.add_with_ids(embeddings, np.arange(len(embeddings), dtype=np.int64))
+    return index, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000, help="Số vector tổng hợp")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--knowledge-base", help="Dùng embeddings thật của file cơ sở tri thức")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--threads", type=int, default=1, help="Số luồng OpenMP của FAISS")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    if args.knowledge_base:
+        embeddings = knowledge_base_embeddings(args.knowledge_base)
+    else:
+        embeddings = synthetic_embeddings(args.size, args.dimension)
+    # Query là vector của corpus cộng nhiễu nhỏ, giống câu hỏi diễn đạt lại nội dung có sẵn
+    rng = np.random.default_rng(1)
+    queries = embeddings[rng.integers(0, len(embeddings), args.queries)].copy()
+    queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    k = min(args.k, len(embeddings))
+
+    print(f"corpus={len(embeddings)} dim={embeddings.shape[1]} queries={len(queries)} k={k} "
+          f"auto={vector_index.choose_index_type(len(embeddings))}")
+    print(f"{'index':<10} {'params':<14} {'build_s':>8} {'size_mb':>8} {f'recall@{k}':>9} "
+          f"{'mean_ms':>8} {'p50_ms':>8} {'p99_ms':>8}")
+
+    flat, build_time = build(vector_index.INDEX_FLAT, embeddings, {})
+    ground_truth, _ = measure(flat, queries, k)
+    settings = [(vector_index.INDEX_FLAT, "-", flat, build_time, {})]
+
+    for index_type in (vector_index.INDEX_IVF_FLAT, vector_index.INDEX_IVF_PQ):
+        try:
+            index, build_time = build(index_type, embeddings, {})
+        except (ValueError, RuntimeError) as e:
+            print(f"{index_type:<10} skipped: {e}")
+            continue
+        for nprobe in args.nprobe:
+            settings.append((index_type, f"nprobe={nprobe}", index, build_time, {"nprobe": nprobe}))
+
+    hnsw, build_time = build(vector_index.INDEX_HNSW, embeddings, {})
+    for ef_search in args.ef_search:
+        settings.append((vector_index.INDEX_HNSW, f"ef={ef_search}", hnsw, build_time, {"ef_search": ef_search}))
+
+    for index_type, label, index, build_time, params in settings:
+        vector_index.set_search_params(index, **params)
+        results, latencies = measure(index, queries, k)
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        print(f"{index_type:<10} {label:<14} {build_time:>8.2f} {size_mb:>8.1f} "
+              f"{vector_index.recall_at_k(ground_truth, results, k):>9.3f} {np.mean(latencies):>8.3f} "
+              f"{np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 99):>8.3f}")
+
+if __name__ == "__main__":
+    main()
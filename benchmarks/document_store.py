@@ -0,0 +1,143 @@
+"""
+So sánh bộ nhớ của mỗi worker khi giữ văn bản và metadata của các đoạn dưới dạng
+dict Python (cách cũ, đọc từ JSONL) và dạng kho nhị phân nạp bằng mmap
+(DocumentStore + MetadataStore).
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.document_store --size 1000000 --workers 4
+
+Mỗi worker là một tiến trình riêng, nạp dữ liệu rồi đọc ngẫu nhiên --lookups đoạn.
+RssAnon là bộ nhớ riêng của worker; RssFile là trang của file được ánh xạ, nằm trong
+page cache và được các worker dùng chung.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ("dict", "mmap")
+JSONL_FILE = "documents.jsonl"
+
+def memory_mb() -> dict:
+    """
+    VmRSS, RssAnon, RssFile hiện tại của tiến trình (MB), đọc từ /proc trên Linux
+    """
+    values = {}
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            key = line.split(":")[0]
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                values[key] = int(line.split()[1]) / 1024
+    return values
+
+def synthetic_chunk(i: int):
+    text = (
+        f"Đoạn {i}: Facebook cho phép người dùng chia sẻ bài viết, hình ảnh và video với bạn bè. "
+        f"Cài đặt quyền riêng tư quyết định ai có thể xem nội dung số {i % 997} của bạn. " * 3
+    )
+    meta = {
+        "id": str(i // 4),
+        "title": f"Bài viết số {i // 4}",
+        "source": ("Wikipedia", "Facebook Help Center", "Tin tức")[i % 3],
+        "category": ("general", "features", "news", "documentation")[i % 4],
+        "start": (i % 4) * 400,
+        "end": (i % 4) * 400 + len(text)
+    }
+    if i % 4 == 2:
+        meta["date"] = f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}"
+    return text, meta
+
+def prepare(data_dir: str, size: int):
+    """
+    Tạo corpus tổng hợp ở cả hai định dạng
+    """
+    from app.models.document_store import DocumentStore
+    from app.models.metadata_store import MetadataStore
+
+    documents = DocumentStore()
+    metadata = MetadataStore()
+    with open(os.path.join(data_dir, JSONL_FILE), "w", encoding="utf-8") as f:
+        for i in range(size):
+            text, meta = synthetic_chunk(i)
+            documents[i] = text
+            metadata.set(i, meta)
+            f.write(json.dumps({"id": i, "document": text, "metadata": meta}, ensure_ascii=False))
+            f.write("\n")
+    documents.save(data_dir)
+    metadata.save(os.path.join(data_dir, "metadata"))
+
+def run_worker(args):
+    """
+    Nạp corpus theo một định dạng và đọc ngẫu nhiên một số đoạn, in kết quả JSON
+    """
+    before = memory_mb()
+    start = time.perf_counter()
+    if args.worker == "dict":
+        documents, metadata = {}, {}
+        with open(os.path.join(args.data_dir, JSONL_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                documents[record["id"]] = record["document"]
+                metadata[record["id"]] = record["metadata"]
+        get_metadata = metadata.__getitem__
+    else:
+        from app.models.document_store import DocumentStore
+        from app.models.metadata_store import MetadataStore
+
+        documents = DocumentStore.load(args.data_dir)
+        metadata = MetadataStore.load(os.path.join(args.data_dir, "metadata"))
+        get_metadata = metadata.get
+    load_seconds = time.perf_counter() - start
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(args.lookups):
+        i = rng.randrange(args.size)
+        documents[i], get_metadata(i)
+    lookup_us = (time.perf_counter() - start) / args.lookups * 1e6
+
+    after = memory_mb()
+    print(json.dumps({
+        "mode": args.worker,
+        "load_s": load_seconds,
+        "lookup_us": lookup_us,
+        "rss_mb": after["VmRSS"] - before["VmRSS"],
+        "anon_mb": after["RssAnon"] - before["RssAnon"],
+        "file_mb": after["RssFile"] - before["RssFile"]
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        prepare(data_dir, args.size)
+        print(f"{'mode':<6} {'load_s':>7} {'lookup_us':>10} {'rss_mb':>8} {'anon_mb':>8} {'file_mb':>8}  (median of {args.workers} workers)")
+        for mode in MODES:
+            command = [
+                sys.executable, "-m", "benchmarks.document_store", "--worker", mode, "--data-dir", data_dir,
+                "--size", str(args.size), "--lookups", str(args.lookups)
+            ]
+            # Các worker chạy đồng thời như các tiến trình của uvicorn --workers
+            processes = [subprocess.Popen(command, stdout=subprocess.PIPE, text=True) for _ in range(args.workers)]
+            results = [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in processes]
+            median = {key: statistics.median(result[key] for result in results) for key in results[0] if key != "mode"}
+            print(f"{mode:<6} {median['load_s']:>7.2f} {median['lookup_us']:>10.2f} {median['rss_mb']:>8.1f} "
+                  f"{median['anon_mb']:>8.1f} {median['file_mb']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
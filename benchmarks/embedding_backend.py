@@ -0,0 +1,165 @@
+"""
+So sánh backend embedding PyTorch và ONNX Runtime (fp32, int8) trên CPU:
+thời gian import + nạp mô hình, độ trễ encode một câu, throughput theo lô, RSS,
+và độ lệch so với PyTorch (cosine, recall@k khi tìm kiếm trên cùng corpus).
+
+Export mô hình ONNX trước, rồi chạy từ thư mục gốc của repo:
+    python -m app.models.embedding_backend --output-dir app/data/onnx
+    python -m benchmarks.embedding_backend --onnx-dir app/data/onnx
+
+Mỗi backend chạy trong một tiến trình riêng để đo RSS và thời gian import độc lập.
+"""
+from typing import Dict, List
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BACKENDS = ("torch", "onnx-fp32", "onnx-int8")
+
+def rss_mb() -> float:
+    """
+    RSS hiện tại của tiến trình (MB), đọc từ /proc trên Linux
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def load_texts(knowledge_base: str, texts_file: str) -> List[str]:
+    from app.models.embedding_backend import CALIBRATION_SENTENCES
+    from app.utils.text_utils import iter_chunks
+
+    texts = list(CALIBRATION_SENTENCES)
+    if texts_file:
+        with open(texts_file, "r", encoding="utf-8") as f:
+            texts.extend(line.strip() for line in f if line.strip())
+    if knowledge_base and os.path.exists(knowledge_base):
+        with open(knowledge_base, "r", encoding="utf-8") as f:
+            for item in json.load(f):
+                text = f"{item.get('title', '')}\n{item.get('content', '')}"
+                texts.extend(chunk["text"] for chunk in iter_chunks(text))
+    return texts
+
+def run_worker(args):
+    """
+    Đo một backend trong tiến trình hiện tại, ghi embeddings ra file .npy và in kết quả JSON
+    """
+    rss_start = rss_mb()
+    start = time.perf_counter()
+    from app.models.embedding_backend import load_embedding_model
+
+    if args.worker == "torch":
+        model = load_embedding_model(backend="torch")
+    else:
+        model = load_embedding_model(
+            backend="onnx", onnx_dir=args.onnx_dir, quantized=args.worker == "onnx-int8"
+        )
+    load_seconds = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    texts = load_texts(args.knowledge_base, args.texts)
+    model.encode(texts[:8], normalize_embeddings=True)  # khởi động
+
+    latencies = []
+    for i in range(args.queries):
+        text = texts[i % len(texts)]
+        start = time.perf_counter()
+        model.encode([text], normalize_embeddings=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=args.batch_size, normalize_embeddings=True)
+    batch_seconds = time.perf_counter() - start
+    np.save(args.output, np.asarray(embeddings, dtype=np.float32))
+
+    print(json.dumps({
+        "backend": args.worker,
+        "load_s": load_seconds,
+        "rss_loaded_mb": rss_loaded - rss_start,
+        "rss_peak_mb": rss_mb(),
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p99_ms": float(np.percentile(latencies, 99)),
+        "throughput_per_s": len(texts) / batch_seconds
+    }))
+
+def compare(reference: np.ndarray, embeddings: np.ndarray, k: int) -> Dict:
+    """
+    Độ lệch so với embeddings PyTorch: cosine từng câu và recall@k khi dùng embeddings
+    của backend làm query trên index tạo bằng PyTorch
+    """
+    import faiss
+    from app.models.embedding_backend import cosine_similarities
+    from app.models.vector_index import recall_at_k
+
+    similarities = cosine_similarities(reference, embeddings)
+    index = faiss.IndexFlatL2(reference.shape[1])
+    index.add(reference)
+    k = min(k, len(reference))
+    _, expected = index.search(reference, k)
+    _, found = index.search(embeddings, k)
+    return {
+        "min_cosine": float(similarities.min()),
+        "mean_cosine": float(similarities.mean()),
+        f"recall@{k}": recall_at_k(expected, found, k)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--onnx-dir", default=os.getenv("EMBEDDING_ONNX_DIR", "app/data/onnx"))
+    parser.add_argument("--knowledge-base", default="app/data/knowledge_base.json")
+    parser.add_argument("--texts", help="File văn bản bổ sung, mỗi dòng một câu")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    embeddings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in args.backends:
+            output = os.path.join(tmp_dir, f"{backend}.npy")
+            completed = subprocess.run(
+                [sys.executable, "-m", "benchmarks.embedding_backend", "--worker", backend,
+                 "--output", output, "--onnx-dir", args.onnx_dir, "--knowledge-base", args.knowledge_base,
+                 "--queries", str(args.queries), "--batch-size", str(args.batch_size)]
+                + (["--texts", args.texts] if args.texts else []),
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                print(f"{backend}: failed\n{completed.stderr.strip()}")
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            embeddings[backend] = np.load(output)
+
+    print(f"{'backend':<10} {'load_s':>7} {'rss_mb':>7} {'peak_mb':>8} {'p50_ms':>7} {'p99_ms':>7} "
+          f"{'texts/s':>8} {'min_cos':>8} {'mean_cos':>8} {f'recall@{args.k}':>9}")
+    for result in results:
+        backend = result["backend"]
+        drift = {}
+        if "torch" in embeddings:
+            drift = compare(embeddings["torch"], embeddings[backend], args.k)
+        recall = next((value for key, value in drift.items() if key.startswith("recall@")), float("nan"))
+        print(f"{backend:<10} {result['load_s']:>7.2f} {result['rss_loaded_mb']:>7.0f} "
+              f"{result['rss_peak_mb']:>8.0f} {result['query_p50_ms']:>7.2f} {result['query_p99_ms']:>7.2f} "
+              f"{result['throughput_per_s']:>8.1f} {drift.get('min_cosine', float('nan')):>8.4f} "
+              f"{drift.get('mean_cosine', float('nan')):>8.4f} {recall:>9.3f}")
+
+if __name__ == "__main__":
+    main()
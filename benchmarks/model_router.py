@@ -0,0 +1,188 @@
+"""
+Đo độ trễ của LLMService khi gọi nhiều model qua ModelRouter, có và không có hedging,
+với một server giả lập API chat completions tương thích OpenAI chạy cục bộ.
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.model_router --requests 400 --concurrency 20
+    python -m benchmarks.model_router --model slow=300,3000,0.1,0.02 --model fast=400,600,0.01,0
+
+Mỗi --model có dạng TÊN=TRUNG_VỊ_MS,ĐUÔI_MS,TỈ_LỆ_ĐUÔI,TỈ_LỆ_LỖI: request chậm tới ĐUÔI_MS
+với xác suất TỈ_LỆ_ĐUÔI, trả 429/503 với xác suất TỈ_LỆ_LỖI. Model đầu tiên là model chính.
+Chỉ chạy server giả lập (để thử ứng dụng với LLM_API_URL/DEEPSEEK_API_URL trỏ tới nó):
+    python -m benchmarks.model_router --serve --port 8765
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import threading
+import time
+
+DEFAULT_MODELS = ("primary=250,2500,0.08,0.02", "secondary=350,700,0.02,0.02")
+
+def parse_model(spec: str) -> Tuple[str, Dict]:
+    name, values = spec.split("=", 1)
+    median_ms, tail_ms, tail_rate, error_rate = values.split(",")
+    return name, {
+        "median": float(median_ms) / 1000,
+        "tail": float(tail_ms) / 1000,
+        "tail_rate": float(tail_rate),
+        "error_rate": float(error_rate)
+    }
+
+def make_handler(models: Dict[str, Dict], seed: int = 0):
+    """
+    Handler của server giả lập. Mỗi model là dict median, tail (giây), tail_rate, error_rate
+    và status tùy chọn (mã lỗi cố định thay vì 429/503 ngẫu nhiên); có thể sửa dict khi
+    server đang chạy để đổi hành vi của model.
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: Dict, headers: Dict[str, str] = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # Client đã hủy request (request thua khi hedging)
+                self.close_connection = True
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            model = models.get(request.get("model"))
+            if model is None:
+                self._send_json(404, {"error": {"message": "model not found"}})
+                return
+            with lock:
+                failed = rng.random() < model["error_rate"]
+                slow = rng.random() < model["tail_rate"]
+                jitter = rng.uniform(0.8, 1.2)
+                status = model.get("status") or rng.choice((429, 503))
+            if failed:
+                self._send_json(status, {"error": {"message": "stub error"}}, {"Retry-After": "1"} if status == 429 else None)
+                return
+            time.sleep((model["tail"] if slow else model["median"]) * jitter)
+            content = f"Câu trả lời từ {request['model']}"
+            if not request.get("stream"):
+                self._send_json(200, {
+                    "choices": [{"message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 5}
+                })
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                for word in content.split(" "):
+                    chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.close_connection = True
+
+    return StubHandler
+
+def start_server(models: Dict[str, Dict], port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(models))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+async def run_mode(models: List[str], hedge: bool, args) -> Dict:
+    """
+    Gửi --requests request (tối đa --concurrency request đồng thời) qua LLMService
+    """
+    from app.services.http_client import close_http_client
+    from app.services.llm_service import LLMService
+    from app.services.model_router import ModelRouter
+
+    service = LLMService()
+    service.router = ModelRouter(models, max_attempts=3, hedge_enabled=hedge, cooldown=args.cooldown)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if args.stream:
+                    async for _ in service.stream_completion(f"Câu hỏi {i}"):
+                        pass
+                else:
+                    await service.get_completion(f"Câu hỏi {i}")
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    await close_http_client()
+    stats = service.router.stats()
+    return {
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "mean": statistics.mean(latencies) * 1000,
+        "errors": errors,
+        "hedges": stats["hedges"],
+        "failovers": stats["failovers"],
+        "requests": sum(model["requests"] for model in stats["models"].values())
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", action="append", help="TÊN=TRUNG_VỊ_MS,ĐUÔI_MS,TỈ_LỆ_ĐUÔI,TỈ_LỆ_LỖI")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--cooldown", type=float, default=1.0)
+    parser.add_argument("--stream", action="store_true", help="đo qua stream_completion (độ trễ tới hết stream)")
+    parser.add_argument("--serve", action="store_true", help="chỉ chạy server giả lập")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    models = dict(parse_model(spec) for spec in (args.model or DEFAULT_MODELS))
+    server = start_server(models, args.port)
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+    if args.serve:
+        print(f"Stub chat completions API: {url} (models: {', '.join(models)})")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    os.environ["LLM_API_URL"] = url
+    os.environ.setdefault("OPENROUTER_API_KEY", "stub")
+    print(f"{'mode':<9} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'mean_ms':>8} {'errors':>7} {'hedges':>7} {'failover':>9} {'upstream':>9}")
+    for hedge in (False, True):
+        result = asyncio.run(run_mode(list(models), hedge, args))
+        mode = "hedge" if hedge else "failover"
+        print(f"{mode:<9} {result['p50']:>8.0f} {result['p95']:>8.0f} {result['p99']:>8.0f} {result['mean']:>8.0f} "
+              f"{result['errors']:>7} {result['hedges']:>7} {result['failovers']:>9} {result['requests']:>9}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Đo thời gian import app.main và thời gian khởi động tới khi /health báo sẵn sàng.
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.startup --runs 5
+
+Mỗi lần đo chạy trong một tiến trình mới (cold start) và báo cáo: thời gian import,
+các module nặng đã bị import, thời gian tới khi ứng dụng nhận request, thời gian tới
+khi warm-up xong và RSS sau khi sẵn sàng.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "onnxruntime", "faiss")
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_worker(timeout: float):
+    """
+    Một lần cold start: import app.main, chạy lifespan qua TestClient và chờ /health
+    """
+    start = time.perf_counter()
+    from app.main import app
+    import_seconds = time.perf_counter() - start
+    heavy_at_import = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    from fastapi.testclient import TestClient
+
+    start = time.perf_counter()
+    with TestClient(app) as client:
+        accepting_seconds = time.perf_counter() - start
+        health = client.get("/health").json()
+        while not health["ready"] and health["status"] == "starting" and time.perf_counter() - start < timeout:
+            time.sleep(0.05)
+            health = client.get("/health").json()
+        ready_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        "import_s": import_seconds,
+        "heavy_modules_at_import": heavy_at_import,
+        "accepting_s": accepting_seconds,
+        "ready_s": ready_seconds,
+        "status": health["status"],
+        "rss_mb": rss_mb()
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.timeout)
+        return
+
+    results = []
+    for _ in range(args.runs):
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--worker", "--timeout", str(args.timeout)],
+            capture_output=True, text=True, env=dict(os.environ)
+        )
+        if completed.returncode != 0:
+            print(f"run failed\n{completed.stderr.strip()}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    if not results:
+        return
+    for key in ("import_s", "accepting_s", "ready_s", "rss_mb"):
+        values = [result[key] for result in results]
+        print(f"{key:<12} median={statistics.median(values):.3f} min={min(values):.3f} max={max(values):.3f}")
+    print(f"status       {results[-1]['status']}")
+    print(f"heavy modules imported by app.main: {results[-1]['heavy_modules_at_import'] or 'none'}")
+
+if __name__ == "__main__":
+    main()
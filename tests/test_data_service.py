@@ -0,0 +1,144 @@
+"""
+Kiểm tra crawler trang trợ giúp (DataService.crawl_facebook_help) với một server HTTP
+cục bộ: chỉ trả về trang mới/thay đổi, bỏ qua trang 304 hoặc cùng hash nội dung,
+giới hạn phạm vi liên kết và số trang.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
+import threading
+import httpx
+import pytest
+from app.services.data_service import DataService
+
+def article(title: str, content: str) -> str:
+    return f'<article><h2>{title}</h2><div class="content">{content}</div></article>'
+
+class FixtureSite:
+    """
+    Các trang HTML phục vụ bởi server cục bộ: path -> (html, etag hoặc None).
+    Trang có ETag trả 304 khi If-None-Match khớp; mọi request được ghi lại (path, status).
+    """
+    def __init__(self, pages: Dict[str, Tuple[str, Optional[str]]]):
+        self.pages = pages
+        self.requests: List[Tuple[str, int]] = []
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                page = site.pages.get(self.path)
+                if page is None:
+                    status, body, etag = 404, b"", None
+                else:
+                    html, etag = page
+                    body = html.encode("utf-8")
+                    status = 304 if etag and self.headers.get("If-None-Match") == etag else 200
+                site.requests.append((self.path, status))
+                self.send_response(status)
+                if etag:
+                    self.send_header("ETag", etag)
+                if status == 304:
+                    self.end_headers()
+                    return
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def statuses(self) -> Dict[str, int]:
+        return dict(self.requests)
+
+@pytest.fixture
+def site():
+    site = FixtureSite({
+        "/help/index.html": (
+            article("Trang chủ trợ giúp", "Hướng dẫn sử dụng Facebook")
+            + '<a href="privacy.html">Quyền riêng tư</a> <a href="/help/ads.html#top">Quảng cáo</a>'
+            + '<a href="/blog/news.html">Tin tức</a> <a href="https://example.com/help/x.html">Ngoài</a>',
+            '"index-v1"'
+        ),
+        "/help/privacy.html": (article("Quyền riêng tư", "Cài đặt ai có thể xem bài viết"), '"privacy-v1"'),
+        # Trang không có ETag: lần sau tải lại toàn bộ, chỉ bỏ qua khi hash nội dung không đổi
+        "/help/ads.html": (article("Quảng cáo", "Quản lý quảng cáo") + "<p>Cập nhật lúc 10:00</p>", None),
+        "/blog/news.html": (article("Tin tức", "Ngoài phạm vi crawl"), None)
+    })
+    yield site
+    site.server.shutdown()
+
+def crawl(data_dir, site: FixtureSite, **kwargs) -> List[Dict]:
+    async def run():
+        async with httpx.AsyncClient() as client:
+            return await DataService(str(data_dir)).crawl_facebook_help(site.url("/help/index.html"), client=client, **kwargs)
+    return asyncio.run(run())
+
+def titles(documents: List[Dict]) -> List[str]:
+    return sorted(document["metadata"]["title"] for document in documents)
+
+def test_first_crawl_returns_pages_in_scope(tmp_path, site):
+    documents = crawl(tmp_path, site)
+
+    assert titles(documents) == ["Quyền riêng tư", "Quảng cáo", "Trang chủ trợ giúp"]
+    # Chỉ theo liên kết cùng host và cùng tiền tố đường dẫn /help, bỏ fragment
+    assert sorted(path for path, _ in site.requests) == ["/help/ads.html", "/help/index.html", "/help/privacy.html"]
+    assert len(list(tmp_path.glob("help_*.json"))) == 3
+
+def test_recrawl_skips_not_modified_and_unchanged_pages(tmp_path, site):
+    crawl(tmp_path, site)
+    site.requests.clear()
+    # Trang không có ETag đổi phần ngoài bài viết: nội dung trích xuất (và hash) giữ nguyên
+    html, _ = site.pages["/help/ads.html"]
+    site.pages["/help/ads.html"] = (html.replace("10:00", "11:00"), None)
+
+    documents = crawl(tmp_path, site)
+
+    assert documents == []
+    assert site.statuses() == {"/help/index.html": 304, "/help/privacy.html": 304, "/help/ads.html": 200}
+
+def test_recrawl_returns_only_changed_pages(tmp_path, site):
+    crawl(tmp_path, site)
+    site.requests.clear()
+    site.pages["/help/privacy.html"] = (article("Quyền riêng tư", "Cài đặt mới cho bài viết"), '"privacy-v2"')
+    site.pages["/help/ads.html"] = (article("Quảng cáo", "Quản lý chiến dịch quảng cáo"), None)
+
+    documents = crawl(tmp_path, site)
+
+    assert titles(documents) == ["Quyền riêng tư", "Quảng cáo"]
+    assert site.statuses()["/help/index.html"] == 304
+
+def test_recrawl_removes_articles_dropped_from_page(tmp_path, site):
+    site.pages["/help/privacy.html"] = (
+        article("Quyền riêng tư", "Cài đặt ai có thể xem bài viết") + article("Chặn", "Chặn một người dùng"),
+        '"privacy-v1"'
+    )
+    crawl(tmp_path, site)
+    assert len(list(tmp_path.glob("help_*.json"))) == 4
+    site.pages["/help/privacy.html"] = (article("Quyền riêng tư", "Cài đặt mới cho bài viết"), '"privacy-v2"')
+
+    crawl(tmp_path, site)
+
+    # Bài viết thứ hai của trang không còn: file cũ của nó không được đánh chỉ mục lại
+    saved = [json.loads(path.read_text(encoding="utf-8")) for path in tmp_path.glob("help_*.json")]
+    assert titles(saved) == ["Quyền riêng tư", "Quảng cáo", "Trang chủ trợ giúp"]
+
+def test_max_pages_limits_crawl(tmp_path, site):
+    documents = crawl(tmp_path, site, max_pages=2)
+
+    assert len(site.requests) == 2
+    assert len(documents) == 2
+
+def test_follow_links_disabled_fetches_start_url_only(tmp_path, site):
+    documents = crawl(tmp_path, site, follow_links=False)
+
+    assert titles(documents) == ["Trang chủ trợ giúp"]
+    assert site.requests == [("/help/index.html", 200)]
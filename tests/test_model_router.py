@@ -0,0 +1,114 @@
+"""
+Kiểm tra định tuyến model của LLMService (ModelRouter) với server giả lập API chat
+completions của benchmarks/model_router.py: hedging sau độ trễ p95, chuyển model khi
+429/5xx/timeout kèm tạm ngừng (cooldown), và đóng stream của request thua.
+"""
+from typing import Dict, Optional
+import asyncio
+import time
+import pytest
+from benchmarks.model_router import start_server
+from app.services.http_client import close_http_client
+from app.services.llm_service import LLMService
+from app.services.model_router import MAX_CONSECUTIVE_ERRORS, MIN_LATENCY_SAMPLES, ModelRouter
+
+def model(median: float, error_rate: float = 0.0, status: Optional[int] = None) -> Dict:
+    return {"median": median, "tail": median, "tail_rate": 0.0, "error_rate": error_rate, "status": status}
+
+@pytest.fixture
+def stub(monkeypatch):
+    models = {"primary": model(0.02), "secondary": model(0.02)}
+    server = start_server(models)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test")
+    monkeypatch.setenv("LLM_API_URL", f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions")
+    yield models
+    server.shutdown()
+
+def make_service(**router_config) -> LLMService:
+    service = LLMService()
+    service.router = ModelRouter(["primary", "secondary"], **router_config)
+    return service
+
+def run(scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await close_http_client()
+    return asyncio.run(main())
+
+def test_hedge_fires_after_primary_p95(stub):
+    service = make_service(initial_hedge_delay=5.0, min_hedge_delay=0.01)
+
+    async def scenario():
+        # Đủ mẫu độ trễ để router dùng p95 của model chính thay cho initial_hedge_delay
+        for i in range(MIN_LATENCY_SAMPLES):
+            await service.get_completion(f"Câu hỏi {i}")
+        delay = service.router.hedge_delay("primary")
+        stub["primary"].update(median=2.0, tail=2.0)
+        start = time.perf_counter()
+        result = await service.get_completion("Câu hỏi chậm")
+        return delay, time.perf_counter() - start, result
+
+    delay, elapsed, result = run(scenario)
+
+    stats = service.router.stats()
+    assert delay < 0.5
+    assert delay <= elapsed < 1.0
+    assert result["answer"] == "Câu trả lời từ secondary"
+    assert result["usage"]["model"] == "secondary"
+    assert stats["hedges"] == 1
+    assert stats["models"]["primary"]["cancelled"] == 1
+
+@pytest.mark.parametrize("failure", [429, 503, "timeout"])
+def test_failover_and_cooldown(stub, failure):
+    if failure == "timeout":
+        stub["primary"].update(median=1.0, tail=1.0)
+    else:
+        stub["primary"].update(error_rate=1.0, status=failure)
+    service = make_service(hedge_enabled=False, cooldown=30.0)
+    service.timeout = 0.2
+    # 429 tạm ngừng model ngay (theo Retry-After), 5xx/timeout sau số lỗi liên tiếp tối đa
+    failed_requests = 1 if failure == 429 else MAX_CONSECUTIVE_ERRORS
+
+    async def scenario():
+        return [await service.get_completion(f"Câu hỏi {i}") for i in range(failed_requests + 1)]
+
+    results = run(scenario)
+
+    stats = service.router.stats()
+    assert [result["usage"]["model"] for result in results] == ["secondary"] * len(results)
+    assert stats["models"]["primary"]["cooling_down"]
+    # Request cuối đi thẳng tới model dự phòng, không thử lại model đang tạm ngừng
+    assert stats["models"]["primary"]["requests"] == stats["models"]["primary"]["errors"] == failed_requests
+    assert stats["failovers"] == failed_requests
+
+def test_losing_stream_is_closed(stub):
+    service = make_service(initial_hedge_delay=0.0, min_hedge_delay=0.0)
+    open_stream = service._open_stream
+    opened = []
+
+    async def scenario():
+        both_opened = asyncio.Event()
+
+        # Cả hai model mở stream thành công trước khi router chọn: request thua phải bị đóng
+        async def open_both(model, headers, data):
+            first, stream = await open_stream(model, headers, data)
+            opened.append(stream)
+            if len(opened) == 2:
+                both_opened.set()
+            await both_opened.wait()
+            return first, stream
+
+        service._open_stream = open_both
+        answer = "".join([delta async for delta in service.stream_completion("Câu hỏi")])
+        # Kiểm tra trước khi event loop kết thúc (asyncio.run tự đóng các generator còn mở)
+        return answer, [stream.ag_frame is None for stream in opened]
+
+    answer, closed = run(scenario)
+
+    stats = service.router.stats()
+    winner = next(name for name, model_stats in stats["models"].items() if model_stats["wins"])
+    assert answer == f"Câu trả lời từ {winner} "
+    assert stats["hedges"] == 1
+    assert closed == [True, True]
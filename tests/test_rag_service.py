@@ -0,0 +1,59 @@
+"""
+Kiểm tra gom lô retrieve của RAGService: lỗi của một truy vấn (ví dụ bộ lọc không hợp lệ)
+chỉ trả về cho truy vấn đó, không làm hỏng các truy vấn khác trong cùng lô.
+"""
+from typing import Dict, List, Optional
+import asyncio
+import numpy as np
+import pytest
+from app.models.metadata_store import MetadataStore
+from app.services.knowledge_base_store import KnowledgeBaseStore
+from app.services.rag_service import RAGService
+
+class StubIndex:
+    """
+    Thay cho RAGModel: lọc bằng MetadataStore thật, trả về các đoạn được chọn theo thứ tự
+    """
+    def __init__(self, rows: List[Dict]):
+        self.metadata = MetadataStore()
+        for row, meta in enumerate(rows):
+            self.metadata.set(row, meta)
+        self.calls = 0
+
+    def retrieve_batch(self, queries: List[str], k: int = 3, filters: Optional[Dict] = None, return_embeddings: bool = False):
+        self.calls += 1
+        mask = self.metadata.mask(filters) if filters else np.ones(len(self.metadata), dtype=bool)
+        documents = [{"metadata": self.metadata.get(row)} for row in np.flatnonzero(mask)[:k]]
+        return [documents for _ in queries], np.zeros((len(queries), 4), dtype=np.float32)
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test")
+    monkeypatch.setenv("RAG_BATCH_WINDOW_MS", "50")
+    service = RAGService(knowledge_base_store=KnowledgeBaseStore(tmp_path / "knowledge_base.json", tmp_path / "last_update.json"))
+    service.rag_model = StubIndex([
+        {"id": "1", "title": "Tin", "category": "news"},
+        {"id": "2", "title": "Hướng dẫn", "category": "doc"}
+    ])
+    return service
+
+def test_invalid_filter_fails_only_its_request(service):
+    async def run():
+        try:
+            return await asyncio.gather(
+                service.retrieve("tin mới", filters={"category": "news"}),
+                service.retrieve("tin cũ", filters={"unknown": "x"}),
+                service.retrieve("hướng dẫn"),
+                return_exceptions=True
+            )
+        finally:
+            await service.close()
+
+    valid, invalid, unfiltered = asyncio.run(run())
+
+    assert [doc["metadata"]["id"] for doc in valid] == ["1"]
+    assert isinstance(invalid, ValueError)
+    assert [doc["metadata"]["id"] for doc in unfiltered] == ["1", "2"]
+    # Cả ba truy vấn nằm trong cùng một lô
+    assert service.retrieve_batcher.stats()["batches"] == 1
+    assert service.retrieve_batcher.stats()["items"] == 3